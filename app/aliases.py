@@ -0,0 +1,129 @@
+"""Hardware-ID alias resolution for devices that were factory reset.
+
+Every ``hardware_id_mapping`` row links a device's previous ID to the one it
+reported after a reset. The links form chains (reset twice: A -> B -> C), so
+the resolver keeps them in a union-find with path compression and union by
+size; resolving any ID in a chain costs near-constant time and no SQL. Each
+set is labelled with its canonical ID - the oldest ID in the chain, which
+owns the device's registration, history and commands.
+
+Rows are loaded at startup and applied incrementally: the worker that
+handles a reset links it immediately, and a background task picks up rows
+written by other workers by reading only ids above the last one applied.
+
+A reset alert only extends a chain if it carries the device token issued
+when the original device was registered, and only while the new ID is
+neither a registered device nor part of any chain - checked against this
+resolver by ``factory_reset_alert`` and again by the storage in the
+transaction that writes the mapping.
+"""
+import asyncio
+import os
+
+from .logs import events
+from .storage import storage
+
+ALIAS_SYNC_INTERVAL = float(os.environ.get("GHOSTTRACK_ALIAS_SYNC_INTERVAL", "1"))
+
+
+class HardwareAliases:
+    def __init__(self, storage, sync_interval=ALIAS_SYNC_INTERVAL):
+        self.storage = storage
+        self.sync_interval = sync_interval
+        self.last_id = 0
+        self._parent = {}
+        self._size = {}
+        self._canonical = {}
+        self._task = None
+        self._stats = {"resolves": 0, "aliased": 0, "links": 0, "sync_errors": 0}
+
+    def _find(self, hardware_id):
+        root = hardware_id
+        while self._parent[root] != root:
+            root = self._parent[root]
+        # Path compression - point every ID on the way straight at the root
+        while self._parent[hardware_id] != root:
+            self._parent[hardware_id], hardware_id = root, self._parent[hardware_id]
+        return root
+
+    def resolve(self, hardware_id):
+        """Return the canonical ID for ``hardware_id`` (itself if it has no aliases)"""
+        self._stats["resolves"] += 1
+        if hardware_id not in self._parent:
+            return hardware_id
+        canonical = self._canonical[self._find(hardware_id)]
+        if canonical != hardware_id:
+            self._stats["aliased"] += 1
+        return canonical
+
+    def is_linked(self, hardware_id):
+        """True if ``hardware_id`` is part of any reset chain"""
+        return hardware_id in self._parent
+
+    def link(self, original_id, current_id):
+        """Record that ``original_id`` now reports as ``current_id``"""
+        for hardware_id in (original_id, current_id):
+            if hardware_id not in self._parent:
+                self._parent[hardware_id] = hardware_id
+                self._size[hardware_id] = 1
+                self._canonical[hardware_id] = hardware_id
+
+        a, b = self._find(original_id), self._find(current_id)
+        if a == b:
+            return
+        # The original device's canonical ID survives the merge
+        canonical = self._canonical[a]
+        if self._size[a] < self._size[b]:
+            a, b = b, a
+        self._parent[b] = a
+        self._size[a] += self._size.pop(b)
+        del self._canonical[b]
+        self._canonical[a] = canonical
+        self._stats["links"] += 1
+
+    def _apply(self, rows):
+        for row in rows:
+            self.link(row["original_id"], row["current_id"])
+            self.last_id = max(self.last_id, row["id"])
+
+    async def load(self):
+        """Build the sets from every mapping (startup, before serving requests)"""
+        await self.sync()
+
+    async def sync(self):
+        """Apply mappings written since the last load or sync"""
+        rows = await self.storage.hardware_mappings(self.last_id)
+        self._apply(rows)
+        return len(rows)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                self._stats["sync_errors"] += 1
+                events.error("alias_sync_failed", exc_info=True, error=str(e))
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["ids"] = len(self._parent)
+        stats["devices"] = len(self._canonical)
+        stats["last_id"] = self.last_id
+        stats["running"] = self._task is not None
+        return stats
+
+
+# Process-wide alias resolver
+hardware_aliases = HardwareAliases(storage)
@@ -1,17 +1,64 @@
-from fastapi import FastAPI, HTTPException, Form, Request,status
+from fastapi import FastAPI, HTTPException, Form, Request, Depends, status
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-import sqlite3
 import hashlib
+import hmac
 import jwt
 import os
 import json
-import logging
+import asyncio
+import base64
+import binascii
+
+from .aliases import hardware_aliases
+from .assets import static_assets
+from .auth import TokenCache, DeviceOwners
+from .blobs import photo_store, BlobTooLarge, is_digest, sniff_content_type
+from .cache import MISSING
+from .conditional import device_etag, etag_matches, DashboardGZipMiddleware, CACHE_HEADERS
+from .commands import command_notifier, LONG_POLL_TIMEOUT, LONG_POLL_MAX_TIMEOUT
+from .geo import bbox_around, lng_ranges, rank_by_distance
+from .ingest import checkin_queue
+from .latest import latest_positions
+from .live import location_hub, LIVE_HEARTBEAT_SECONDS
+from .logs import log_pipeline, events
+from .maintenance import maintenance
+from .metrics import metrics, MetricsMiddleware
+from .profiling import query_profiler
+from .registry import stolen_registry
+from .storage import storage, get_storage
+from .track import simplify_track, track_cache, MIN_ZOOM, MAX_ZOOM
+from .wire import decode_checkins
+
+# Log records are queued and written by a background thread
+log_pipeline.install()
+
+# Application lifespan - build the static assets, open the storage backend, load
+# the in-memory state and start the check-in writer, then flush it and close the
+# storage on shutdown
+@asynccontextmanager
+async def lifespan(app):
+    log_pipeline.start()
+    static_assets.build()
+    await init_storage()
+    checkin_queue.start()
+    stolen_registry.start()
+    hardware_aliases.start()
+    yield
+    await hardware_aliases.stop()
+    await stolen_registry.stop()
+    await checkin_queue.stop()
+    await storage.close()
+    log_pipeline.stop()
 
 # Initialize FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+# gzip the dashboard's polling responses (innermost - other routes pass straight through)
+app.add_middleware(DashboardGZipMiddleware)
 
 # Enable CORS for all origins (for development)
 app.add_middleware(
@@ -21,138 +68,46 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database setup function
-def get_db():
-    conn = sqlite3.connect('ghosttrack.db')
-    conn.row_factory = sqlite3.Row
-    return conn
-
-# Create database tables if they don't exist
-def init_db():
-    conn = get_db()
-    # Users table
-    conn.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY,
-        email TEXT UNIQUE,
-        password TEXT
-    )
-    ''')
-    
-    # Locations table
-    conn.execute('''
-    CREATE TABLE IF NOT EXISTS locations (
-        id INTEGER PRIMARY KEY,
-        user_id INTEGER,
-        latitude REAL,
-        longitude REAL,
-        timestamp TEXT,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )
-    ''')
-    
-    # Anti-theft device tracking
-    conn.execute('''
-    CREATE TABLE IF NOT EXISTS antitheft_devices (
-        id INTEGER PRIMARY KEY,
-        user_id INTEGER,
-        hardware_id TEXT UNIQUE,
-        first_seen TEXT,
-        last_seen TEXT,
-        device_info TEXT,
-        is_stolen INTEGER DEFAULT 0,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )
-    ''')
-    
-    # Stolen devices table
-    conn.execute('''
-    CREATE TABLE IF NOT EXISTS stolen_devices (
-        id INTEGER PRIMARY KEY,
-        hardware_id TEXT UNIQUE,
-        user_id INTEGER,
-        reported_stolen_at TEXT,
-        last_location TEXT,
-        recovery_email TEXT,
-        recovery_phone TEXT,
-        FOREIGN KEY (hardware_id) REFERENCES antitheft_devices (hardware_id),
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )
-    ''')
-    
-    # Stolen device locations
-    conn.execute('''
-    CREATE TABLE IF NOT EXISTS stolen_device_locations (
-        id INTEGER PRIMARY KEY,
-        hardware_id TEXT,
-        latitude REAL,
-        longitude REAL,
-        timestamp TEXT,
-        connection_info TEXT,
-        FOREIGN KEY (hardware_id) REFERENCES stolen_devices (hardware_id)
-    )
-    ''')
-
-    # Device commands table - for remote actions
-    conn.execute('''
-    CREATE TABLE IF NOT EXISTS device_commands (
-        id INTEGER PRIMARY KEY,
-        hardware_id TEXT,
-        user_id INTEGER,
-        command_type TEXT,
-        command_data TEXT,
-        issued_at TEXT,
-        executed BOOLEAN,
-        executed_at TEXT,
-        FOREIGN KEY (hardware_id) REFERENCES antitheft_devices (hardware_id),
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )
-    ''')
-    
-    # Factory reset events table
-    conn.execute('''
-    CREATE TABLE IF NOT EXISTS factory_reset_events (
-        id INTEGER PRIMARY KEY,
-        original_hardware_id TEXT,
-        new_hardware_id TEXT,
-        detected_at TEXT,
-        device_info TEXT,
-        FOREIGN KEY (original_hardware_id) REFERENCES antitheft_devices (hardware_id)
-    )
-    ''')
-    
-    # Hardware ID mapping table - to track changes in hardware IDs
-    conn.execute('''
-    CREATE TABLE IF NOT EXISTS hardware_id_mapping (
-        id INTEGER PRIMARY KEY,
-        original_id TEXT UNIQUE,
-        current_id TEXT,
-        updated_at TEXT
-    )
-    ''')
-    
-    # Stolen device photos table
-    conn.execute('''
-    CREATE TABLE IF NOT EXISTS stolen_device_photos (
-        id INTEGER PRIMARY KEY,
-        hardware_id TEXT,
-        photo_data TEXT,
-        timestamp TEXT,
-        FOREIGN KEY (hardware_id) REFERENCES stolen_devices (hardware_id)
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
+# Per-route request counts, statuses and latency for /metrics (outermost, so
+# the time spent in other middleware is included)
+app.add_middleware(MetricsMiddleware)
 
-# Initialize database on startup
-init_db()
+# Open the storage backend (creating or upgrading the database schema)
+async def init_storage():
+    await storage.open()
+    
+    # Status checks and check-ins are answered from memory
+    await stolen_registry.load()
+    
+    # Factory-reset devices are resolved to their original hardware ID
+    await hardware_aliases.load()
 
 # Secret key for JWT
 SECRET_KEY = "dev-secret-key"  # Change in production!
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 30  # 30 days
 
+# Shared key for recovery operator endpoints (sent as X-Operator-Key);
+# those endpoints are disabled while it is unset
+OPERATOR_KEY = os.environ.get("GHOSTTRACK_OPERATOR_KEY")
+
+# Largest number of buffered fixes accepted in one batch request
+MAX_BATCH_FIXES = 500
+
+# Location history page sizes - default, largest allowed, and rows per DB round trip
+DEFAULT_HISTORY_LIMIT = 50
+MAX_HISTORY_LIMIT = 5000
+HISTORY_CHUNK_SIZE = 500
+
+# Most raw fixes loaded for one simplified track (the newest in the range win)
+MAX_TRACK_ROWS = 100000
+
+# Largest number of devices returned by one area search
+MAX_NEARBY_RESULTS = 1000
+
+# Read size when streaming multipart photo uploads to the blob store
+PHOTO_CHUNK_SIZE = 64 * 1024
+
 # Models
 class LocationData(BaseModel):
     latitude: float
@@ -174,87 +129,119 @@ def create_token(user_id):
     payload = {"sub": str(user_id), "exp": expires}
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
-def verify_token(token):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return int(payload["sub"])
-    except:
-        return None
+def create_device_token(hardware_id):
+    """Secret issued to a device when its owner registers it - proof in its factory-reset alerts"""
+    return hmac.new(SECRET_KEY.encode(), f"device:{hardware_id}".encode(), hashlib.sha256).hexdigest()
+
+def verify_device_token(hardware_id, token):
+    if not isinstance(token, str):
+        return False
+    return hmac.compare_digest(token.encode(), create_device_token(hardware_id).encode())
+
+# Verified tokens and device owners are cached - both are checked on every poll
+token_cache = TokenCache(storage, SECRET_KEY, ALGORITHM)
+device_owners = DeviceOwners(storage)
+
+async def verify_token(token):
+    return await token_cache.verify(token)
+
+def verify_operator(request):
+    key = request.headers.get("X-Operator-Key", "")
+    return bool(OPERATOR_KEY) and hmac.compare_digest(key.encode(), OPERATOR_KEY.encode())
+
+# Dependency for operator-only endpoints - internal stats, queries and plans
+def require_operator(request: Request):
+    if not verify_operator(request):
+        raise HTTPException(status_code=403, detail="Operator key required")
+
+def valid_coordinates(latitude, longitude):
+    if not isinstance(latitude, (int, float)) or not isinstance(longitude, (int, float)):
+        return False
+    return abs(latitude) <= 90 and abs(longitude) <= 180
+
+def checkin_timestamp(millis):
+    """Convert a device's epoch-millisecond fix time, falling back to now"""
+    if isinstance(millis, (int, float)):
+        try:
+            return datetime.utcfromtimestamp(millis / 1000).isoformat()
+        except (OverflowError, OSError, ValueError):
+            pass
+    return datetime.utcnow().isoformat()
+
+async def record_checkins(rows):
+    """Queue a stolen device's check-in rows and update its last-known position and live streams"""
+    await checkin_queue.submit_many(rows)
+    
+    if rows:
+        newest = max(rows, key=lambda row: row[3])
+        latest_positions.record_device(*newest[:4])
+        
+        for row in sorted(rows, key=lambda row: row[3]):
+            location_hub.publish(*row[:4])
 
 # Routes
 @app.post("/api/register")
-async def register(email: str = Form(...), password: str = Form(...)):
+async def register(email: str = Form(...), password: str = Form(...), storage=Depends(get_storage)):
     # Hash password
     hashed_password = hash_password(password)
     
     # Save to database
-    db = get_db()
-    try:
-        cursor = db.cursor()
-        cursor.execute(
-            "INSERT INTO users (email, password) VALUES (?, ?)",
-            (email, hashed_password)
-        )
-        db.commit()
-        user_id = cursor.lastrowid
-        
-        # Create token
-        token = create_token(user_id)
-        return {"token": token, "user_id": user_id, "email": email}
-    except sqlite3.IntegrityError:
+    user_id = await storage.create_user(email, hashed_password)
+    if user_id is None:
         raise HTTPException(status_code=400, detail="Email already registered")
-    finally:
-        db.close()
+    
+    # Create token
+    token = create_token(user_id)
+    return {"token": token, "user_id": user_id, "email": email}
 
 @app.post("/api/login")
-async def login(email: str = Form(...), password: str = Form(...)):
+async def login(email: str = Form(...), password: str = Form(...), storage=Depends(get_storage)):
     # Check credentials
     hashed_password = hash_password(password)
-    db = get_db()
-    try:
-        cursor = db.cursor()
-        cursor.execute(
-            "SELECT id FROM users WHERE email = ? AND password = ?",
-            (email, hashed_password)
-        )
-        user = cursor.fetchone()
-        
-        if not user:
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-        
-        # Create token
-        token = create_token(user["id"])
-        return {"token": token, "user_id": user["id"], "email": email}
-    finally:
-        db.close()
+    user_id = await storage.find_user(email, hashed_password)
+    
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    # Create token
+    token = create_token(user_id)
+    return {"token": token, "user_id": user_id, "email": email}
+
+# Revoke the caller's token
+@app.post("/api/logout")
+async def logout(request: Request):
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    if not await token_cache.revoke(token):
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    return {"status": "success"}
 
 # Improved location API endpoints with better error handling and logging
 
 @app.post("/api/location")
-async def save_location(request: Request):
+async def save_location(request: Request, storage=Depends(get_storage)):
     """Save user's current location to the database with improved error handling"""
     try:
         # Get token from query parameter
         token = request.query_params.get("token")
         if not token:
-            logging.warning("Location save attempt with missing token")
+            events.warning("location_rejected", reason="missing_token")
             raise HTTPException(status_code=401, detail="Missing token")
         
         # Verify token and get user_id
-        user_id = verify_token(token)
+        user_id = await verify_token(token)
         if not user_id:
-            logging.warning(f"Location save attempt with invalid token: {token[:10]}...")
+            events.warning("location_rejected", reason="invalid_token")
             raise HTTPException(status_code=401, detail="Invalid token")
         
         # Parse JSON data from request body
         try:
             data = await request.json()
-            logging.info(f"Received location data for user_id {user_id}: {data}")
             
             # Validate required fields
             if not all(key in data for key in ['latitude', 'longitude', 'timestamp']):
                 missing = [key for key in ['latitude', 'longitude', 'timestamp'] if key not in data]
-                logging.error(f"Missing required fields in location data: {missing}")
+                events.warning("location_rejected", reason="missing_fields", user_id=user_id, missing=missing)
                 raise HTTPException(status_code=400, detail=f"Missing required fields: {missing}")
             
             # Get location data
@@ -264,34 +251,27 @@ async def save_location(request: Request):
             
             # Additional validation
             if not isinstance(latitude, (int, float)) or not isinstance(longitude, (int, float)):
-                logging.error(f"Invalid coordinates: lat={latitude}, lng={longitude}")
+                events.warning("location_rejected", reason="invalid_coordinates", user_id=user_id)
                 raise HTTPException(status_code=400, detail="Coordinates must be numbers")
             
             if abs(latitude) > 90 or abs(longitude) > 180:
-                logging.error(f"Coordinates out of range: lat={latitude}, lng={longitude}")
+                events.warning("location_rejected", reason="coordinates_out_of_range", user_id=user_id)
                 raise HTTPException(status_code=400, detail="Coordinates out of valid range")
             
         except json.JSONDecodeError:
-            logging.error(f"Failed to parse JSON data for user_id {user_id}")
+            events.warning("location_rejected", reason="invalid_json", user_id=user_id)
             raise HTTPException(status_code=400, detail="Invalid JSON data")
         
         # Save to database
-        db = get_db()
         try:
-            db.execute(
-                "INSERT INTO locations (user_id, latitude, longitude, timestamp) VALUES (?, ?, ?, ?)",
-                (user_id, latitude, longitude, timestamp)
-            )
-            db.commit()
-            logging.info(f"Successfully saved location for user_id {user_id}")
+            await storage.add_user_fixes([(user_id, latitude, longitude, timestamp)])
+            latest_positions.record_user(user_id, latitude, longitude, timestamp)
+            events.event("location_saved", user_id=user_id)
             return {"status": "success", "message": "Location saved successfully"}
         
         except Exception as e:
-            logging.error(f"Database error saving location for user_id {user_id}: {str(e)}")
+            events.error("location_save_failed", user_id=user_id, error=str(e))
             raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-        
-        finally:
-            db.close()
             
     except HTTPException:
         # Re-raise HTTP exceptions
@@ -299,35 +279,72 @@ async def save_location(request: Request):
     
     except Exception as e:
         # Log any unexpected errors
-        logging.exception(f"Unexpected error in save_location: {str(e)}")
+        events.error("location_save_failed", exc_info=True, error=str(e))
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+@app.post("/api/location/batch")
+async def save_location_batch(request: Request, storage=Depends(get_storage)):
+    """Save a batch of buffered location fixes in a single transaction"""
+    token = request.query_params.get("token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Missing token")
+    
+    user_id = await verify_token(token)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    try:
+        data = await request.json()
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON data")
+    
+    fixes = data.get("locations") if isinstance(data, dict) else None
+    if not isinstance(fixes, list) or not fixes:
+        raise HTTPException(status_code=400, detail="locations must be a non-empty list")
+    
+    if len(fixes) > MAX_BATCH_FIXES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_FIXES} locations per batch")
+    
+    # Validate every fix before writing any of them
+    rows = []
+    for index, fix in enumerate(fixes):
+        if not isinstance(fix, dict) or not all(key in fix for key in ['latitude', 'longitude', 'timestamp']):
+            raise HTTPException(status_code=400, detail=f"Missing required fields in location {index}")
+        
+        if not valid_coordinates(fix['latitude'], fix['longitude']):
+            raise HTTPException(status_code=400, detail=f"Invalid coordinates in location {index}")
+        
+        rows.append((user_id, fix['latitude'], fix['longitude'], fix['timestamp']))
+    
+    try:
+        saved = await storage.add_user_fixes(rows)
+    except Exception as e:
+        events.error("location_batch_failed", user_id=user_id, fixes=len(rows), error=str(e))
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    
+    newest = max(rows, key=lambda row: str(row[3]))
+    latest_positions.record_user(user_id, newest[1], newest[2], newest[3])
+    
+    events.event("location_batch_saved", user_id=user_id, saved=saved)
+    return {"status": "success", "saved": saved}
+
+
 @app.get("/api/location")
-async def get_location(token: str):
+async def get_location(token: str, storage=Depends(get_storage)):
     """Get user's most recent location with improved error handling and fallback"""
     try:
         # Verify token and get user_id
-        user_id = verify_token(token)
+        user_id = await verify_token(token)
         if not user_id:
-            logging.warning(f"Location get attempt with invalid token: {token[:10]}...")
+            events.warning("location_get_rejected", reason="invalid_token")
             raise HTTPException(status_code=401, detail="Invalid token")
         
-        logging.info(f"Getting latest location for user_id {user_id}")
-        
-        db = get_db()
         try:
-            cursor = db.cursor()
-            
-            # First try to get the most recent location
-            cursor.execute(
-                "SELECT latitude, longitude, timestamp FROM locations WHERE user_id = ? ORDER BY timestamp DESC LIMIT 1",
-                (user_id,)
-            )
-            location = cursor.fetchone()
+            # First try to get the most recent location (cached last-known position)
+            location = await latest_positions.for_user(user_id)
             
             if location:
-                logging.info(f"Found location for user_id {user_id}")
                 return {
                     "latitude": location["latitude"],
                     "longitude": location["longitude"],
@@ -335,7 +352,7 @@ async def get_location(token: str):
                 }
             else:
                 # If no location found, return a more specific error
-                logging.warning(f"No location found for user_id {user_id}")
+                events.event("location_not_found", user_id=user_id)
                 
                 # Instead of 404, return a default with a status flag
                 return {
@@ -347,11 +364,8 @@ async def get_location(token: str):
                 }
                 
         except Exception as e:
-            logging.error(f"Database error getting location for user_id {user_id}: {str(e)}")
+            events.error("location_get_failed", user_id=user_id, error=str(e))
             raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-        
-        finally:
-            db.close()
             
     except HTTPException:
         # Re-raise HTTP exceptions
@@ -359,274 +373,404 @@ async def get_location(token: str):
     
     except Exception as e:
         # Log any unexpected errors
-        logging.exception(f"Unexpected error in get_location: {str(e)}")
+        events.error("location_get_failed", exc_info=True, error=str(e))
         raise HTTPException(status_code=500, detail="Internal server error")
 
 # Anti-theft API
 @app.post("/api/register-device-antitheft")
-async def register_device_antitheft(device: DeviceRegistration, request: Request):
+async def register_device_antitheft(device: DeviceRegistration, request: Request, storage=Depends(get_storage)):
     token = request.headers.get('Authorization', '').replace('Bearer ', '')
-    user_id = verify_token(token)
+    user_id = await verify_token(token)
     
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    db = get_db()
-    try:
-        # Check if device exists by hardware ID
-        cursor = db.cursor()
-        cursor.execute(
-            "SELECT id, user_id FROM antitheft_devices WHERE hardware_id = ?",
-            (device.hardwareId,)
-        )
-        existing_device = cursor.fetchone()
-        
-        device_info_json = json.dumps(device.deviceInfo)
-        
-        if existing_device:
-            # If device exists but belongs to a different user
-            if str(existing_device["user_id"]) != device.userId:
-                # This could be a stolen device - log this suspicious activity
-                db.execute(
-                    """
-                    INSERT INTO stolen_device_locations 
-                    (hardware_id, latitude, longitude, timestamp, connection_info)
-                    VALUES (?, ?, ?, ?, ?)
-                    """,
-                    (
-                        device.hardwareId, 
-                        device.deviceInfo.get("lastKnownPosition", {}).get("latitude", 0),
-                        device.deviceInfo.get("lastKnownPosition", {}).get("longitude", 0),
-                        datetime.utcnow().isoformat(),
-                        json.dumps({"ip": request.client.host, "ua": request.headers.get("User-Agent")})
-                    )
-                )
-                
-                # Check if it's been reported stolen
-                cursor.execute(
-                    "SELECT id FROM stolen_devices WHERE hardware_id = ?",
-                    (device.hardwareId,)
-                )
-                is_reported_stolen = cursor.fetchone() is not None
-                
-                # Update last seen
-                db.execute(
-                    "UPDATE antitheft_devices SET last_seen = ? WHERE hardware_id = ?",
-                    (datetime.utcnow().isoformat(), device.hardwareId)
-                )
-                
-                db.commit()
-                
-                if is_reported_stolen:
-                    # Return a special response that will activate theft recovery mode
-                    return {
-                        "status": "stolen_recovery_mode",
-                        "message": "This device has been reported stolen. Location tracking has been activated."
-                    }
-                
-                # Return normal response if not reported stolen
-                return {"status": "success", "registered": False}
-            
-            # Update existing device for same user
-            db.execute(
-                """
-                UPDATE antitheft_devices 
-                SET last_seen = ?, device_info = ? 
-                WHERE hardware_id = ?
-                """,
-                (datetime.utcnow().isoformat(), device_info_json, device.hardwareId)
-            )
-        else:
-            # Register new device
-            db.execute(
-                """
-                INSERT INTO antitheft_devices 
-                (user_id, hardware_id, first_seen, last_seen, device_info)
-                VALUES (?, ?, ?, ?, ?)
-                """,
-                (
-                    user_id, 
-                    device.hardwareId, 
-                    datetime.utcnow().isoformat(),
-                    datetime.utcnow().isoformat(),
-                    device_info_json
-                )
-            )
-        
-        db.commit()
-        return {"status": "success", "registered": True}
-    finally:
-        db.close()
+    # A reset device re-registering is the same device as its original ID
+    device.hardwareId = hardware_aliases.resolve(device.hardwareId)
+    device_info_json = json.dumps(device.deviceInfo)
+    
+    # Location logged if the device turns up under a different account
+    position = device.deviceInfo.get("lastKnownPosition")
+    if not isinstance(position, dict):
+        position = {}
+    suspicious_location = (
+        device.hardwareId, 
+        position.get("latitude"),
+        position.get("longitude"),
+        datetime.utcnow().isoformat(),
+        json.dumps({"ip": request.client.host, "ua": request.headers.get("User-Agent")})
+    )
+    
+    # Registration reads and writes several rows - the storage runs them atomically.
+    # Ownership is decided by the verified token's user, never the client's userId
+    result = await storage.register_device(
+        device.hardwareId, user_id, device_info_json, datetime.utcnow().isoformat()
+    )
+    if result == "foreign_stolen":
+        # Return a special response that will activate theft recovery mode
+        response = {
+            "status": "stolen_recovery_mode",
+            "message": "This device has been reported stolen. Location tracking has been activated."
+        }
+    elif result == "foreign":
+        response = {"status": "success", "registered": False}
+    else:
+        # Only the owner's own registration gets the device's token
+        response = {"status": "success", "registered": True,
+                    "deviceToken": create_device_token(device.hardwareId)}
+    # A position without valid coordinates is not logged as a fix
+    log_location = result != "registered" and valid_coordinates(*suspicious_location[1:3])
+    device_owners.forget(device.hardwareId)
+    
+    # This could be a stolen device - log this suspicious activity through the check-in queue
+    if log_location:
+        await checkin_queue.submit(suspicious_location)
+        latest_positions.record_device(*suspicious_location[:4])
+        location_hub.publish(*suspicious_location[:4])
+    
+    return response
 
+# Polled by every device - answered from the in-memory stolen registry and
+# the device owner cache, so a typical check runs no queries at all
 @app.get("/api/check-device-status")
-async def check_device_status(hardwareId: str):
-    db = get_db()
-    try:
-        cursor = db.cursor()
-        
-        # Check stolen devices first
-        cursor.execute(
-            "SELECT id FROM stolen_devices WHERE hardware_id = ?",
-            (hardwareId,)
-        )
-        
-        if cursor.fetchone():
-            return {"status": "stolen"}
-        
-        # Check if device exists
-        cursor.execute(
-            "SELECT user_id, is_stolen FROM antitheft_devices WHERE hardware_id = ?",
-            (hardwareId,)
-        )
-        
-        device = cursor.fetchone()
-        
-        if not device:
-            return {"status": "unknown"}
-        
-        if device["is_stolen"] == 1:
-            return {"status": "stolen"}
-        
-        return {"status": "registered", "user_id": device["user_id"]}
-    finally:
-        db.close()
+async def check_device_status(hardwareId: str, storage=Depends(get_storage)):
+    # A reset device keeps the status of its original hardware ID
+    hardwareId = hardware_aliases.resolve(hardwareId)
+    
+    # Check stolen devices first
+    if stolen_registry.is_stolen(hardwareId):
+        return {"status": "stolen"}
+    
+    # Check if device exists
+    owner = await device_owners.get(hardwareId)
+    
+    if owner is None:
+        return {"status": "unknown"}
+    
+    return {"status": "registered", "user_id": owner}
 
 @app.post("/api/report-stolen")
-async def report_stolen(hardwareId: str = Form(...), email: str = Form(...), phone: str = Form(None)):
-    db = get_db()
-    try:
-        cursor = db.cursor()
-        
-        # Verify device exists
-        cursor.execute(
-            "SELECT user_id FROM antitheft_devices WHERE hardware_id = ?",
-            (hardwareId,)
-        )
-        
-        device = cursor.fetchone()
-        
-        if not device:
-            raise HTTPException(status_code=404, detail="Device not found")
-        
-        # Mark as stolen
-        db.execute(
-            "UPDATE antitheft_devices SET is_stolen = 1 WHERE hardware_id = ?",
-            (hardwareId,)
-        )
-        
-        # Check if already in stolen_devices
-        cursor.execute(
-            "SELECT id FROM stolen_devices WHERE hardware_id = ?",
-            (hardwareId,)
-        )
-        
-        if cursor.fetchone() is None:
-            # Add to stolen devices
-            db.execute(
-                """
-                INSERT INTO stolen_devices 
-                (hardware_id, user_id, reported_stolen_at, recovery_email, recovery_phone)
-                VALUES (?, ?, ?, ?, ?)
-                """,
-                (
-                    hardwareId,
-                    device["user_id"],
-                    datetime.utcnow().isoformat(),
-                    email,
-                    phone
-                )
-            )
-        
-        db.commit()
-        return {"status": "success", "message": "Device reported as stolen"}
-    finally:
-        db.close()
+async def report_stolen(hardwareId: str = Form(...), email: str = Form(...), phone: str = Form(None), storage=Depends(get_storage)):
+    hardwareId = hardware_aliases.resolve(hardwareId)
+    
+    # Marking a device stolen touches two tables - the storage runs it atomically
+    if not await storage.report_stolen(hardwareId, email, phone, datetime.utcnow().isoformat()):
+        raise HTTPException(status_code=404, detail="Device not found")
+    
+    stolen_registry.mark_stolen(hardwareId)
+    
+    return {"status": "success", "message": "Device reported as stolen"}
 
+def history_location(row):
+    # Parse connection info for additional data
+    connection_info = {}
+    if row["connection_info"]:
+        try:
+            connection_info = json.loads(row["connection_info"])
+        except ValueError:
+            pass
+    
+    return {
+        "id": row["id"],
+        "latitude": row["latitude"],
+        "longitude": row["longitude"],
+        "timestamp": row["timestamp"],
+        "accuracy": connection_info.get("accuracy", 100)  # Default accuracy radius
+    }
+
+# Location history for a stolen device, with keyset pagination:
+#   no cursor          newest fixes first
+#   before, before_id  older page - pass the "next" cursor from the previous page
+#   after_id           fixes stored after that id, in ingest order (delta refresh)
+#   since              only fixes with a timestamp after this (combines with the above)
+# The body is streamed in chunks, so long pages never build one big response
 @app.get("/api/stolen-device-locations")
-async def get_stolen_device_locations(hardwareId: str, token: str):
-    user_id = verify_token(token)
+async def get_stolen_device_locations(hardwareId: str, token: str, request: Request,
+                                      limit: int = DEFAULT_HISTORY_LIMIT, before: str = None,
+                                      before_id: int = None, after_id: int = None, since: str = None,
+                                      storage=Depends(get_storage)):
+    """Get location history for a stolen device"""
+    user_id = await verify_token(token)
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid token")
+    hardwareId = hardware_aliases.resolve(hardwareId)
     
-    db = get_db()
-    try:
-        cursor = db.cursor()
-        
-        # Verify device belongs to user
-        cursor.execute(
-            "SELECT user_id FROM antitheft_devices WHERE hardware_id = ?",
-            (hardwareId,)
-        )
-        
-        device = cursor.fetchone()
-        
-        if not device or device["user_id"] != user_id:
-            raise HTTPException(status_code=403, detail="Not authorized to view this device")
-        
-        # Get locations
-        cursor.execute(
-            """
-            SELECT latitude, longitude, timestamp 
-            FROM stolen_device_locations
-            WHERE hardware_id = ?
-            ORDER BY timestamp DESC
-            LIMIT 50
-            """,
-            (hardwareId,)
-        )
-        
-        locations = []
-        for row in cursor:
-            locations.append({
-                "latitude": row["latitude"],
-                "longitude": row["longitude"],
-                "timestamp": row["timestamp"]
-            })
-        
-        return {"locations": locations}
-    finally:
-        db.close()
+    if (before is None) != (before_id is None):
+        raise HTTPException(status_code=400, detail="before and before_id must be given together")
+    if before is not None and after_id is not None:
+        raise HTTPException(status_code=400, detail="Use either a before or an after_id cursor")
+    limit = min(max(limit, 1), MAX_HISTORY_LIMIT)
+    
+    # Verify device belongs to user
+    if await device_owners.get(hardwareId) != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to view this device")
+    
+    # The same page is unchanged until the device's version moves
+    etag = device_etag(hardwareId, await storage.device_version(hardwareId))
+    headers = {"ETag": etag, **CACHE_HEADERS}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    async def body():
+        cursor_ts, cursor_id = before, before_id
+        last_id = after_id
+        latest_id = after_id
+        sent = 0
+        rows = []
+        
+        yield '{"locations":['
+        while sent < limit:
+            size = min(HISTORY_CHUNK_SIZE, limit - sent)
+            rows = await storage.stolen_fix_page(hardwareId, size, cursor_ts, cursor_id, last_id, since)
+            if not rows:
+                break
+            
+            chunk = ",".join(json.dumps(history_location(row)) for row in rows)
+            yield ("," if sent else "") + chunk
+            sent += len(rows)
+            latest_id = max([row["id"] for row in rows] + [latest_id or 0])
+            
+            if after_id is not None:
+                last_id = rows[-1]["id"]
+            else:
+                cursor_ts, cursor_id = rows[-1]["timestamp"], rows[-1]["id"]
+            if len(rows) < size:
+                break
+        
+        # A full page means there may be more - hand back the cursor for it
+        next_cursor = None
+        if sent == limit and rows:
+            if after_id is not None:
+                next_cursor = {"after_id": last_id}
+            else:
+                next_cursor = {"before": cursor_ts, "before_id": cursor_id}
+        yield f'],"next":{json.dumps(next_cursor)},"latest_id":{json.dumps(latest_id)}}}'
+    
+    return StreamingResponse(body(), media_type="application/json", headers=headers)
+
+# Simplified track for drawing a stolen device's path on the map. zoom is the
+# map zoom level (one pixel of tolerance); resolution optionally keeps only
+# the last fix per that many seconds; start/end bound the time range
+@app.get("/api/stolen-device-locations/track")
+async def get_stolen_device_track(hardwareId: str, token: str, zoom: int = 15, resolution: int = 0,
+                                  start: str = None, end: str = None, storage=Depends(get_storage)):
+    """Get a zoom-aware simplified location track for a stolen device"""
+    user_id = await verify_token(token)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    hardwareId = hardware_aliases.resolve(hardwareId)
+    
+    zoom = min(max(zoom, MIN_ZOOM), MAX_ZOOM)
+    resolution = max(resolution, 0)
+    
+    # Verify device belongs to user
+    if await device_owners.get(hardwareId) != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to view this device")
+    
+    key = (hardwareId, start, end, zoom, resolution)
+    track = track_cache.get(key)
+    if track is not MISSING:
+        return track
+    
+    rows = await storage.stolen_fix_track(hardwareId, start, end, MAX_TRACK_ROWS)
+    rows = [(row["latitude"], row["longitude"], row["timestamp"]) for row in reversed(rows)]
+    
+    # Simplification is CPU work - keep it off the event loop
+    loop = asyncio.get_running_loop()
+    locations = await loop.run_in_executor(None, simplify_track, rows, zoom, resolution)
+    
+    track = {
+        "locations": locations,
+        "points": len(locations),
+        "raw_points": len(rows),
+        "zoom": zoom,
+        "resolution": resolution
+    }
+    track_cache.set(key, track)
+    return track
+
+# Recovery operator sweep - stolen devices whose last known position is in an
+# area. Give either a radius (lat, lng, radius_m) or a bounding box
+# (min_lat, min_lng, max_lat, max_lng; min_lng > max_lng crosses the
+# antimeridian). Results are nearest first, from the circle or box centre
+@app.get("/api/stolen-devices/nearby")
+async def find_nearby_stolen_devices(request: Request, lat: float = None, lng: float = None,
+                                     radius_m: float = None, min_lat: float = None, min_lng: float = None,
+                                     max_lat: float = None, max_lng: float = None, since: str = None,
+                                     limit: int = 100, storage=Depends(get_storage)):
+    """Find stolen devices last seen within a radius or bounding box"""
+    if not verify_operator(request):
+        raise HTTPException(status_code=403, detail="Operator key required")
+    
+    limit = min(max(limit, 1), MAX_NEARBY_RESULTS)
+    
+    if radius_m is not None:
+        if lat is None or lng is None or not valid_coordinates(lat, lng) or radius_m <= 0:
+            raise HTTPException(status_code=400, detail="Invalid radius search")
+        min_lat, min_lng, max_lat, max_lng = bbox_around(lat, lng, radius_m)
+        center = (lat, lng)
+    elif None not in (min_lat, min_lng, max_lat, max_lng):
+        if not (valid_coordinates(min_lat, min_lng) and valid_coordinates(max_lat, max_lng)) or min_lat > max_lat:
+            raise HTTPException(status_code=400, detail="Invalid bounding box")
+        center_lng = (min_lng + max_lng) / 2 if min_lng <= max_lng else (min_lng + max_lng + 360) / 2
+        center = ((min_lat + max_lat) / 2, center_lng - 360 if center_lng > 180 else center_lng)
+    else:
+        raise HTTPException(status_code=400, detail="Give lat, lng and radius_m, or a bounding box")
+    
+    rows = []
+    for low_lng, high_lng in lng_ranges(min_lng, max_lng):
+        rows += await storage.stolen_devices_in_box(min_lat, max_lat, low_lng, high_lng, since)
+    
+    devices = rank_by_distance(rows, center[0], center[1], radius_m, limit)
+    return {"devices": devices, "count": len(devices)}
+
+# Live stream of new locations for a stolen device (Server-Sent Events).
+# Each fix is sent as a "location" event as soon as it is ingested
+@app.get("/api/stolen-device-locations/stream")
+async def stream_stolen_device_locations(hardwareId: str, token: str, storage=Depends(get_storage)):
+    """Push new locations for a stolen device to its owner"""
+    user_id = await verify_token(token)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    hardwareId = hardware_aliases.resolve(hardwareId)
+    
+    # Verify device belongs to user
+    if await device_owners.get(hardwareId) != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to view this device")
+    
+    if location_hub.full:
+        location_hub.reject()
+        raise HTTPException(status_code=503, detail="Too many live streams")
+    
+    async def sse_events():
+        # Starlette cancels this generator when the client disconnects
+        with location_hub.subscribe(hardwareId) as subscription:
+            yield "retry: 5000\n\n"
+            while True:
+                fixes = await subscription.next_batch(LIVE_HEARTBEAT_SECONDS)
+                if not fixes:
+                    # Keep-alive comment so proxies don't close an idle stream
+                    yield ": ping\n\n"
+                for fix in fixes:
+                    yield f"event: location\ndata: {json.dumps(fix)}\n\n"
+    
+    return StreamingResponse(
+        sse_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.post("/api/__system__/device-checkin")
-async def device_checkin(request: Request):
+async def device_checkin(request: Request, storage=Depends(get_storage)):
     data = await request.json()
     
     hardwareId = data.get("h")
     lat = data.get("a")
     lng = data.get("o")
     
-    if not (hardwareId and lat and lng):
+    if not (hardwareId and lat and lng) or not valid_coordinates(lat, lng):
         # Return success regardless to avoid alerting thief
         return {"s": 1}
     
-    db = get_db()
+    # A reset device reports under a new ID - record it under the original
+    hardwareId = hardware_aliases.resolve(hardwareId)
+    
+    # Check if device is reported stolen
+    if stolen_registry.is_stolen(hardwareId):
+        # Record location - queued and group-committed in the background
+        timestamp = datetime.utcnow().isoformat()
+        await checkin_queue.submit((
+            hardwareId,
+            lat,
+            lng,
+            timestamp,
+            json.dumps({"ip": request.client.host, "ua": request.headers.get("User-Agent")})
+        ))
+        latest_positions.record_device(hardwareId, lat, lng, timestamp)
+        location_hub.publish(hardwareId, lat, lng, timestamp)
+        events.event("stolen_checkin", hardware_id=hardwareId)
+    
+    # Always return success to avoid alerting thief
+    return {"s": 1}
+
+@app.post("/api/__system__/device-checkin/batch")
+async def device_checkin_batch(request: Request, storage=Depends(get_storage)):
+    """Record a batch of buffered check-ins (``f``) for one device"""
     try:
-        # Check if device is reported stolen
-        cursor = db.cursor()
-        cursor.execute(
-            "SELECT id FROM stolen_devices WHERE hardware_id = ?",
-            (hardwareId,)
-        )
-        
-        if cursor.fetchone():
-            # Record location
-            db.execute(
-                """
-                INSERT INTO stolen_device_locations 
-                (hardware_id, latitude, longitude, timestamp, connection_info)
-                VALUES (?, ?, ?, ?, ?)
-                """,
-                (
-                    hardwareId,
-                    lat,
-                    lng,
-                    datetime.utcnow().isoformat(),
-                    json.dumps({"ip": request.client.host, "ua": request.headers.get("User-Agent")})
-                )
-            )
-            db.commit()
-    finally:
-        db.close()
+        data = await request.json()
+    except json.JSONDecodeError:
+        return {"s": 1}
+    
+    hardwareId = data.get("h") if isinstance(data, dict) else None
+    fixes = data.get("f") if isinstance(data, dict) else None
+    
+    if not hardwareId or not isinstance(fixes, list):
+        # Return success regardless to avoid alerting thief
+        return {"s": 1}
+    
+    hardwareId = hardware_aliases.resolve(hardwareId)
+    
+    # Check if device is reported stolen
+    if stolen_registry.is_stolen(hardwareId):
+        rows = []
+        for fix in fixes[:MAX_BATCH_FIXES]:
+            if not isinstance(fix, dict):
+                continue
+            
+            lat = fix.get("a")
+            lng = fix.get("o")
+            if not (lat and lng) or not valid_coordinates(lat, lng):
+                continue
+            
+            connection_info = {"ip": request.client.host, "ua": request.headers.get("User-Agent")}
+            if isinstance(fix.get("c"), (int, float)):
+                connection_info["accuracy"] = fix["c"]
+            
+            rows.append((
+                hardwareId,
+                lat,
+                lng,
+                checkin_timestamp(fix.get("t")),
+                json.dumps(connection_info)
+            ))
+        
+        await record_checkins(rows)
+    
+    # Always return success to avoid alerting thief
+    return {"s": 1}
+
+@app.post("/api/__system__/device-checkin/bin")
+async def device_checkin_binary(request: Request):
+    """Record check-ins sent in the compact binary format (see wire.py)"""
+    try:
+        hardwareId, fixes = decode_checkins(await request.body())
+    except ValueError:
+        # Return success regardless to avoid alerting thief
+        return {"s": 1}
+    
+    if not hardwareId:
+        return {"s": 1}
+    
+    hardwareId = hardware_aliases.resolve(hardwareId)
+    
+    # Check if device is reported stolen
+    if stolen_registry.is_stolen(hardwareId):
+        connection_info = {"ip": request.client.host, "ua": request.headers.get("User-Agent")}
+        rows = []
+        for lat, lng, millis, accuracy in fixes[:MAX_BATCH_FIXES]:
+            if not (lat and lng) or not valid_coordinates(lat, lng):
+                continue
+            
+            info = connection_info if accuracy is None else {**connection_info, "accuracy": accuracy}
+            rows.append((
+                hardwareId,
+                lat,
+                lng,
+                checkin_timestamp(millis),
+                json.dumps(info)
+            ))
+        
+        await record_checkins(rows)
     
     # Always return success to avoid alerting thief
     return {"s": 1}
@@ -634,60 +778,33 @@ async def device_checkin(request: Request):
 # Add these routes to your app.py file to support the theft recovery dashboard
 
 @app.get("/api/device-info")
-async def get_device_info(hardwareId: str, token: str):
+async def get_device_info(hardwareId: str, token: str, request: Request, storage=Depends(get_storage)):
     """Get information about a device including its theft status and last known data"""
-    user_id = verify_token(token)
+    user_id = await verify_token(token)
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid token")
+    hardwareId = hardware_aliases.resolve(hardwareId)
     
-    db = get_db()
     try:
-        cursor = db.cursor()
+        # Unchanged since the dashboard's last poll - answer without building the response
+        if await device_owners.get(hardwareId) == user_id:
+            etag = device_etag(hardwareId, await storage.device_version(hardwareId))
+            if etag_matches(request.headers.get("if-none-match"), etag):
+                return Response(status_code=304, headers={"ETag": etag, **CACHE_HEADERS})
+        else:
+            etag = None
         
         # First check if device exists and belongs to user
-        cursor.execute(
-            """
-            SELECT ad.id, ad.user_id, ad.hardware_id, ad.device_info, ad.last_seen, 
-                   sd.reported_stolen_at, sd.recovery_email
-            FROM antitheft_devices ad
-            LEFT JOIN stolen_devices sd ON ad.hardware_id = sd.hardware_id
-            WHERE ad.hardware_id = ? AND ad.user_id = ?
-            """,
-            (hardwareId, user_id)
-        )
-        
-        device = cursor.fetchone()
+        device = await storage.device_details(hardwareId, user_id)
         
         if not device:
             raise HTTPException(status_code=404, detail="Device not found or not authorized")
         
-        # Get the most recent location
-        cursor.execute(
-            """
-            SELECT latitude, longitude, timestamp 
-            FROM stolen_device_locations
-            WHERE hardware_id = ?
-            ORDER BY timestamp DESC
-            LIMIT 1
-            """,
-            (hardwareId,)
-        )
+        # Get the most recent location - no older than the version in the ETag
+        last_location = await latest_positions.refresh_device(hardwareId)
         
-        last_location = cursor.fetchone()
-        
-        # Get the most recent photo if available
-        cursor.execute(
-            """
-            SELECT photo_data, timestamp
-            FROM stolen_device_photos
-            WHERE hardware_id = ?
-            ORDER BY timestamp DESC
-            LIMIT 1
-            """,
-            (hardwareId,)
-        )
-        
-        last_photo = cursor.fetchone()
+        # Get the most recent photo if available (metadata only - bytes are served by /api/photos)
+        last_photo = await storage.latest_photo(hardwareId)
         
         # Device information
         device_info = json.loads(device["device_info"] or '{}')
@@ -711,92 +828,30 @@ async def get_device_info(hardwareId: str, token: str):
         }
         
         # Add photo if available
-        if last_photo and last_photo["photo_data"]:
-            response["lastPhoto"] = last_photo["photo_data"]
+        if last_photo and last_photo["content_hash"]:
+            response["lastPhotoUrl"] = f"/api/photos/{last_photo['content_hash']}"
             response["lastPhotoTime"] = last_photo["timestamp"]
         
-        return response
-        
-    except Exception as e:
-        logging.error(f"Error fetching device info: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    
-    finally:
-        db.close()
-
-@app.get("/api/stolen-device-locations")
-async def get_stolen_device_locations(hardwareId: str, token: str):
-    """Get location history for a stolen device"""
-    user_id = verify_token(token)
-    if not user_id:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    
-    db = get_db()
-    try:
-        cursor = db.cursor()
-        
-        # Verify device belongs to user
-        cursor.execute(
-            "SELECT user_id FROM antitheft_devices WHERE hardware_id = ?",
-            (hardwareId,)
-        )
-        
-        device = cursor.fetchone()
-        
-        if not device or device["user_id"] != user_id:
-            raise HTTPException(status_code=403, detail="Not authorized to view this device")
-        
-        # Get locations sorted by timestamp (newest first)
-        cursor.execute(
-            """
-            SELECT latitude, longitude, timestamp, 
-                   connection_info, accuracy
-            FROM stolen_device_locations
-            WHERE hardware_id = ?
-            ORDER BY timestamp DESC
-            LIMIT 50
-            """,
-            (hardwareId,)
-        )
-        
-        locations = []
-        for row in cursor:
-            # Parse connection info for additional data
-            connection_info = {}
-            if row["connection_info"]:
-                try:
-                    connection_info = json.loads(row["connection_info"])
-                except:
-                    pass
-            
-            # Build location object
-            location = {
-                "latitude": row["latitude"],
-                "longitude": row["longitude"],
-                "timestamp": row["timestamp"],
-                "accuracy": connection_info.get("accuracy", 100)  # Default accuracy radius
-            }
-            
-            locations.append(location)
+        if etag is None:
+            return response
+        return JSONResponse(response, headers={"ETag": etag, **CACHE_HEADERS})
         
-        return {"locations": locations}
-    
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Error fetching location history: {str(e)}")
+        events.error("device_info_failed", exc_info=True, error=str(e))
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
     
-    finally:
-        db.close()
 
 @app.post("/api/remote-action")
-async def trigger_remote_action(request: Request):
+async def trigger_remote_action(request: Request, storage=Depends(get_storage)):
     """Send a remote action command to a device"""
     try:
         # Get token from Authorization header
         auth_header = request.headers.get('Authorization', '')
         token = auth_header.replace('Bearer ', '')
         
-        user_id = verify_token(token)
+        user_id = await verify_token(token)
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token")
         
@@ -807,84 +862,57 @@ async def trigger_remote_action(request: Request):
         
         if not hardwareId or not action:
             raise HTTPException(status_code=400, detail="Missing required fields")
+        hardwareId = hardware_aliases.resolve(hardwareId)
         
-        db = get_db()
-        try:
-            cursor = db.cursor()
-            
-            # Verify device belongs to user
-            cursor.execute(
-                "SELECT user_id FROM antitheft_devices WHERE hardware_id = ?",
-                (hardwareId,)
-            )
-            
-            device = cursor.fetchone()
-            
-            if not device or device["user_id"] != user_id:
-                raise HTTPException(status_code=403, detail="Not authorized to control this device")
-            
-            # Store the command in the database for the device to pick up
-            command_data = {
-                "action": action,
-                "timestamp": datetime.utcnow().isoformat()
-            }
+        # Verify device belongs to user
+        if await device_owners.get(hardwareId) != user_id:
+            raise HTTPException(status_code=403, detail="Not authorized to control this device")
+        
+        # Store the command in the database for the device to pick up
+        command_data = {
+            "action": action,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        
+        # Add action-specific data
+        if action == "message":
+            command_data["message"] = data.get("message", "Your device has been reported stolen")
+        elif action == "alarm":
+            command_data["duration"] = data.get("duration", 30)
+        elif action == "wipe":
+            # Check password for wipe command
+            if not data.get("password"):
+                raise HTTPException(status_code=400, detail="Password required for wipe command")
             
-            # Add action-specific data
-            if action == "message":
-                command_data["message"] = data.get("message", "Your device has been reported stolen")
-            elif action == "alarm":
-                command_data["duration"] = data.get("duration", 30)
-            elif action == "wipe":
-                # Check password for wipe command
-                if not data.get("password"):
-                    raise HTTPException(status_code=400, detail="Password required for wipe command")
-                
-                # Verify user password
-                cursor.execute(
-                    "SELECT password FROM users WHERE id = ?",
-                    (user_id,)
-                )
-                user = cursor.fetchone()
-                if not user:
-                    raise HTTPException(status_code=404, detail="User not found")
-                
-                # Compare passwords (this should use proper password verification in production)
-                if hash_password(data.get("password")) != user["password"]:
-                    raise HTTPException(status_code=403, detail="Invalid password")
-                
-                command_data["confirmed"] = True
+            # Verify user password
+            password_hash = await storage.user_password(user_id)
+            if password_hash is None:
+                raise HTTPException(status_code=404, detail="User not found")
             
-            # Store command
-            db.execute(
-                """
-                INSERT INTO device_commands
-                (hardware_id, user_id, command_type, command_data, issued_at, executed)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    hardwareId,
-                    user_id,
-                    action,
-                    json.dumps(command_data),
-                    datetime.utcnow().isoformat(),
-                    False
-                )
-            )
+            # Compare passwords (this should use proper password verification in production)
+            if hash_password(data.get("password")) != password_hash:
+                raise HTTPException(status_code=403, detail="Invalid password")
             
-            db.commit()
-            return {"status": "success", "message": f"{action} command sent to device"}
-            
-        finally:
-            db.close()
+            command_data["confirmed"] = True
+        
+        # Store command
+        await storage.add_command(
+            hardwareId, user_id, action, json.dumps(command_data), datetime.utcnow().isoformat()
+        )
+        
+        # Wake the device if it is long-polling on this worker
+        command_notifier.notify(hardwareId)
+        
+        return {"status": "success", "message": f"{action} command sent to device"}
             
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Error processing remote action: {str(e)}")
+        events.error("remote_action_failed", exc_info=True, error=str(e))
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
 
 @app.post("/api/__system__/factory-reset-alert")
-async def factory_reset_alert(request: Request):
+async def factory_reset_alert(request: Request, storage=Depends(get_storage)):
     """Handle alerts from devices that detect they were factory reset"""
     try:
         data = await request.json()
@@ -899,80 +927,66 @@ async def factory_reset_alert(request: Request):
             # Return success to avoid alerting potential thief
             return {"s": 1}
         
-        db = get_db()
-        try:
-            # Check if original hardware ID was reported stolen
-            cursor = db.cursor()
-            cursor.execute(
-                "SELECT id FROM stolen_devices WHERE hardware_id = ?",
-                (originalHardwareId,)
-            )
-            
-            stolen_device = cursor.fetchone()
-            
-            if stolen_device:
-                # Device was reported stolen - record the factory reset
-                db.execute(
-                    """
-                    INSERT INTO factory_reset_events
-                    (original_hardware_id, new_hardware_id, detected_at, device_info)
-                    VALUES (?, ?, ?, ?)
-                    """,
-                    (
-                        originalHardwareId,
-                        newHardwareId,
-                        timestamp or datetime.utcnow().isoformat(),
-                        json.dumps(deviceInfo)
-                    )
-                )
-                
-                # Also record the location
-                if position and 'latitude' in position and 'longitude' in position:
-                    db.execute(
-                        """
-                        INSERT INTO stolen_device_locations
-                        (hardware_id, latitude, longitude, timestamp, connection_info)
-                        VALUES (?, ?, ?, ?, ?)
-                        """,
-                        (
-                            originalHardwareId,
-                            position.get('latitude'),
-                            position.get('longitude'),
-                            position.get('timestamp') or datetime.utcnow().isoformat(),
-                            json.dumps({
-                                "resetDetected": True,
-                                "newHardwareId": newHardwareId,
-                                "ip": request.client.host,
-                                "userAgent": request.headers.get("User-Agent"),
-                                "accuracy": 100  # Default accuracy radius
-                            })
-                        )
-                    )
-                
-                # Create a link between the old and new hardware IDs
-                db.execute(
-                    """
-                    INSERT OR REPLACE INTO hardware_id_mapping
-                    (original_id, current_id, updated_at)
-                    VALUES (?, ?, ?)
-                    """,
-                    (
-                        originalHardwareId,
-                        newHardwareId,
-                        datetime.utcnow().isoformat()
-                    )
+        # The original ID may itself be a reset alias - follow the chain back
+        canonicalId = hardware_aliases.resolve(originalHardwareId)
+        
+        # Only the device itself holds the token issued when it was registered
+        if not verify_device_token(canonicalId, data.get('deviceToken')):
+            events.warning("factory_reset_rejected", reason="invalid_device_token", hardware_id=canonicalId)
+            return {"s": 1}
+        
+        # Check if original hardware ID was reported stolen
+        stolen_device = stolen_registry.is_stolen(canonicalId)
+        
+        if stolen_device:
+            # Also record the location
+            fix = None
+            if position and 'latitude' in position and 'longitude' in position:
+                fix = (
+                    canonicalId,
+                    position.get('latitude'),
+                    position.get('longitude'),
+                    position.get('timestamp') or datetime.utcnow().isoformat(),
+                    json.dumps({
+                        "resetDetected": True,
+                        "newHardwareId": newHardwareId,
+                        "ip": request.client.host,
+                        "userAgent": request.headers.get("User-Agent"),
+                        "accuracy": 100  # Default accuracy radius
+                    })
                 )
-                
-                db.commit()
             
-            # Always return success to avoid alerting potential thief
-            return {"s": 1}
+            # A registered device or another device's alias is never pulled into the chain
+            linkable = (
+                not hardware_aliases.is_linked(newHardwareId)
+                and await device_owners.get(newHardwareId) is None
+            )
             
-        finally:
-            db.close()
-    
+            # The reset event, location and ID mapping are written atomically;
+            # the storage re-checks that the new ID is unused in the same transaction
+            linked = await storage.record_factory_reset(
+                originalHardwareId,
+                newHardwareId,
+                timestamp or datetime.utcnow().isoformat(),
+                json.dumps(deviceInfo),
+                fix,
+                link=linkable
+            )
+            if linked:
+                hardware_aliases.link(originalHardwareId, newHardwareId)
+            else:
+                events.warning("factory_reset_not_linked", reason="hardware_id_in_use",
+                               hardware_id=canonicalId, new_hardware_id=newHardwareId)
+            
+            if fix is not None:
+                latest_positions.record_device(*fix[:4])
+                location_hub.publish(*fix[:4])
+        
+        # Always return success to avoid alerting potential thief
+        return {"s": 1}
+        
     except Exception as e:
-        logging.error(f"Error processing factory reset alert: {str(e)}")
+        events.error("factory_reset_failed", exc_info=True, error=str(e))
         # Always return success to avoid alerting potential thief
         return {"s": 1}
 
@@ -982,42 +996,55 @@ async def factory_reset_alert(request: Request):
 # Add this line at the end of your init_db function:
 # init_additional_tables()
 
+# Unexecuted commands for a device, oldest first
+async def pending_commands(storage, hardware_id):
+    rows = await storage.pending_commands(hardware_id)
+    
+    commands = []
+    for row in rows:
+        command = {
+            "id": row["id"],
+            "type": row["command_type"],
+            "data": json.loads(row["command_data"])
+        }
+        commands.append(command)
+    
+    return commands
+
 # API endpoint for devices to check for and retrieve commands
 @app.get("/api/device-commands")
-async def get_device_commands(hardwareId: str):
+async def get_device_commands(hardwareId: str, storage=Depends(get_storage)):
     """Get pending commands for a device"""
-    db = get_db()
-    try:
-        cursor = db.cursor()
-        
-        # Get pending commands
-        cursor.execute(
-            """
-            SELECT id, command_type, command_data
-            FROM device_commands
-            WHERE hardware_id = ? AND executed = 0
-            ORDER BY issued_at ASC
-            """,
-            (hardwareId,)
-        )
-        
-        commands = []
-        for row in cursor:
-            command = {
-                "id": row["id"],
-                "type": row["command_type"],
-                "data": json.loads(row["command_data"])
-            }
-            commands.append(command)
+    hardwareId = hardware_aliases.resolve(hardwareId)
+    return {"commands": await pending_commands(storage, hardwareId)}
+
+# Long-poll variant - holds the request open until a command is issued for
+# the device or the timeout passes, so idle devices cost one query per window
+@app.get("/api/device-commands/wait")
+async def wait_device_commands(hardwareId: str, timeout: float = LONG_POLL_TIMEOUT, storage=Depends(get_storage)):
+    """Wait for pending commands for a device"""
+    hardwareId = hardware_aliases.resolve(hardwareId)
+    timeout = min(max(timeout, 0), LONG_POLL_MAX_TIMEOUT)
+    
+    # Too many open long-polls - answer like the plain endpoint
+    if command_notifier.full:
+        command_notifier.reject()
+        return {"commands": await pending_commands(storage, hardwareId)}
+    
+    with command_notifier.subscribe(hardwareId) as event:
+        commands = await pending_commands(storage, hardwareId)
+        if commands:
+            return {"commands": commands}
         
-        return {"commands": commands}
+        # On timeout re-check anyway, in case another worker queued a command
+        await command_notifier.wait(event, timeout)
+    
+    return {"commands": await pending_commands(storage, hardwareId)}
     
-    finally:
-        db.close()
 
 # API endpoint for devices to mark commands as executed
 @app.post("/api/device-command-executed")
-async def mark_command_executed(request: Request):
+async def mark_command_executed(request: Request, storage=Depends(get_storage)):
     """Mark a command as executed"""
     try:
         data = await request.json()
@@ -1027,71 +1054,207 @@ async def mark_command_executed(request: Request):
         if not command_id:
             raise HTTPException(status_code=400, detail="Missing command ID")
         
-        db = get_db()
-        try:
-            # Update command status
-            db.execute(
-                """
-                UPDATE device_commands
-                SET executed = 1, executed_at = ?, result = ?
-                WHERE id = ?
-                """,
-                (
-                    datetime.utcnow().isoformat(),
-                    json.dumps(result),
-                    command_id
-                )
-            )
-            
-            db.commit()
-            return {"status": "success"}
-            
-        finally:
-            db.close()
+        # Update command status
+        await storage.mark_command_executed(command_id, datetime.utcnow().isoformat(), json.dumps(result))
+        
+        return {"status": "success"}
             
     except Exception as e:
-        logging.error(f"Error marking command as executed: {str(e)}")
+        events.error("command_executed_failed", exc_info=True, error=str(e))
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
 
-# API endpoint for devices to upload photos
+# API endpoint for devices to upload photos. Accepts a raw image body
+# (?hardwareId=...), a multipart form with a "photo" file, or the legacy
+# JSON {"hardwareId", "photoData"} with base64 image data
 @app.post("/api/upload-photo")
-async def upload_photo(request: Request):
+async def upload_photo(request: Request, hardwareId: str = None, storage=Depends(get_storage)):
     """Upload a photo from a stolen device"""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
     try:
-        data = await request.json()
-        hardwareId = data.get("hardwareId")
-        photoData = data.get("photoData")  # Base64 encoded image
-        
-        if not hardwareId or not photoData:
-            raise HTTPException(status_code=400, detail="Missing required fields")
-        
-        db = get_db()
-        try:
-            # Store the photo
-            db.execute(
-                """
-                INSERT INTO stolen_device_photos
-                (hardware_id, photo_data, timestamp)
-                VALUES (?, ?, ?)
-                """,
-                (
-                    hardwareId,
-                    photoData,
-                    datetime.utcnow().isoformat()
-                )
-            )
+        if content_type == "application/json":
+            data = await request.json()
+            hardwareId = data.get("hardwareId")
+            photoData = data.get("photoData")  # Base64 encoded image
+            
+            if not hardwareId or not photoData:
+                raise HTTPException(status_code=400, detail="Missing required fields")
             
-            db.commit()
-            return {"status": "success"}
+            # Accept both bare base64 and data: URLs
+            if photoData.startswith("data:"):
+                photoData = photoData.split(",", 1)[-1]
+            try:
+                photo_bytes = base64.b64decode(photoData, validate=True)
+            except (binascii.Error, ValueError):
+                raise HTTPException(status_code=400, detail="Invalid photo data")
             
-        finally:
-            db.close()
+            loop = asyncio.get_running_loop()
+            digest, size = await loop.run_in_executor(None, photo_store.put_bytes, photo_bytes)
+            head = photo_bytes[:16]
+        
+        elif content_type == "multipart/form-data":
+            form = await request.form()
+            hardwareId = form.get("hardwareId") or hardwareId
+            upload = form.get("photo")
             
+            if not hardwareId or upload is None or isinstance(upload, str):
+                raise HTTPException(status_code=400, detail="Missing required fields")
+            
+            async def upload_chunks():
+                while chunk := await upload.read(PHOTO_CHUNK_SIZE):
+                    yield chunk
+            
+            digest, size, head = await photo_store.put_stream(upload_chunks())
+            content_type = upload.content_type or ""
+        
+        else:
+            # Raw image body, streamed straight to the blob store
+            if not hardwareId:
+                raise HTTPException(status_code=400, detail="Missing required fields")
+            digest, size, head = await photo_store.put_stream(request.stream())
+        
+        if not size:
+            raise HTTPException(status_code=400, detail="Empty photo")
+        
+        fallback = content_type if content_type.startswith("image/") else "image/jpeg"
+        
+        # Store the photo metadata
+        await storage.add_photo(
+            hardware_aliases.resolve(hardwareId),
+            datetime.utcnow().isoformat(),
+            digest,
+            size,
+            sniff_content_type(head, fallback)
+        )
+        
+        return {"status": "success", "url": f"/api/photos/{digest}"}
+    
+    except HTTPException:
+        raise
+    except BlobTooLarge:
+        raise HTTPException(status_code=413, detail="Photo too large")
     except Exception as e:
-        logging.error(f"Error uploading photo: {str(e)}")
+        events.error("photo_upload_failed", exc_info=True, error=str(e))
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
 
-# Serve static files
-app.mount("/", StaticFiles(directory="app/static", html=True), name="static")
+# Serve a stored photo to the device owner. Blobs are named by their
+# SHA-256, so the digest is a strong ETag and responses never go stale
+@app.get("/api/photos/{digest}")
+async def get_photo(digest: str, token: str, request: Request, storage=Depends(get_storage)):
+    """Stream a stolen device photo, with ETag and Range support"""
+    user_id = await verify_token(token)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    if not is_digest(digest):
+        raise HTTPException(status_code=404, detail="Photo not found")
+    
+    photo = await storage.photo_for_owner(digest, user_id)
+    
+    path = photo_store.path(digest)
+    if not photo or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Photo not found")
+    
+    headers = {
+        "ETag": f'"{digest}"',
+        "Cache-Control": "private, max-age=31536000, immutable",
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if digest in if_none_match or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    
+    # FileResponse streams the file in chunks and answers Range requests
+    return FileResponse(path, media_type=photo["content_type"] or "image/jpeg", headers=headers)
+
+# The stats endpoints below expose SQL, plans and internal counters, so they
+# require the operator key (X-Operator-Key) like other operator endpoints
+
+# Storage backend statistics - for SQLite, the connection pool usage used to
+# size the pool per uvicorn worker
+@app.get("/api/__system__/pool-stats", dependencies=[Depends(require_operator)])
+async def get_pool_stats():
+    """Report storage backend usage for this worker process"""
+    return storage.stats()
+
+# Check-in queue statistics - depth, group-commit sizes and flush latency
+@app.get("/api/__system__/ingest-stats", dependencies=[Depends(require_operator)])
+async def get_ingest_stats():
+    """Report write-behind check-in queue counters for this worker process"""
+    return checkin_queue.stats()
+
+# Command long-poll statistics - open waiters, wake-ups and timeouts
+@app.get("/api/__system__/command-stats", dependencies=[Depends(require_operator)])
+async def get_command_stats():
+    """Report long-poll command channel counters for this worker process"""
+    return command_notifier.stats()
+
+# Stolen registry statistics - set size, version and reloads
+@app.get("/api/__system__/registry-stats", dependencies=[Depends(require_operator)])
+async def get_registry_stats():
+    """Report in-memory stolen registry counters for this worker process"""
+    return stolen_registry.stats()
+
+# Hardware alias statistics - known IDs, reset chains and resolutions
+@app.get("/api/__system__/alias-stats", dependencies=[Depends(require_operator)])
+async def get_alias_stats():
+    """Report hardware-ID alias resolver counters for this worker process"""
+    return hardware_aliases.stats()
+
+# Maintenance statistics - retention policies and the last run's metrics
+@app.get("/api/__system__/maintenance-stats", dependencies=[Depends(require_operator)])
+async def get_maintenance_stats():
+    """Report retention and vacuum metrics for this worker process"""
+    return maintenance.stats()
+
+# Auth cache statistics - verified-token and device-owner hit rates
+@app.get("/api/__system__/auth-stats", dependencies=[Depends(require_operator)])
+async def get_auth_stats():
+    """Report token and device-owner cache counters for this worker process"""
+    return {"tokens": token_cache.stats(), "owners": device_owners.stats()}
+
+# Live location stream statistics - open streams, fan-out and dropped fixes
+@app.get("/api/__system__/live-stats", dependencies=[Depends(require_operator)])
+async def get_live_stats():
+    """Report live location hub counters for this worker process"""
+    return location_hub.stats()
+
+# Slow-query log - statements over the threshold and scans of watched tables,
+# with their plans and the routes that issued them
+@app.get("/api/__system__/slow-queries", dependencies=[Depends(require_operator)])
+async def get_slow_queries():
+    """Report slow statements and table scans seen by this worker process"""
+    return query_profiler.report()
+
+# Log pipeline stats - queued and dropped records, sampled and suppressed events
+@app.get("/api/__system__/log-stats", dependencies=[Depends(require_operator)])
+async def get_log_stats():
+    """Report logging pipeline and event sampling counters for this worker process"""
+    return {"pipeline": log_pipeline.stats(), "events": events.stats()}
+
+# Gauges read when /metrics is scraped
+metrics.gauge("ghosttrack_db_connections_open", "Pooled DB connections opened by this worker",
+              lambda: storage.stats().get("open"))
+metrics.gauge("ghosttrack_db_connections_in_use", "Pooled DB connections checked out",
+              lambda: storage.stats().get("in_use"))
+metrics.gauge("ghosttrack_ingest_queue_depth", "Check-ins queued and not yet written",
+              lambda: checkin_queue.stats()["depth"])
+metrics.gauge("ghosttrack_ingest_queue_capacity", "Check-in queue size limit", lambda: checkin_queue.max_size)
+metrics.gauge("ghosttrack_command_waiters", "Open command long-polls", lambda: command_notifier.stats()["waiting"])
+metrics.gauge("ghosttrack_live_streams", "Open live location streams", lambda: location_hub.stats()["subscribers"])
+metrics.gauge("ghosttrack_stolen_devices", "Stolen hardware IDs in the registry", lambda: stolen_registry.stats()["stolen"])
+
+# Prometheus scrape endpoint - request, DB and queue metrics for this worker process
+@app.get("/metrics")
+async def get_metrics():
+    """Expose this worker's metrics in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Static asset stats - build size, gzip savings and conditional hits
+@app.get("/api/__system__/asset-stats", dependencies=[Depends(require_operator)])
+async def get_asset_stats():
+    """Report static asset pipeline counters for this worker process"""
+    return static_assets.stats()
+
+# Serve static files - fingerprinted and precompressed at startup
+app.mount("/", static_assets, name="static")
 
-# For development, run with: uvicorn app:app --host 0.0.0.0 --port 8000 --reload
\ No newline at end of file
+# For development, run from the repository root with: uvicorn app.app:app --host 0.0.0.0 --port 8000 --reload
\ No newline at end of file
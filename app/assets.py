@@ -0,0 +1,224 @@
+"""Fingerprinted, precompressed static assets for the PWA.
+
+At startup ``StaticAssets.build()`` reads every file under the static
+directory once and
+
+1. names each by its content hash - ``app.js`` is also served as
+   ``app.<hash>.js`` with ``Cache-Control: immutable``, so a cached copy is
+   never revalidated and a changed file gets a new URL;
+2. rewrites the ``src``/``href`` references in the HTML pages to those
+   names (pages themselves keep their URLs, served with ``no-cache`` and an
+   ETag, so a deploy is picked up with one conditional request);
+3. gzips every text asset once, served to clients that accept gzip with
+   ``Content-Encoding`` and ``Vary: Accept-Encoding``;
+4. writes ``asset-manifest.json`` - the precache list and a version the
+   service worker uses to name its cache. The version is also stamped into
+   ``service-worker.js`` (``__ASSET_VERSION__``), so a deploy changes the
+   worker's bytes and browsers install it again.
+
+Service workers keep their fixed URLs: the browser updates them in place.
+Files are not re-read while the process runs.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import time
+
+from starlette.responses import PlainTextResponse, Response
+
+from .logs import events
+
+STATIC_DIR = os.environ.get("GHOSTTRACK_STATIC_DIR", "app/static")
+MANIFEST_NAME = "asset-manifest.json"
+# Workers are registered by a fixed URL and updated by the browser in place
+SERVICE_WORKERS = ("service-worker.js", "stealth-worker.js")
+VERSION_PLACEHOLDER = "__ASSET_VERSION__"
+
+HASH_LENGTH = 12
+GZIP_LEVEL = 9
+# Gzip variants smaller than this share of the original are kept
+GZIP_MAX_RATIO = 0.9
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "application/manifest+json",
+                      "image/svg+xml")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+_REFERENCE_RE = re.compile(r"""(\b(?:src|href)=["'])([^"'#?:]+)(["'])""")
+
+mimetypes.add_type("application/javascript", ".js")
+mimetypes.add_type("application/manifest+json", ".webmanifest")
+
+
+def fingerprinted(path, digest):
+    """"icons/small.png" -> "icons/small.<digest>.png" """
+    stem, extension = posixpath.splitext(path)
+    return f"{stem}.{digest}{extension}"
+
+
+def content_type(path):
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if media_type.startswith("text/") or media_type in ("application/javascript", "application/json"):
+        media_type += "; charset=utf-8"
+    return media_type
+
+
+class Asset:
+    def __init__(self, path, body):
+        self.path = path
+        self.body = body
+        self.content_type = content_type(path)
+        self.digest = hashlib.sha256(body).hexdigest()[:HASH_LENGTH]
+        self.gzipped = None
+        if self.content_type.startswith(COMPRESSIBLE_TYPES):
+            # mtime=0 keeps the gzip bytes (and every worker's copy) deterministic
+            gzipped = gzip.compress(body, GZIP_LEVEL, mtime=0)
+            if len(gzipped) < len(body) * GZIP_MAX_RATIO:
+                self.gzipped = gzipped
+
+    @property
+    def hashed_path(self):
+        return fingerprinted(self.path, self.digest)
+
+
+class StaticAssets:
+    """ASGI app serving the built assets (mounted at "/")"""
+
+    def __init__(self, directory=STATIC_DIR):
+        self.directory = directory
+        self.version = None
+        # URL path (no leading slash) -> (asset, immutable)
+        self._routes = {}
+        self._stats = {"files": 0, "bytes": 0, "gzip_bytes": 0, "build_ms": 0.0,
+                       "hits": 0, "gzip_hits": 0, "not_modified": 0, "not_found": 0}
+
+    def _read(self):
+        files = {}
+        for root, _, names in os.walk(self.directory):
+            for name in sorted(names):
+                full = os.path.join(root, name)
+                path = os.path.relpath(full, self.directory).replace(os.sep, "/")
+                with open(full, "rb") as f:
+                    files[path] = f.read()
+        return files
+
+    def _rewrite(self, path, html, assets):
+        """Point a page's src/href references at fingerprinted names"""
+        base = posixpath.dirname(path)
+
+        def replace(match):
+            reference = match.group(2)
+            target = posixpath.normpath(reference.lstrip("/") if reference.startswith("/")
+                                        else posixpath.join(base, reference))
+            asset = assets.get(target)
+            if asset is None:
+                return match.group(0)
+            hashed = "/" + asset.hashed_path if reference.startswith("/") else \
+                posixpath.relpath(asset.hashed_path, base or ".")
+            return f"{match.group(1)}{hashed}{match.group(3)}"
+
+        return _REFERENCE_RE.sub(replace, html.decode("utf-8")).encode("utf-8")
+
+    def build(self):
+        """Read, fingerprint, rewrite and compress every file (startup, before serving)"""
+        start = time.perf_counter()
+        files = self._read()
+
+        # Everything a page can reference first, then the pages, then the workers
+        assets = {
+            path: Asset(path, body) for path, body in files.items()
+            if not path.endswith(".html") and path not in SERVICE_WORKERS
+        }
+        pages = {
+            path: Asset(path, self._rewrite(path, body, assets))
+            for path, body in files.items() if path.endswith(".html")
+        }
+        everything = {**assets, **pages}
+        self.version = hashlib.sha256(
+            "".join(f"{path}:{asset.digest}\n" for path, asset in sorted(everything.items())).encode()
+        ).hexdigest()[:HASH_LENGTH]
+
+        workers = {
+            path: Asset(path, files[path].replace(VERSION_PLACEHOLDER.encode(), self.version.encode()))
+            for path in SERVICE_WORKERS if path in files
+        }
+
+        # Pages are precached at their own URLs, everything else by fingerprint
+        manifest = {
+            "version": self.version,
+            "assets": {path: asset.hashed_path for path, asset in sorted(assets.items())},
+            "precache": ["/"] + sorted(f"/{path}" for path in pages)
+                        + sorted(f"/{asset.hashed_path}" for asset in assets.values()),
+        }
+        manifest_asset = Asset(MANIFEST_NAME, json.dumps(manifest, indent=2).encode())
+
+        routes = {}
+        for path, asset in assets.items():
+            routes[path] = (asset, False)
+            routes[asset.hashed_path] = (asset, True)
+        for path, asset in {**pages, **workers, MANIFEST_NAME: manifest_asset}.items():
+            routes[path] = (asset, False)
+        self._routes = routes
+
+        built = [*assets.values(), *pages.values(), *workers.values(), manifest_asset]
+        self._stats.update(
+            files=len(built),
+            bytes=sum(len(asset.body) for asset in built),
+            gzip_bytes=sum(len(asset.gzipped or asset.body) for asset in built),
+            build_ms=round((time.perf_counter() - start) * 1000, 3),
+        )
+        events.event("static_assets_built", files=len(built), version=self.version,
+                     bytes=self._stats["bytes"], gzip_bytes=self._stats["gzip_bytes"])
+        return manifest
+
+    def resolve(self, path):
+        """(asset, immutable) for a request path, or None"""
+        path = path.lstrip("/")
+        if path == "" or path.endswith("/"):
+            path += "index.html"
+        return self._routes.get(path)
+
+    async def __call__(self, scope, receive, send):
+        assert scope["type"] == "http"
+        if scope["method"] not in ("GET", "HEAD"):
+            response = PlainTextResponse("Method Not Allowed", status_code=405, headers={"Allow": "GET, HEAD"})
+            await response(scope, receive, send)
+            return
+
+        found = self.resolve(scope["path"])
+        if found is None:
+            self._stats["not_found"] += 1
+            await PlainTextResponse("Not Found", status_code=404)(scope, receive, send)
+            return
+
+        asset, immutable = found
+        request_headers = dict(scope["headers"])
+        use_gzip = asset.gzipped is not None and b"gzip" in request_headers.get(b"accept-encoding", b"")
+        etag = f'"{asset.digest}-gz"' if use_gzip else f'"{asset.digest}"'
+        headers = {"ETag": etag, "Cache-Control": IMMUTABLE if immutable else REVALIDATE}
+        if asset.gzipped is not None:
+            headers["Vary"] = "Accept-Encoding"
+
+        self._stats["hits"] += 1
+        if_none_match = request_headers.get(b"if-none-match", b"").decode("latin-1")
+        if etag in if_none_match or if_none_match.strip() == "*":
+            self._stats["not_modified"] += 1
+            await Response(status_code=304, headers=headers)(scope, receive, send)
+            return
+
+        if use_gzip:
+            self._stats["gzip_hits"] += 1
+            headers["Content-Encoding"] = "gzip"
+        body = asset.gzipped if use_gzip else asset.body
+        await Response(body, headers=headers, media_type=asset.content_type)(scope, receive, send)
+
+    def stats(self):
+        return {"version": self.version, **self._stats}
+
+
+# Process-wide asset server, built in the app lifespan
+static_assets = StaticAssets()
@@ -0,0 +1,115 @@
+"""Cached token verification and device-ownership lookups.
+
+Dashboards and the web app poll with the same long-lived JWT, so a verified
+token is cached (keyed by its SHA-256) until the cache TTL or the token's
+own ``exp``, whichever comes first. Invalid tokens are cached briefly too,
+so a client retrying a bad token does not cost an HMAC check each time.
+Revoked tokens are kept by the storage backend; another worker process may
+keep accepting one it had already cached for at most ``TOKEN_CACHE_TTL``.
+"""
+import hashlib
+import os
+import time
+from datetime import datetime
+
+import jwt
+
+from .cache import LRUCache, MISSING
+
+TOKEN_CACHE_SIZE = int(os.environ.get("GHOSTTRACK_TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.environ.get("GHOSTTRACK_TOKEN_CACHE_TTL", "60"))
+TOKEN_NEGATIVE_TTL = float(os.environ.get("GHOSTTRACK_TOKEN_NEGATIVE_TTL", "10"))
+
+OWNER_CACHE_SIZE = int(os.environ.get("GHOSTTRACK_OWNER_CACHE_SIZE", "10000"))
+# A device's owner is fixed when it is first registered, so owners can be
+# cached for long; "no such device" is cached briefly since it can change
+OWNER_CACHE_TTL = float(os.environ.get("GHOSTTRACK_OWNER_CACHE_TTL", "300"))
+OWNER_NEGATIVE_TTL = float(os.environ.get("GHOSTTRACK_OWNER_NEGATIVE_TTL", "5"))
+
+
+def token_key(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenCache:
+    def __init__(self, storage, secret, algorithm, max_entries=TOKEN_CACHE_SIZE,
+                 ttl=TOKEN_CACHE_TTL, negative_ttl=TOKEN_NEGATIVE_TTL):
+        self.storage = storage
+        self.secret = secret
+        self.algorithm = algorithm
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache = LRUCache(max_entries)
+
+    def decode(self, token):
+        """Verify a token's signature and expiry, returning (user_id, exp) or None"""
+        try:
+            payload = jwt.decode(token, self.secret, algorithms=[self.algorithm])
+            return int(payload["sub"]), payload["exp"]
+        except (jwt.PyJWTError, KeyError, TypeError, ValueError):
+            return None
+
+    async def verify(self, token):
+        """Return the token's user id, or None if it is invalid or revoked"""
+        if not token:
+            return None
+
+        key = token_key(token)
+        user_id = self.cache.get(key)
+        if user_id is not MISSING:
+            return user_id
+
+        decoded = self.decode(token)
+        if decoded is None or await self.storage.token_revoked(key):
+            self.cache.set(key, None, time.monotonic() + self.negative_ttl)
+            return None
+
+        user_id, exp = decoded
+        # Never cache a token past its own expiry
+        lifetime = min(self.ttl, exp - time.time())
+        self.cache.set(key, user_id, time.monotonic() + lifetime)
+        return user_id
+
+    async def revoke(self, token):
+        """Reject ``token`` from now on; returns False if it was not valid"""
+        decoded = self.decode(token)
+        if decoded is None:
+            return False
+
+        key = token_key(token)
+        expires_at = datetime.utcfromtimestamp(decoded[1]).isoformat()
+        await self.storage.revoke_token(key, expires_at, datetime.utcnow().isoformat())
+        self.cache.set(key, None, time.monotonic() + self.ttl)
+        return True
+
+    def stats(self):
+        return self.cache.stats()
+
+
+class DeviceOwners:
+    """Cache of hardware ID -> owning user id for per-request ownership checks"""
+
+    def __init__(self, storage, max_entries=OWNER_CACHE_SIZE, ttl=OWNER_CACHE_TTL,
+                 negative_ttl=OWNER_NEGATIVE_TTL):
+        self.storage = storage
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache = LRUCache(max_entries)
+
+    async def get(self, hardware_id):
+        """Return the user id that owns ``hardware_id``, or None"""
+        owner = self.cache.get(hardware_id)
+        if owner is not MISSING:
+            return owner
+
+        owner = await self.storage.device_owner(hardware_id)
+        ttl = self.ttl if owner is not None else self.negative_ttl
+        self.cache.set(hardware_id, owner, time.monotonic() + ttl)
+        return owner
+
+    def forget(self, hardware_id):
+        """Drop a cached owner after the device row is created or changed"""
+        self.cache.pop(hardware_id)
+
+    def stats(self):
+        return self.cache.stats()
@@ -0,0 +1,183 @@
+"""Content-addressed blob store for stolen device photos.
+
+Photos are written to disk once, named by the SHA-256 of their bytes, and
+only their metadata lives in SQLite. Identical uploads share one file, and
+because a blob's name never changes it can be served with strong ETags and
+immutable cache headers.
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+
+from .db import DB_PATH
+from .logs import events
+
+# Blobs live next to the database they belong to unless configured otherwise
+BLOB_DIR = os.environ.get("GHOSTTRACK_BLOB_DIR", os.path.join(os.path.dirname(DB_PATH), "photos"))
+MAX_PHOTO_BYTES = int(os.environ.get("GHOSTTRACK_MAX_PHOTO_BYTES", str(10 * 1024 * 1024)))
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Leading bytes of the image formats devices upload
+_MAGIC_TYPES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+    (b"RIFF", "image/webp"),
+]
+
+
+class BlobTooLarge(Exception):
+    """Raised when an upload exceeds MAX_PHOTO_BYTES"""
+
+
+def sniff_content_type(head, fallback="application/octet-stream"):
+    for magic, content_type in _MAGIC_TYPES:
+        if head.startswith(magic):
+            return content_type
+    return fallback
+
+
+def is_digest(value):
+    return bool(_DIGEST_RE.match(value or ""))
+
+
+class BlobStore:
+    def __init__(self, root=BLOB_DIR, max_bytes=MAX_PHOTO_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._tmp = os.path.join(root, "tmp")
+
+    def path(self, digest):
+        if not is_digest(digest):
+            raise ValueError(f"Invalid blob digest: {digest!r}")
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def _touch(self, target):
+        # A re-upload refreshes the blob's mtime, so retention never removes
+        # a blob whose metadata row is about to be written
+        try:
+            os.utime(target)
+        except FileNotFoundError:
+            pass
+
+    def remove(self, digest, stored_before):
+        """Delete an unreferenced blob unless it was stored or re-uploaded after ``stored_before`` (epoch seconds)"""
+        target = self.path(digest)
+        try:
+            stat = os.stat(target)
+            if stat.st_mtime >= stored_before:
+                return 0
+            os.unlink(target)
+        except FileNotFoundError:
+            return 0
+        return stat.st_size
+
+    def _open_temp(self):
+        os.makedirs(self._tmp, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=self._tmp, delete=False)
+
+    def _commit(self, tmp_path, digest):
+        target = self.path(digest)
+        if os.path.exists(target):
+            # Same content already stored - keep the existing file
+            os.unlink(tmp_path)
+            self._touch(target)
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(tmp_path, target)
+
+    def put_bytes(self, data):
+        """Store an in-memory blob, returning (digest, size)"""
+        if len(data) > self.max_bytes:
+            raise BlobTooLarge(f"Blob exceeds {self.max_bytes} bytes")
+        digest = hashlib.sha256(data).hexdigest()
+        if self.exists(digest):
+            self._touch(self.path(digest))
+        else:
+            with self._open_temp() as tmp:
+                tmp.write(data)
+            self._commit(tmp.name, digest)
+        return digest, len(data)
+
+    async def put_stream(self, chunks):
+        """Stream an upload to disk while hashing it.
+
+        ``chunks`` is an async iterator of bytes. Returns (digest, size, head)
+        where ``head`` is the first bytes of the blob, for content sniffing.
+        File I/O runs in the default executor so large uploads never block
+        the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        hasher = hashlib.sha256()
+        size = 0
+        head = b""
+        tmp = await loop.run_in_executor(None, self._open_temp)
+        try:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise BlobTooLarge(f"Blob exceeds {self.max_bytes} bytes")
+                if len(head) < 16:
+                    head += chunk[:16 - len(head)]
+                hasher.update(chunk)
+                await loop.run_in_executor(None, tmp.write, chunk)
+            await loop.run_in_executor(None, tmp.close)
+            digest = hasher.hexdigest()
+            await loop.run_in_executor(None, self._commit, tmp.name, digest)
+            return digest, size, head
+        except BaseException:
+            tmp.close()
+            if os.path.exists(tmp.name):
+                os.unlink(tmp.name)
+            raise
+
+
+def migrate_legacy_photos(conn, store, batch_size=100):
+    """Move base64 photos still stored in SQLite into the blob store"""
+    moved = 0
+    while True:
+        rows = conn.execute(
+            """
+            SELECT id, photo_data FROM stolen_device_photos
+            WHERE photo_data IS NOT NULL AND content_hash IS NULL
+            LIMIT ?
+            """,
+            (batch_size,)
+        ).fetchall()
+        if not rows:
+            break
+
+        for row in rows:
+            try:
+                data = base64.b64decode(row["photo_data"], validate=False)
+            except (binascii.Error, ValueError):
+                data = row["photo_data"].encode()
+            digest, size = store.put_bytes(data)
+            conn.execute(
+                """
+                UPDATE stolen_device_photos
+                SET content_hash = ?, size = ?, content_type = ?, photo_data = NULL
+                WHERE id = ?
+                """,
+                (digest, size, sniff_content_type(data[:16], "image/jpeg"), row["id"])
+            )
+        conn.commit()
+        moved += len(rows)
+
+    if moved:
+        events.event("legacy_photos_moved", photos=moved)
+    return moved
+
+
+# Process-wide store
+photo_store = BlobStore()
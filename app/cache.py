@@ -0,0 +1,74 @@
+"""Small bounded in-memory caches used in front of the database"""
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by LRUCache.get when a key is absent, so ``None`` can be cached
+MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe LRU mapping with an optional per-entry time-to-live.
+
+    ``max_entries`` bounds memory; the least recently used entry is evicted
+    first. Entries older than ``ttl`` seconds (or their own ``expires_at``)
+    are treated as absent, which bounds how stale another worker process's
+    writes can look from this one.
+    """
+
+    def __init__(self, max_entries, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires_at=None):
+        """Store a value; ``expires_at`` is a ``time.monotonic()`` deadline"""
+        if expires_at is None and self.ttl is not None:
+            expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return MISSING if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
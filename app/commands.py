@@ -0,0 +1,81 @@
+"""In-process wake-ups for devices long-polling for remote commands.
+
+A device waiting on ``GET /api/device-commands/wait`` subscribes to its
+hardware ID and sleeps on an ``asyncio.Event`` instead of re-querying
+``device_commands``; ``trigger_remote_action`` calls ``notify`` after it
+inserts a command so the waiting request returns immediately. Notifications
+do not cross uvicorn worker processes, so a command issued through another
+worker is picked up when the waiter's timeout expires and it re-checks the
+table - delivery is never lost, only delayed by at most one poll window.
+"""
+import asyncio
+import os
+from contextlib import contextmanager
+
+# Longest a device request is held open, and how many may be held at once
+LONG_POLL_TIMEOUT = float(os.environ.get("GHOSTTRACK_LONG_POLL_TIMEOUT", "25"))
+LONG_POLL_MAX_TIMEOUT = 55
+LONG_POLL_MAX_WAITERS = int(os.environ.get("GHOSTTRACK_LONG_POLL_MAX_WAITERS", "5000"))
+
+
+class CommandNotifier:
+    def __init__(self, max_waiters=LONG_POLL_MAX_WAITERS):
+        self.max_waiters = max_waiters
+        self._waiters = {}
+        self._count = 0
+        self._stats = {"waits": 0, "wakeups": 0, "timeouts": 0, "rejected": 0, "notifies": 0}
+
+    @property
+    def full(self):
+        return self._count >= self.max_waiters
+
+    @contextmanager
+    def subscribe(self, hardware_id):
+        """Register interest in ``hardware_id`` before checking for commands.
+
+        Subscribing first means a command inserted between the check and
+        the wait still sets the event, so it is never missed.
+        """
+        event = asyncio.Event()
+        self._waiters.setdefault(hardware_id, set()).add(event)
+        self._count += 1
+        try:
+            yield event
+        finally:
+            self._count -= 1
+            waiters = self._waiters.get(hardware_id)
+            if waiters is not None:
+                waiters.discard(event)
+                if not waiters:
+                    del self._waiters[hardware_id]
+
+    async def wait(self, event, timeout):
+        """Wait for a notification, returning False on timeout"""
+        self._stats["waits"] += 1
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            return False
+        self._stats["wakeups"] += 1
+        return True
+
+    def reject(self):
+        self._stats["rejected"] += 1
+
+    def notify(self, hardware_id):
+        """Wake every request waiting on ``hardware_id`` in this process"""
+        self._stats["notifies"] += 1
+        for event in self._waiters.get(hardware_id, ()):
+            event.set()
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["waiting"] = self._count
+        stats["devices"] = len(self._waiters)
+        stats["max_waiters"] = self.max_waiters
+        return stats
+
+
+# Process-wide notifier for device command channels
+command_notifier = CommandNotifier()
@@ -0,0 +1,68 @@
+"""Conditional GET and compression for the dashboard's polling endpoints.
+
+The recovery dashboard polls ``device-info`` and the stolen-device history
+every minute, and most polls find nothing new. Responses carry a weak ETag
+built from the device's storage version (``device_versions``, bumped by
+triggers on every change to its fixes, photos, theft report or details)
+and ``Cache-Control: no-cache``, so the browser revalidates each poll with
+``If-None-Match`` and an unchanged device is answered with a bodyless 304
+after one primary-key read.
+
+``DashboardGZipMiddleware`` gzips the JSON those endpoints return. It is
+limited to those paths: photos are already compressed and served with
+Range support, and live streams must not be buffered.
+"""
+import hashlib
+import os
+
+from starlette.middleware.gzip import GZipMiddleware
+
+GZIP_MIN_BYTES = int(os.environ.get("GHOSTTRACK_GZIP_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.environ.get("GHOSTTRACK_GZIP_LEVEL", "6"))
+
+# Routes whose JSON responses are compressed
+GZIP_PATHS = (
+    "/api/device-info",
+    "/api/stolen-device-locations",
+    "/api/stolen-device-locations/track",
+)
+
+# Revalidate on every poll; the token in the URL keeps shared caches out
+CACHE_HEADERS = {"Cache-Control": "private, no-cache"}
+
+
+def device_etag(hardware_id, version):
+    """Weak ETag of a device's state - weak because the gzip and identity bodies differ.
+
+    The client-supplied hardware ID is hashed, so quotes or non-latin-1
+    characters in it cannot break the header.
+    """
+    digest = hashlib.sha256(hardware_id.encode()).hexdigest()[:16]
+    return f'W/"{digest}.{version}"'
+
+
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match header lists ``etag`` (weak comparison) or is "*" """
+    if not if_none_match:
+        return False
+    opaque = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque:
+            return True
+    return False
+
+
+class DashboardGZipMiddleware:
+    """Starlette's gzip middleware, applied only to ``GZIP_PATHS``"""
+
+    def __init__(self, app, paths=GZIP_PATHS, minimum_size=GZIP_MIN_BYTES, compresslevel=GZIP_LEVEL):
+        self.app = app
+        self.paths = frozenset(paths)
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=compresslevel)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.paths:
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
@@ -0,0 +1,251 @@
+"""SQLite connection pool and async data-access layer shared by every request handler"""
+import asyncio
+import contextvars
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from .metrics import db_wait, db_query_latency, db_errors
+from .profiling import ProfiledConnection
+
+# Database configuration (override with environment variables per deployment)
+DB_PATH = os.environ.get("GHOSTTRACK_DB", "ghosttrack.db")
+POOL_SIZE = int(os.environ.get("GHOSTTRACK_DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.environ.get("GHOSTTRACK_DB_POOL_TIMEOUT", "10"))
+BUSY_TIMEOUT_MS = int(os.environ.get("GHOSTTRACK_DB_BUSY_TIMEOUT_MS", "5000"))
+MMAP_SIZE = int(os.environ.get("GHOSTTRACK_DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+CACHED_STATEMENTS = int(os.environ.get("GHOSTTRACK_DB_CACHED_STATEMENTS", "256"))
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection is returned to the pool in time"""
+
+
+class ConnectionPool:
+    """Fixed-size pool of long-lived, pre-configured SQLite connections.
+
+    Connections are opened lazily up to ``size`` and reused for the life of
+    the process, so the WAL/pragma setup and the prepared statement cache
+    are paid once per connection instead of once per request. Every uvicorn
+    worker process gets its own pool; size it so that
+    ``workers * size`` stays well below what the disk can serve.
+    """
+
+    def __init__(self, path=DB_PATH, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._created = 0
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._acquires = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._timeouts = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=CACHED_STATEMENTS,
+            # Times every statement for the slow-query log
+            factory=ProfiledConnection,
+        )
+        conn.row_factory = sqlite3.Row
+        # Only takes effect on a new database (or after VACUUM) - lets
+        # retention maintenance hand freed pages back to the filesystem
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def acquire(self):
+        """Take a connection from the pool, opening a new one if allowed"""
+        if self._closed:
+            raise PoolTimeout("Connection pool is closed")
+
+        start = time.perf_counter()
+        waited = False
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+
+            if can_create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                waited = True
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s")
+
+        with self._lock:
+            self._acquires += 1
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+            if waited:
+                self._waits += 1
+                self._wait_seconds += time.perf_counter() - start
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any open transaction"""
+        with self._lock:
+            self._in_use -= 1
+
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Broken connection - drop it so a fresh one is opened next time
+            with self._lock:
+                self._created -= 1
+            conn.close()
+            return
+
+        if self._closed:
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Close all idle connections; busy ones are closed on release"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "path": self.path,
+                "size": self.size,
+                "open": self._created,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "peak_in_use": self._peak_in_use,
+                "acquires": self._acquires,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": round(self._wait_seconds * 1000 / self._waits, 3) if self._waits else 0.0,
+            }
+
+
+def _fetchone(conn, sql, params):
+    return conn.execute(sql, params).fetchone()
+
+
+def _fetchall(conn, sql, params):
+    return conn.execute(sql, params).fetchall()
+
+
+def _execute(conn, sql, params):
+    cursor = conn.execute(sql, params)
+    conn.commit()
+    return cursor.lastrowid
+
+
+def _executemany(conn, sql, seq_of_params):
+    cursor = conn.executemany(sql, seq_of_params)
+    conn.commit()
+    return cursor.rowcount
+
+
+class AsyncDatabase:
+    """Awaitable facade that runs all SQLite work off the event loop.
+
+    Queries are executed on a bounded thread pool no larger than the
+    connection pool, so a slow INSERT or history scan only occupies one
+    DB thread while the event loop keeps serving other requests.
+    """
+
+    def __init__(self, pool, max_workers=None):
+        self.pool = pool
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or pool.size,
+            thread_name_prefix="ghosttrack-db",
+        )
+
+    def _call(self, fn, args, name, submitted):
+        with self.pool.connection() as conn:
+            start = time.perf_counter()
+            db_wait.observe(start - submitted)
+            try:
+                return fn(conn, *args)
+            except Exception:
+                db_errors.inc(name)
+                raise
+            finally:
+                db_query_latency.observe(time.perf_counter() - start, name)
+
+    async def run(self, fn, *args, name=None):
+        """Run ``fn(conn, *args)`` on a pooled connection in the DB executor.
+
+        Use this for multi-statement work that must share a transaction;
+        ``fn`` is responsible for committing. Timings are recorded under
+        ``name`` (default: the function's name).
+        """
+        loop = asyncio.get_running_loop()
+        # Carry the request context over, so slow queries know their route
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._executor, context.run, self._call, fn, args, name or fn.__name__.lstrip("_"), time.perf_counter()
+        )
+
+    async def fetchone(self, sql, params=(), name="fetchone"):
+        return await self.run(_fetchone, sql, params, name=name)
+
+    async def fetchall(self, sql, params=(), name="fetchall"):
+        return await self.run(_fetchall, sql, params, name=name)
+
+    async def execute(self, sql, params=(), name="execute"):
+        """Execute and commit a single statement, returning the last row id"""
+        return await self.run(_execute, sql, params, name=name)
+
+    async def executemany(self, sql, seq_of_params, name="executemany"):
+        """Execute and commit a statement for every parameter set, returning the row count"""
+        return await self.run(_executemany, sql, list(seq_of_params), name=name)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+# Process-wide pool and async facade
+pool = ConnectionPool()
+database = AsyncDatabase(pool)
@@ -0,0 +1,76 @@
+"""Distance helpers for spatial searches over last-known device positions.
+
+Candidate devices come from the ``latest_device_rtree`` R*Tree, which only
+answers rectangle queries; these helpers turn a radius into a bounding box
+for that lookup and then rank the candidates by great-circle distance in a
+single vectorized pass.
+"""
+import math
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE_LAT = 111320.0
+
+
+def bbox_around(latitude, longitude, radius_m):
+    """Bounding box (min_lat, min_lng, max_lat, max_lng) enclosing a circle"""
+    dlat = radius_m / METERS_PER_DEGREE_LAT
+    cos_lat = math.cos(math.radians(latitude))
+    if cos_lat < 1e-6 or abs(latitude) + dlat >= 90:
+        # The circle reaches a pole - every longitude is in range
+        return max(latitude - dlat, -90.0), -180.0, min(latitude + dlat, 90.0), 180.0
+    dlng = min(radius_m / (METERS_PER_DEGREE_LAT * cos_lat), 180.0)
+    return latitude - dlat, wrap_longitude(longitude - dlng), latitude + dlat, wrap_longitude(longitude + dlng)
+
+
+def wrap_longitude(longitude):
+    return (longitude + 180.0) % 360.0 - 180.0 if abs(longitude) > 180.0 else longitude
+
+
+def lng_ranges(min_lng, max_lng):
+    """Split a longitude span that crosses the antimeridian into two ranges"""
+    if min_lng <= max_lng:
+        return [(min_lng, max_lng)]
+    return [(min_lng, 180.0), (-180.0, max_lng)]
+
+
+def finite_coordinates(latitude, longitude):
+    """True if both values are real, finite numbers (rows can hold NULL or text)"""
+    try:
+        return math.isfinite(float(latitude)) and math.isfinite(float(longitude))
+    except (TypeError, ValueError):
+        return False
+
+
+def haversine_m(latitude, longitude, latitudes, longitudes):
+    """Great-circle distance in metres from one point to arrays of points"""
+    lat1 = math.radians(latitude)
+    lat2 = np.radians(latitudes)
+    dlat = lat2 - lat1
+    dlng = np.radians(longitudes) - math.radians(longitude)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def rank_by_distance(rows, latitude, longitude, radius_m=None, limit=None):
+    """Return rows as dicts with ``distance_m``, nearest first.
+
+    Rows outside ``radius_m`` (the corners of the bounding box) and rows
+    without finite coordinates are dropped.
+    """
+    rows = [row for row in rows if finite_coordinates(row["latitude"], row["longitude"])]
+    if not rows:
+        return []
+
+    latitudes = np.fromiter((row["latitude"] for row in rows), dtype=float, count=len(rows))
+    longitudes = np.fromiter((row["longitude"] for row in rows), dtype=float, count=len(rows))
+    distances = haversine_m(latitude, longitude, latitudes, longitudes)
+
+    order = np.argsort(distances, kind="stable")
+    if radius_m is not None:
+        order = order[distances[order] <= radius_m]
+    if limit is not None:
+        order = order[:limit]
+
+    return [dict(rows[i], distance_m=round(float(distances[i]), 1)) for i in order]
@@ -0,0 +1,173 @@
+"""Write-behind ingest queue that group-commits device check-ins"""
+import asyncio
+import os
+import time
+
+from .logs import events
+from .storage import storage
+
+# Queue configuration (override with environment variables per deployment)
+INGEST_QUEUE_SIZE = int(os.environ.get("GHOSTTRACK_INGEST_QUEUE_SIZE", "10000"))
+INGEST_BATCH_SIZE = int(os.environ.get("GHOSTTRACK_INGEST_BATCH_SIZE", "500"))
+INGEST_FLUSH_MS = float(os.environ.get("GHOSTTRACK_INGEST_FLUSH_MS", "200"))
+INGEST_PUT_TIMEOUT = float(os.environ.get("GHOSTTRACK_INGEST_PUT_TIMEOUT", "1"))
+INGEST_FLUSH_RETRIES = 3
+
+class IngestQueue:
+    """Bounded in-process queue that turns many small INSERTs into group commits.
+
+    Producers ``await submit(row)`` and return as soon as the row is queued.
+    A background task writes queued rows in one transaction per batch,
+    flushing when ``batch_size`` rows have accumulated or ``flush_ms`` has
+    passed since the first row of the batch arrived. When the queue is full
+    producers wait up to ``put_timeout`` seconds (backpressure) and then
+    fall back to writing their row directly, so nothing is dropped.
+    """
+
+    def __init__(self, write, max_size=INGEST_QUEUE_SIZE, batch_size=INGEST_BATCH_SIZE,
+                 flush_ms=INGEST_FLUSH_MS, put_timeout=INGEST_PUT_TIMEOUT):
+        # async write(rows) stores one batch atomically
+        self.write = write
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.put_timeout = put_timeout
+        self._queue = None
+        self._task = None
+        self._batch = []
+        self._flushing = None
+        self._stats = {
+            "enqueued": 0,
+            "flushes": 0,
+            "flushed_rows": 0,
+            "flush_errors": 0,
+            "failed_rows": 0,
+            "backpressure_waits": 0,
+            "direct_writes": 0,
+            "flush_seconds": 0.0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+        }
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def start(self):
+        """Start the background flusher on the running event loop"""
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write out everything still queued"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+        if self._flushing is not None:
+            await self._flushing
+
+        rows, self._batch = self._batch, []
+        while True:
+            try:
+                rows.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+
+        for start in range(0, len(rows), self.batch_size):
+            await self._flush(rows[start:start + self.batch_size])
+
+    async def submit(self, row):
+        """Queue one row for the next group commit"""
+        if self._task is None:
+            # Not running inside the app lifespan - write straight through
+            await self._write_direct([row])
+            return
+
+        try:
+            self._queue.put_nowait(row)
+        except asyncio.QueueFull:
+            self._stats["backpressure_waits"] += 1
+            try:
+                await asyncio.wait_for(self._queue.put(row), self.put_timeout)
+            except asyncio.TimeoutError:
+                events.warning("ingest_queue_full", depth=self._queue.qsize())
+                await self._write_direct([row])
+                return
+        self._stats["enqueued"] += 1
+
+    async def submit_many(self, rows):
+        for row in rows:
+            await self.submit(row)
+
+    async def _write_direct(self, rows):
+        await self.write(rows)
+        self._stats["direct_writes"] += len(rows)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch.append(await self._queue.get())
+            deadline = loop.time() + self.flush_interval
+
+            # Keep collecting until the batch is full or the flush window closes
+            while len(self._batch) < self.batch_size:
+                try:
+                    self._batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    self._batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            batch, self._batch = self._batch, []
+            # Shield the write so shutdown never interrupts a commit half way
+            self._flushing = asyncio.ensure_future(self._flush(batch))
+            await asyncio.shield(self._flushing)
+            self._flushing = None
+
+    async def _flush(self, rows):
+        for attempt in range(1, INGEST_FLUSH_RETRIES + 1):
+            start = time.perf_counter()
+            try:
+                await self.write(rows)
+            except Exception as e:
+                self._stats["flush_errors"] += 1
+                events.error("ingest_flush_failed", rows=len(rows), attempt=attempt, error=str(e))
+                await asyncio.sleep(0.1 * attempt)
+                continue
+
+            elapsed = time.perf_counter() - start
+            self._stats["flushes"] += 1
+            self._stats["flushed_rows"] += len(rows)
+            self._stats["flush_seconds"] += elapsed
+            self._stats["last_flush_ms"] = round(elapsed * 1000, 3)
+            self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], self._stats["last_flush_ms"])
+            return
+
+        self._stats["failed_rows"] += len(rows)
+        events.error("ingest_rows_dropped", rows=len(rows), attempts=INGEST_FLUSH_RETRIES)
+
+    def stats(self):
+        stats = dict(self._stats)
+        flush_seconds = stats.pop("flush_seconds")
+        # Rows already pulled into the batch being collected are still unwritten
+        stats["depth"] = (self._queue.qsize() if self._queue is not None else 0) + len(self._batch)
+        stats["max_size"] = self.max_size
+        stats["running"] = self.running
+        stats["avg_flush_ms"] = round(flush_seconds * 1000 / stats["flushes"], 3) if stats["flushes"] else 0.0
+        stats["avg_batch_size"] = round(stats["flushed_rows"] / stats["flushes"], 1) if stats["flushes"] else 0.0
+        return stats
+
+
+# Process-wide queue for stolen device check-ins
+checkin_queue = IngestQueue(storage.add_stolen_fixes)
@@ -0,0 +1,78 @@
+"""Last-known position store for users and devices.
+
+The storage backend keeps one latest position per user / hardware ID current
+as fixes are stored (on SQLite, the ``latest_locations`` and
+``latest_device_locations`` tables, maintained by triggers on the history
+tables in the same transaction as the insert). Reads go through a bounded LRU that ingest handlers update
+write-through, so polling for the current position never touches the
+history tables and usually never touches SQLite at all.
+"""
+import os
+
+from .cache import LRUCache, MISSING
+from .storage import storage
+
+LATEST_CACHE_SIZE = int(os.environ.get("GHOSTTRACK_LATEST_CACHE_SIZE", "10000"))
+# Bounds how long another worker's ingest can go unseen by this worker's cache
+LATEST_CACHE_TTL = float(os.environ.get("GHOSTTRACK_LATEST_CACHE_TTL", "5"))
+
+
+def _newer(current, timestamp):
+    return current is None or current["timestamp"] is None or (timestamp or "") >= current["timestamp"]
+
+
+class LatestPositions:
+    def __init__(self, storage, max_entries=LATEST_CACHE_SIZE, ttl=LATEST_CACHE_TTL):
+        self.storage = storage
+        self.by_user = LRUCache(max_entries, ttl)
+        self.by_device = LRUCache(max_entries, ttl)
+
+    async def _load(self, cache, key, fetch):
+        position = cache.get(key)
+        if position is not MISSING:
+            return position
+
+        row = await fetch(key)
+        position = dict(row) if row else None
+        # Cache misses too, so devices that never checked in stay cheap to poll
+        cache.set(key, position)
+        return position
+
+    async def for_user(self, user_id):
+        """Latest {latitude, longitude, timestamp} for a user, or None"""
+        return await self._load(self.by_user, user_id, self.storage.latest_user_location)
+
+    async def for_device(self, hardware_id):
+        """Latest {latitude, longitude, timestamp} for a device, or None"""
+        return await self._load(self.by_device, hardware_id, self.storage.latest_device_location)
+
+    async def refresh_device(self, hardware_id):
+        """Latest position for a device, re-read from storage (a newer cached one wins).
+
+        For responses tagged with the device's storage version, which must
+        not carry a position older than that version.
+        """
+        row = await self.storage.latest_device_location(hardware_id)
+        if row:
+            self.record_device(hardware_id, row["latitude"], row["longitude"], row["timestamp"])
+        return self.by_device.get(hardware_id, None)
+
+    def _record(self, cache, key, latitude, longitude, timestamp):
+        current = cache.get(key, None)
+        if _newer(current, timestamp):
+            cache.set(key, {"latitude": latitude, "longitude": longitude, "timestamp": timestamp})
+
+    def record_user(self, user_id, latitude, longitude, timestamp):
+        """Write-through after a user fix is stored"""
+        self._record(self.by_user, user_id, latitude, longitude, timestamp)
+
+    def record_device(self, hardware_id, latitude, longitude, timestamp):
+        """Write-through after a stolen device fix is stored or queued"""
+        self._record(self.by_device, hardware_id, latitude, longitude, timestamp)
+
+    def stats(self):
+        return {"users": self.by_user.stats(), "devices": self.by_device.stats()}
+
+
+# Process-wide store
+latest_positions = LatestPositions(storage)
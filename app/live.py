@@ -0,0 +1,100 @@
+"""In-process fan-out of newly ingested stolen-device fixes to live dashboards.
+
+Each open dashboard stream subscribes to one hardware ID and gets its own
+bounded buffer. Publishing never blocks an ingest handler: when a slow
+subscriber's buffer is full its oldest fix is dropped, and the dashboard
+catches up from the history endpoint on its periodic resync. Fixes only fan
+out within the worker process that ingested them.
+"""
+import asyncio
+import os
+from collections import deque
+from contextlib import contextmanager
+
+LIVE_BUFFER_SIZE = int(os.environ.get("GHOSTTRACK_LIVE_BUFFER_SIZE", "100"))
+LIVE_MAX_SUBSCRIBERS = int(os.environ.get("GHOSTTRACK_LIVE_MAX_SUBSCRIBERS", "1000"))
+# Keep-alive comment interval, below typical proxy idle timeouts
+LIVE_HEARTBEAT_SECONDS = float(os.environ.get("GHOSTTRACK_LIVE_HEARTBEAT_SECONDS", "15"))
+
+
+class Subscription:
+    def __init__(self, hardware_id, max_buffer):
+        self.hardware_id = hardware_id
+        self.dropped = 0
+        self._buffer = deque(maxlen=max_buffer)
+        self._ready = asyncio.Event()
+
+    def push(self, fix):
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(fix)
+        self._ready.set()
+
+    async def next_batch(self, timeout):
+        """Return buffered fixes, waiting up to ``timeout`` for one to arrive"""
+        if not self._buffer:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self._ready.clear()
+        fixes = list(self._buffer)
+        self._buffer.clear()
+        return fixes
+
+
+class LocationHub:
+    def __init__(self, max_buffer=LIVE_BUFFER_SIZE, max_subscribers=LIVE_MAX_SUBSCRIBERS):
+        self.max_buffer = max_buffer
+        self.max_subscribers = max_subscribers
+        self._subscribers = {}
+        self._count = 0
+        self._stats = {"published": 0, "delivered": 0, "dropped": 0, "subscribed": 0, "rejected": 0}
+
+    @property
+    def full(self):
+        return self._count >= self.max_subscribers
+
+    def reject(self):
+        self._stats["rejected"] += 1
+
+    @contextmanager
+    def subscribe(self, hardware_id):
+        subscription = Subscription(hardware_id, self.max_buffer)
+        self._subscribers.setdefault(hardware_id, set()).add(subscription)
+        self._count += 1
+        self._stats["subscribed"] += 1
+        try:
+            yield subscription
+        finally:
+            self._count -= 1
+            self._stats["dropped"] += subscription.dropped
+            subscribers = self._subscribers.get(hardware_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[hardware_id]
+
+    def publish(self, hardware_id, latitude, longitude, timestamp):
+        """Push a new fix to every stream watching ``hardware_id``"""
+        self._stats["published"] += 1
+        subscribers = self._subscribers.get(hardware_id)
+        if not subscribers:
+            return
+
+        fix = {"latitude": latitude, "longitude": longitude, "timestamp": timestamp}
+        for subscription in subscribers:
+            subscription.push(fix)
+        self._stats["delivered"] += len(subscribers)
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["dropped"] += sum(s.dropped for subs in self._subscribers.values() for s in subs)
+        stats["subscribers"] = self._count
+        stats["devices"] = len(self._subscribers)
+        stats["max_subscribers"] = self.max_subscribers
+        return stats
+
+
+# Process-wide hub for stolen device location streams
+location_hub = LocationHub()
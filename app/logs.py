@@ -0,0 +1,184 @@
+"""Structured, sampled logging that keeps handler I/O off the event loop.
+
+Every record goes through a ``QueueHandler`` into a bounded queue; a
+``QueueListener`` thread formats it as one JSON object per line and writes
+it out. Records are not formatted on the caller's side, and when the queue
+is full they are counted and dropped rather than waited on.
+
+Hot paths log through ``events``:
+
+* ``events.event(name, **fields)`` - a routine event, kept at the sampling
+  rate of the current route (``GHOSTTRACK_LOG_SAMPLE``, e.g.
+  ``/api/location=0.01``). The decision is made before anything is built,
+  so a skipped event costs a dictionary lookup and a random number.
+* ``events.error(name, **fields)`` - an error, rate limited per event name
+  to ``ERROR_LOG_BURST`` records per ``ERROR_LOG_INTERVAL`` seconds. The
+  next record written reports how many were suppressed.
+
+Fields carry IDs and counts, never request payloads.
+"""
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+from .metrics import current_route
+
+LOG_LEVEL = os.environ.get("GHOSTTRACK_LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.environ.get("GHOSTTRACK_LOG_QUEUE_SIZE", "10000"))
+# Per-route sampling rates for routine events; other routes log every event
+LOG_SAMPLE = os.environ.get(
+    "GHOSTTRACK_LOG_SAMPLE",
+    "/api/location=0.01,/api/location/batch=0.1,"
+    "/api/__system__/device-checkin=0.001,/api/__system__/device-checkin/batch=0.01,"
+    "/api/__system__/device-checkin/bin=0.01"
+)
+LOG_DEFAULT_SAMPLE = float(os.environ.get("GHOSTTRACK_LOG_DEFAULT_SAMPLE", "1"))
+ERROR_LOG_BURST = int(os.environ.get("GHOSTTRACK_ERROR_LOG_BURST", "10"))
+ERROR_LOG_INTERVAL = float(os.environ.get("GHOSTTRACK_ERROR_LOG_INTERVAL", "60"))
+
+
+def parse_rates(spec):
+    """"route=rate,route=rate" -> {route: rate}"""
+    rates = {}
+    for item in spec.split(","):
+        route, _, rate = item.strip().rpartition("=")
+        if route:
+            rates[route] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.utcfromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue handler that never blocks or formats on the logging thread"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting happens in the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """Root-logger queue handler and the background writer that drains it"""
+
+    def __init__(self, stream=None, max_size=LOG_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.handler = DroppingQueueHandler(self.queue)
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.target.setFormatter(JsonFormatter())
+        self._listener = None
+
+    def install(self, level=LOG_LEVEL):
+        """Route the root logger through the queue (records wait there until start())"""
+        root = logging.getLogger()
+        if self.handler not in root.handlers:
+            root.addHandler(self.handler)
+        root.setLevel(level)
+
+    def start(self):
+        if self._listener is None:
+            self._listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+            self._listener.start()
+
+    def stop(self):
+        """Write out everything queued and stop the writer thread"""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "max_size": self.queue.maxsize,
+            "dropped": self.handler.dropped,
+            "running": self._listener is not None,
+        }
+
+
+class EventLog:
+    def __init__(self, name, rates=None, default_rate=LOG_DEFAULT_SAMPLE,
+                 error_burst=ERROR_LOG_BURST, error_interval=ERROR_LOG_INTERVAL):
+        self.logger = logging.getLogger(name)
+        self.rates = parse_rates(LOG_SAMPLE) if rates is None else rates
+        self.default_rate = default_rate
+        self.error_burst = error_burst
+        self.error_interval = error_interval
+        # event -> [window start, records written in window, suppressed since last written]
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._stats = {"events": 0, "sampled_out": 0, "errors": 0, "errors_suppressed": 0}
+
+    def event(self, name, **fields):
+        """Log a routine event, sampled at the current route's rate"""
+        route = current_route()
+        rate = self.rates.get(route, self.default_rate)
+        if rate < 1 and random.random() >= rate:
+            self._stats["sampled_out"] += 1
+            return
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        self._stats["events"] += 1
+        self.logger.info(name, extra={"fields": {"event": name, "route": route, "sample_rate": rate, **fields}})
+
+    def warning(self, name, **fields):
+        """An unexpected but handled condition - rate limited like errors"""
+        self._limited(logging.WARNING, name, fields)
+
+    def error(self, name, exc_info=False, **fields):
+        """Log an error, at most ``error_burst`` per event name per interval"""
+        self._limited(logging.ERROR, name, fields, exc_info)
+
+    def _limited(self, level, name, fields, exc_info=False):
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(name)
+            if window is None or now - window[0] >= self.error_interval:
+                window = self._windows[name] = [now, 0, window[2] if window else 0]
+            if window[1] >= self.error_burst:
+                window[2] += 1
+                self._stats["errors_suppressed"] += 1
+                return
+            window[1] += 1
+            suppressed, window[2] = window[2], 0
+            self._stats["errors"] += 1
+
+        fields = {"event": name, "route": current_route(), **fields}
+        if suppressed:
+            fields["suppressed"] = suppressed
+        self.logger.log(level, name, exc_info=exc_info, extra={"fields": fields})
+
+    def stats(self):
+        return dict(self._stats)
+
+
+# Process-wide pipeline and event log
+log_pipeline = LogPipeline()
+events = EventLog("ghosttrack")
@@ -0,0 +1,365 @@
+"""Background retention, rollup and vacuum scheduler for history tables.
+
+``locations``, ``stolen_device_locations`` and ``stolen_device_photos`` grow
+with every check-in and upload. Once per ``MAINTENANCE_INTERVAL`` the
+scheduler deletes rows older than each table's retention period, oldest
+first, in batches of ``MAINTENANCE_BATCH_SIZE``. Retention is opt-in: a
+table keeps its rows forever unless ``GHOSTTRACK_RETENTION_*_DAYS`` sets a
+period for it. Location fixes are folded into hourly rollup rows (fix
+count, centroid, bounding box, first and last timestamp) in the same
+transaction that deletes them; photo rows take their blob with them once
+no other row references it. A monthly location partition that is entirely
+past retention is rolled up in id order and then dropped as a whole; only
+partitions straddling the cutoff (and the legacy tables) are trimmed row by
+row.
+
+Each batch is its own short ``BEGIN IMMEDIATE`` transaction and the
+scheduler pauses between batches, so ingest never waits long for the write
+lock, and several workers running maintenance at once never roll the same
+row up twice. A run ends with an incremental VACUUM that returns freed
+pages to the filesystem.
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+
+from .blobs import photo_store
+from .db import database
+from .logs import events
+from .partitions import PARTITIONED_TABLES, timestamp_text
+
+MAINTENANCE_INTERVAL = float(os.environ.get("GHOSTTRACK_MAINTENANCE_INTERVAL", "3600"))
+MAINTENANCE_START_DELAY = float(os.environ.get("GHOSTTRACK_MAINTENANCE_START_DELAY", "60"))
+MAINTENANCE_BATCH_SIZE = int(os.environ.get("GHOSTTRACK_MAINTENANCE_BATCH_SIZE", "500"))
+MAINTENANCE_BATCH_PAUSE = float(os.environ.get("GHOSTTRACK_MAINTENANCE_BATCH_PAUSE", "0.05"))
+# Bounds one run; a backlog larger than this is worked off over several runs
+MAINTENANCE_MAX_BATCHES = int(os.environ.get("GHOSTTRACK_MAINTENANCE_MAX_BATCHES", "200"))
+VACUUM_PAGES = int(os.environ.get("GHOSTTRACK_VACUUM_PAGES", "5000"))
+
+# Retention in days per table (0 keeps rows forever). Off unless the
+# operator sets it - stolen-device history and photos are evidence
+RETENTION_DAYS = {
+    "locations": float(os.environ.get("GHOSTTRACK_RETENTION_LOCATIONS_DAYS", "0")),
+    "stolen_device_locations": float(os.environ.get("GHOSTTRACK_RETENTION_STOLEN_LOCATIONS_DAYS", "0")),
+    "stolen_device_photos": float(os.environ.get("GHOSTTRACK_RETENTION_PHOTOS_DAYS", "0")),
+}
+
+# History table -> (subject column, hourly rollup table)
+ROLLUPS = {
+    "locations": ("user_id", "location_rollups"),
+    "stolen_device_locations": ("hardware_id", "stolen_location_rollups"),
+}
+
+# Oldest rows of a partition (or legacy table) past the cutoff, and of the photos table
+RETENTION_BATCH_SQL = (
+    "SELECT id, {key}, latitude, longitude, timestamp FROM {partition} "
+    "WHERE timestamp < ? ORDER BY timestamp LIMIT ?"
+)
+PHOTO_RETENTION_SQL = (
+    "SELECT id, content_hash FROM stolen_device_photos WHERE timestamp < ? ORDER BY timestamp LIMIT ?"
+)
+
+# Blobs re-uploaded this recently are kept even if no row references them yet
+BLOB_GRACE_SECONDS = 3600
+
+ROLLUP_UPSERT = """
+    INSERT INTO {rollup} ({key}, hour, fixes, latitude, longitude,
+                          min_lat, max_lat, min_lng, max_lng, first_seen, last_seen)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT ({key}, hour) DO UPDATE SET
+        fixes = fixes + excluded.fixes,
+        latitude = (latitude * fixes + excluded.latitude * excluded.fixes) / (fixes + excluded.fixes),
+        longitude = (longitude * fixes + excluded.longitude * excluded.fixes) / (fixes + excluded.fixes),
+        min_lat = min(min_lat, excluded.min_lat),
+        max_lat = max(max_lat, excluded.max_lat),
+        min_lng = min(min_lng, excluded.min_lng),
+        max_lng = max(max_lng, excluded.max_lng),
+        first_seen = min(first_seen, excluded.first_seen),
+        last_seen = max(last_seen, excluded.last_seen)
+"""
+
+
+def summarize_hours(rows, key):
+    """Fold location rows into one rollup tuple per (subject, hour)"""
+    buckets = {}
+    for row in rows:
+        timestamp = timestamp_text(row["timestamp"])
+        if row["latitude"] is None or row["longitude"] is None or timestamp is None:
+            continue
+        bucket_key = (row[key], timestamp[:13] + ":00:00")
+        bucket = buckets.get(bucket_key)
+        if bucket is None:
+            buckets[bucket_key] = [1, row["latitude"], row["longitude"],
+                                   row["latitude"], row["latitude"], row["longitude"], row["longitude"],
+                                   timestamp, timestamp]
+            continue
+        bucket[0] += 1
+        bucket[1] += row["latitude"]
+        bucket[2] += row["longitude"]
+        bucket[3] = min(bucket[3], row["latitude"])
+        bucket[4] = max(bucket[4], row["latitude"])
+        bucket[5] = min(bucket[5], row["longitude"])
+        bucket[6] = max(bucket[6], row["longitude"])
+        bucket[7] = min(bucket[7], timestamp)
+        bucket[8] = max(bucket[8], timestamp)
+
+    return [
+        (subject, hour, fixes, lat_sum / fixes, lng_sum / fixes, *bounds)
+        for (subject, hour), (fixes, lat_sum, lng_sum, *bounds) in buckets.items()
+    ]
+
+
+def _write_rollups(conn, table, rows):
+    key, rollup = ROLLUPS[table]
+    summaries = summarize_hours(rows, key)
+    conn.executemany(ROLLUP_UPSERT.format(rollup=rollup, key=key), summaries)
+    return len(summaries)
+
+
+def _rollup_batch(conn, table, partition, cutoff, batch_size):
+    key, _ = ROLLUPS[table]
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # A partition already being rolled up for a drop must not lose rows here
+        if conn.execute(
+            "SELECT 1 FROM partition_catalog WHERE name = ? AND rolled_up_to = 0", (partition,)
+        ).fetchone() is None:
+            conn.rollback()
+            return 0, 0
+        rows = conn.execute(
+            RETENTION_BATCH_SQL.format(key=key, partition=partition), (cutoff, batch_size)
+        ).fetchall()
+        rollups = _write_rollups(conn, table, rows)
+        conn.executemany(f"DELETE FROM {partition} WHERE id = ?", [(row["id"],) for row in rows])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(rows), rollups
+
+
+def _drop_partition_batch(conn, table, partition, batch_size):
+    """Roll up the next rows of a partition in id order; drop it once none are left"""
+    key, _ = ROLLUPS[table]
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        catalog = conn.execute(
+            "SELECT rolled_up_to FROM partition_catalog WHERE name = ?", (partition,)
+        ).fetchone()
+        if catalog is None:
+            # Another worker finished it
+            conn.rollback()
+            return 0, 0, True
+        rows = conn.execute(
+            f"SELECT id, {key}, latitude, longitude, timestamp FROM {partition} "
+            "WHERE id > ? ORDER BY id LIMIT ?",
+            (catalog["rolled_up_to"], batch_size)
+        ).fetchall()
+        if rows:
+            rollups = _write_rollups(conn, table, rows)
+            conn.execute(
+                "UPDATE partition_catalog SET rolled_up_to = ? WHERE name = ?", (rows[-1]["id"], partition)
+            )
+        else:
+            rollups = 0
+            if table == "stolen_device_locations":
+                # Dropping a table fires no delete triggers - bump its devices' versions here
+                conn.execute(
+                    "UPDATE device_versions SET version = version + 1 "
+                    f"WHERE hardware_id IN (SELECT DISTINCT hardware_id FROM {partition})"
+                )
+            PARTITIONED_TABLES[table].drop(conn, partition)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(rows), rollups, not rows
+
+
+def _photo_batch(conn, cutoff, batch_size):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(PHOTO_RETENTION_SQL, (cutoff, batch_size)).fetchall()
+        conn.executemany("DELETE FROM stolen_device_photos WHERE id = ?", [(row["id"],) for row in rows])
+        # Identical photos share a blob - only the last reference frees it
+        orphans = [
+            digest for digest in {row["content_hash"] for row in rows if row["content_hash"]}
+            if conn.execute("SELECT 1 FROM stolen_device_photos WHERE content_hash = ?", (digest,)).fetchone() is None
+        ]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(rows), orphans
+
+
+def _page_usage(conn):
+    return {
+        name: conn.execute(f"PRAGMA {name}").fetchone()[0]
+        for name in ("page_size", "page_count", "freelist_count", "auto_vacuum")
+    }
+
+
+def _incremental_vacuum(conn, max_pages):
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        # Run through executescript: a cursor only steps the pragma once,
+        # which frees a single page
+        conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)})")
+    return _page_usage(conn)
+
+
+class MaintenanceScheduler:
+    def __init__(self, database, store, retention=RETENTION_DAYS, interval=MAINTENANCE_INTERVAL,
+                 start_delay=MAINTENANCE_START_DELAY, batch_size=MAINTENANCE_BATCH_SIZE,
+                 batch_pause=MAINTENANCE_BATCH_PAUSE, max_batches=MAINTENANCE_MAX_BATCHES,
+                 vacuum_pages=VACUUM_PAGES):
+        self.database = database
+        self.store = store
+        self.retention = retention
+        self.interval = interval
+        self.start_delay = start_delay
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.max_batches = max_batches
+        self.vacuum_pages = vacuum_pages
+        self.last_run = None
+        self._warned_vacuum = False
+        self._task = None
+        self._stats = {"runs": 0, "errors": 0, "rows_removed": 0, "rollups_written": 0,
+                       "blobs_removed": 0, "partitions_dropped": 0, "bytes_reclaimed": 0}
+
+    async def _in_batches(self, fn, *args):
+        """Run ``fn`` batch by batch until it returns a short batch or the run's batch limit"""
+        results = []
+        for _ in range(self.max_batches):
+            result = await self.database.run(fn, *args, self.batch_size)
+            results.append(result)
+            if result[0] < self.batch_size:
+                break
+            # Let queued check-ins take the write lock between batches
+            await asyncio.sleep(self.batch_pause)
+        return results
+
+    async def _drop_partition(self, table, partition):
+        removed = rollups = 0
+        for _ in range(self.max_batches):
+            count, written, dropped = await self.database.run(_drop_partition_batch, table, partition, self.batch_size)
+            removed += count
+            rollups += written
+            if dropped:
+                break
+            await asyncio.sleep(self.batch_pause)
+        return removed, rollups, dropped
+
+    async def _expire_locations(self, table, cutoff):
+        partitions = await self.database.run(PARTITIONED_TABLES[table].partitions, None, cutoff)
+        result = {"cutoff": cutoff, "rows_removed": 0, "rollups_written": 0, "partitions_dropped": 0}
+        for partition in partitions:
+            name = partition["name"]
+            # Whole months past retention (or already being rolled up) are dropped
+            if partition["month"] is not None and (
+                partition["rolled_up_to"] or (partition["max_ts"] is not None and partition["max_ts"] < cutoff)
+            ):
+                removed, rollups, dropped = await self._drop_partition(table, name)
+                result["partitions_dropped"] += dropped
+            else:
+                batches = await self._in_batches(_rollup_batch, table, name, cutoff)
+                removed = sum(count for count, _ in batches)
+                rollups = sum(written for _, written in batches)
+            result["rows_removed"] += removed
+            result["rollups_written"] += rollups
+        return result
+
+    async def _expire_photos(self, cutoff):
+        batches = await self._in_batches(_photo_batch, cutoff)
+        orphans = [digest for _, digests in batches for digest in digests]
+
+        loop = asyncio.get_running_loop()
+        stored_before = time.time() - BLOB_GRACE_SECONDS
+        freed = [await loop.run_in_executor(None, self.store.remove, digest, stored_before) for digest in orphans]
+        return {
+            "cutoff": cutoff,
+            "rows_removed": sum(removed for removed, _ in batches),
+            "blobs_removed": sum(1 for size in freed if size),
+            "blob_bytes_reclaimed": sum(freed),
+        }
+
+    async def run_once(self):
+        """Apply every retention policy, then vacuum; returns the run's metrics"""
+        start = time.perf_counter()
+        before = await self.database.run(_page_usage)
+        now = datetime.utcnow()
+
+        tables = {}
+        for table, days in self.retention.items():
+            if days <= 0:
+                continue
+            cutoff = (now - timedelta(days=days)).isoformat()
+            if table in ROLLUPS:
+                tables[table] = await self._expire_locations(table, cutoff)
+            else:
+                tables[table] = await self._expire_photos(cutoff)
+
+        after = await self.database.run(_incremental_vacuum, self.vacuum_pages)
+        if after["auto_vacuum"] != 2 and not self._warned_vacuum:
+            self._warned_vacuum = True
+            # Freed pages stay in the file until it is converted with
+            # PRAGMA auto_vacuum=INCREMENTAL; VACUUM
+            events.warning("incremental_vacuum_disabled", auto_vacuum=after["auto_vacuum"])
+
+        run = {
+            "started_at": now.isoformat(),
+            "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+            "tables": tables,
+            "pages_reclaimed": before["page_count"] - after["page_count"],
+            "bytes_reclaimed": (before["page_count"] - after["page_count"]) * after["page_size"],
+            "free_pages": after["freelist_count"],
+            "db_bytes": after["page_count"] * after["page_size"],
+        }
+
+        self.last_run = run
+        self._stats["runs"] += 1
+        for result in tables.values():
+            self._stats["rows_removed"] += result["rows_removed"]
+            self._stats["rollups_written"] += result.get("rollups_written", 0)
+            self._stats["blobs_removed"] += result.get("blobs_removed", 0)
+            self._stats["partitions_dropped"] += result.get("partitions_dropped", 0)
+        self._stats["bytes_reclaimed"] += run["bytes_reclaimed"]
+
+        removed = sum(result["rows_removed"] for result in tables.values())
+        events.event("maintenance_run", rows_removed=removed, bytes_reclaimed=run["bytes_reclaimed"],
+                     duration_ms=run["duration_ms"])
+        return run
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        await asyncio.sleep(self.start_delay)
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self._stats["errors"] += 1
+                events.error("maintenance_failed", exc_info=True, error=str(e))
+            await asyncio.sleep(self.interval)
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["retention_days"] = dict(self.retention)
+        stats["last_run"] = self.last_run
+        stats["running"] = self._task is not None
+        return stats
+
+
+# Process-wide maintenance scheduler
+maintenance = MaintenanceScheduler(database, photo_store)
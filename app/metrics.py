@@ -0,0 +1,196 @@
+"""Process metrics rendered in the Prometheus text exposition format.
+
+Counters and histograms are plain dictionaries keyed by label values, each
+behind its own lock (DB timings are recorded from executor threads), so
+recording a sample costs a bisect and a dictionary update. Gauges are read
+from callbacks only when ``/metrics`` is scraped. Every worker process keeps
+its own metrics; scrape each worker, or aggregate them in Prometheus.
+
+``MetricsMiddleware`` times every HTTP request and labels it with the route
+template (``/api/device-info``), never the raw path, so label cardinality
+stays bounded.
+"""
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+
+# Upper bounds in seconds, from cache hits to long-polls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                bucket_labels = _labels(self.label_names, labels, [("le", bound)])
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """A value read from ``read()`` at scrape time (skipped when it returns None)"""
+
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        value = self.read()
+        if value is not None:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, read):
+        return self._register(Gauge(name, help, read))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry and the metrics recorded outside app.py
+metrics = Registry()
+
+http_requests = metrics.counter(
+    "ghosttrack_http_requests_total", "HTTP requests by route template and status", ("method", "route", "status")
+)
+http_latency = metrics.histogram(
+    "ghosttrack_http_request_duration_seconds", "HTTP request latency until the response is sent", ("method", "route")
+)
+_in_progress = [0]
+metrics.gauge("ghosttrack_http_requests_in_progress", "HTTP requests being served", lambda: _in_progress[0])
+
+db_wait = metrics.histogram(
+    "ghosttrack_db_wait_seconds", "Time a query waited for a DB thread and a pooled connection"
+)
+db_query_latency = metrics.histogram(
+    "ghosttrack_db_query_duration_seconds", "Query execution time on the connection", ("query",)
+)
+db_errors = metrics.counter("ghosttrack_db_errors_total", "Queries that raised", ("query",))
+
+# ASGI scope of the request being served, so DB work can be attributed to its
+# route (AsyncDatabase copies the context into its executor threads)
+request_scope = ContextVar("request_scope", default=None)
+
+
+def route_name(scope):
+    """Route template of a routed request; anything else was served by the static files mount"""
+    route = scope.get("route")
+    return route.path if route is not None else "static"
+
+
+def current_route():
+    """Route of the request being served, or "background" outside of one"""
+    scope = request_scope.get()
+    return route_name(scope) if scope is not None else "background"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request counts, statuses and latency per route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        _in_progress[0] += 1
+        token = request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _in_progress[0] -= 1
+            request_scope.reset(token)
+            elapsed = time.perf_counter() - start
+            # The router stores the matched route in the scope
+            route = route_name(scope)
+            http_requests.inc(scope["method"], route, str(status))
+            http_latency.observe(elapsed, scope["method"], route)
@@ -0,0 +1,503 @@
+"""Versioned schema migrations, tracked with SQLite's ``user_version`` pragma"""
+import re
+
+from .logs import events
+
+# Each migration is (version, description, statements). Append new migrations
+# to the end with the next version number - never edit one that has shipped.
+MIGRATIONS = [
+    (1, "initial schema", [
+        # Users table
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            email TEXT UNIQUE,
+            password TEXT
+        )
+        ''',
+        # Locations table
+        '''
+        CREATE TABLE IF NOT EXISTS locations (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            latitude REAL,
+            longitude REAL,
+            timestamp TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        # Anti-theft device tracking
+        '''
+        CREATE TABLE IF NOT EXISTS antitheft_devices (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            hardware_id TEXT UNIQUE,
+            first_seen TEXT,
+            last_seen TEXT,
+            device_info TEXT,
+            is_stolen INTEGER DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        # Stolen devices table
+        '''
+        CREATE TABLE IF NOT EXISTS stolen_devices (
+            id INTEGER PRIMARY KEY,
+            hardware_id TEXT UNIQUE,
+            user_id INTEGER,
+            reported_stolen_at TEXT,
+            last_location TEXT,
+            recovery_email TEXT,
+            recovery_phone TEXT,
+            FOREIGN KEY (hardware_id) REFERENCES antitheft_devices (hardware_id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        # Stolen device locations
+        '''
+        CREATE TABLE IF NOT EXISTS stolen_device_locations (
+            id INTEGER PRIMARY KEY,
+            hardware_id TEXT,
+            latitude REAL,
+            longitude REAL,
+            timestamp TEXT,
+            connection_info TEXT,
+            FOREIGN KEY (hardware_id) REFERENCES stolen_devices (hardware_id)
+        )
+        ''',
+        # Device commands table - for remote actions
+        '''
+        CREATE TABLE IF NOT EXISTS device_commands (
+            id INTEGER PRIMARY KEY,
+            hardware_id TEXT,
+            user_id INTEGER,
+            command_type TEXT,
+            command_data TEXT,
+            issued_at TEXT,
+            executed BOOLEAN,
+            executed_at TEXT,
+            FOREIGN KEY (hardware_id) REFERENCES antitheft_devices (hardware_id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        # Factory reset events table
+        '''
+        CREATE TABLE IF NOT EXISTS factory_reset_events (
+            id INTEGER PRIMARY KEY,
+            original_hardware_id TEXT,
+            new_hardware_id TEXT,
+            detected_at TEXT,
+            device_info TEXT,
+            FOREIGN KEY (original_hardware_id) REFERENCES antitheft_devices (hardware_id)
+        )
+        ''',
+        # Hardware ID mapping table - to track changes in hardware IDs
+        '''
+        CREATE TABLE IF NOT EXISTS hardware_id_mapping (
+            id INTEGER PRIMARY KEY,
+            original_id TEXT UNIQUE,
+            current_id TEXT,
+            updated_at TEXT
+        )
+        ''',
+        # Stolen device photos table
+        '''
+        CREATE TABLE IF NOT EXISTS stolen_device_photos (
+            id INTEGER PRIMARY KEY,
+            hardware_id TEXT,
+            photo_data TEXT,
+            timestamp TEXT,
+            FOREIGN KEY (hardware_id) REFERENCES stolen_devices (hardware_id)
+        )
+        ''',
+    ]),
+    (2, "hot-path indexes", [
+        # Latest fix for a user (GET /api/location)
+        "CREATE INDEX IF NOT EXISTS idx_locations_user_time ON locations (user_id, timestamp)",
+        # Stolen device history and latest fix (history, device-info)
+        "CREATE INDEX IF NOT EXISTS idx_stolen_locations_hw_time ON stolen_device_locations (hardware_id, timestamp)",
+        # Pending commands for a device, oldest first (device-commands)
+        "CREATE INDEX IF NOT EXISTS idx_device_commands_pending ON device_commands (hardware_id, executed, issued_at)",
+        # Latest photo for a device (device-info)
+        "CREATE INDEX IF NOT EXISTS idx_stolen_photos_hw_time ON stolen_device_photos (hardware_id, timestamp)",
+    ]),
+    (3, "command execution result", [
+        # mark_command_executed stores the device's result payload
+        "ALTER TABLE device_commands ADD COLUMN result TEXT",
+    ]),
+    (4, "materialized latest positions", [
+        # One row per user / device holding its most recent fix
+        '''
+        CREATE TABLE IF NOT EXISTS latest_locations (
+            user_id INTEGER PRIMARY KEY,
+            latitude REAL,
+            longitude REAL,
+            timestamp TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS latest_device_locations (
+            hardware_id TEXT PRIMARY KEY,
+            latitude REAL,
+            longitude REAL,
+            timestamp TEXT
+        )
+        ''',
+        # Kept current by the history inserts themselves, whatever the ingest path
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_locations_latest AFTER INSERT ON locations
+        BEGIN
+            INSERT INTO latest_locations (user_id, latitude, longitude, timestamp)
+            VALUES (NEW.user_id, NEW.latitude, NEW.longitude, NEW.timestamp)
+            ON CONFLICT (user_id) DO UPDATE SET
+                latitude = excluded.latitude,
+                longitude = excluded.longitude,
+                timestamp = excluded.timestamp
+            WHERE excluded.timestamp >= latest_locations.timestamp;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stolen_locations_latest AFTER INSERT ON stolen_device_locations
+        BEGIN
+            INSERT INTO latest_device_locations (hardware_id, latitude, longitude, timestamp)
+            VALUES (NEW.hardware_id, NEW.latitude, NEW.longitude, NEW.timestamp)
+            ON CONFLICT (hardware_id) DO UPDATE SET
+                latitude = excluded.latitude,
+                longitude = excluded.longitude,
+                timestamp = excluded.timestamp
+            WHERE excluded.timestamp >= latest_device_locations.timestamp;
+        END
+        ''',
+        # Backfill from existing history (bare columns come from the MAX row)
+        '''
+        INSERT OR REPLACE INTO latest_locations (user_id, latitude, longitude, timestamp)
+        SELECT user_id, latitude, longitude, MAX(timestamp) FROM locations GROUP BY user_id
+        ''',
+        '''
+        INSERT OR REPLACE INTO latest_device_locations (hardware_id, latitude, longitude, timestamp)
+        SELECT hardware_id, latitude, longitude, MAX(timestamp) FROM stolen_device_locations GROUP BY hardware_id
+        ''',
+    ]),
+    (5, "photo blob metadata", [
+        # Photo bytes move to the content-addressed blob store; photo_data
+        # is only kept for rows written before this migration
+        "ALTER TABLE stolen_device_photos ADD COLUMN content_hash TEXT",
+        "ALTER TABLE stolen_device_photos ADD COLUMN size INTEGER",
+        "ALTER TABLE stolen_device_photos ADD COLUMN content_type TEXT",
+        # Blob lookups from GET /api/photos/{digest}
+        "CREATE INDEX IF NOT EXISTS idx_stolen_photos_hash ON stolen_device_photos (content_hash)",
+    ]),
+    (6, "history cursor index", [
+        # Ingest-order delta refresh (stolen-device-locations?after_id=)
+        "CREATE INDEX IF NOT EXISTS idx_stolen_locations_hw_id ON stolen_device_locations (hardware_id, id)",
+    ]),
+    (7, "spatial index of last-known device positions", [
+        # R*Tree over latest_device_locations, keyed by its rowid. The triggers
+        # delete then insert because OR REPLACE inside a trigger is overridden
+        # by the UPSERT that fires it
+        "CREATE VIRTUAL TABLE IF NOT EXISTS latest_device_rtree USING rtree(id, min_lat, max_lat, min_lng, max_lng)",
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_latest_device_rtree_insert AFTER INSERT ON latest_device_locations
+        WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+        BEGIN
+            DELETE FROM latest_device_rtree WHERE id = NEW.rowid;
+            INSERT INTO latest_device_rtree
+            VALUES (NEW.rowid, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_latest_device_rtree_update AFTER UPDATE OF latitude, longitude ON latest_device_locations
+        WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+        BEGIN
+            DELETE FROM latest_device_rtree WHERE id = NEW.rowid;
+            INSERT INTO latest_device_rtree
+            VALUES (NEW.rowid, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_latest_device_rtree_delete AFTER DELETE ON latest_device_locations
+        BEGIN
+            DELETE FROM latest_device_rtree WHERE id = OLD.rowid;
+        END
+        ''',
+        '''
+        INSERT OR REPLACE INTO latest_device_rtree
+        SELECT rowid, latitude, latitude, longitude, longitude FROM latest_device_locations
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        ''',
+    ]),
+    (8, "token revocation", [
+        # SHA-256 of revoked tokens, kept until the token would have expired
+        '''
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            token_hash TEXT PRIMARY KEY,
+            expires_at TEXT
+        )
+        ''',
+    ]),
+    (9, "stolen registry version counter", [
+        # Bumped by every change to the set of stolen devices, so each worker's
+        # in-memory registry can tell when to reload
+        '''
+        CREATE TABLE IF NOT EXISTS registry_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        "INSERT OR IGNORE INTO registry_versions (name, version) VALUES ('stolen_devices', 0)",
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stolen_devices_insert_version AFTER INSERT ON stolen_devices
+        BEGIN
+            UPDATE registry_versions SET version = version + 1 WHERE name = 'stolen_devices';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stolen_devices_delete_version AFTER DELETE ON stolen_devices
+        BEGIN
+            UPDATE registry_versions SET version = version + 1 WHERE name = 'stolen_devices';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_antitheft_stolen_version AFTER UPDATE OF is_stolen ON antitheft_devices
+        WHEN OLD.is_stolen IS NOT NEW.is_stolen
+        BEGIN
+            UPDATE registry_versions SET version = version + 1 WHERE name = 'stolen_devices';
+        END
+        ''',
+    ]),
+    (10, "history retention and hourly rollups", [
+        # Fixes past their retention period are summarized per hour and deleted
+        '''
+        CREATE TABLE IF NOT EXISTS location_rollups (
+            user_id INTEGER,
+            hour TEXT,
+            fixes INTEGER,
+            latitude REAL,
+            longitude REAL,
+            min_lat REAL,
+            max_lat REAL,
+            min_lng REAL,
+            max_lng REAL,
+            first_seen TEXT,
+            last_seen TEXT,
+            PRIMARY KEY (user_id, hour)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS stolen_location_rollups (
+            hardware_id TEXT,
+            hour TEXT,
+            fixes INTEGER,
+            latitude REAL,
+            longitude REAL,
+            min_lat REAL,
+            max_lat REAL,
+            min_lng REAL,
+            max_lng REAL,
+            first_seen TEXT,
+            last_seen TEXT,
+            PRIMARY KEY (hardware_id, hour)
+        )
+        ''',
+        # Oldest-first retention batches
+        "CREATE INDEX IF NOT EXISTS idx_locations_time ON locations (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_stolen_locations_time ON stolen_device_locations (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_stolen_photos_time ON stolen_device_photos (timestamp)",
+    ]),
+    (11, "monthly location partitions", [
+        # One row per partition of a history table, with the bounds queries prune on
+        '''
+        CREATE TABLE IF NOT EXISTS partition_catalog (
+            name TEXT PRIMARY KEY,
+            base TEXT NOT NULL,
+            month TEXT,
+            min_ts TEXT,
+            max_ts TEXT,
+            max_id INTEGER,
+            rolled_up_to INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        # Ids stay unique and in ingest order across a table's partitions
+        '''
+        CREATE TABLE IF NOT EXISTS partition_sequences (
+            base TEXT PRIMARY KEY,
+            next_id INTEGER NOT NULL
+        )
+        ''',
+        "INSERT OR IGNORE INTO partition_sequences SELECT 'locations', coalesce(max(id), 0) + 1 FROM locations",
+        '''
+        INSERT OR IGNORE INTO partition_sequences
+        SELECT 'stolen_device_locations', coalesce(max(id), 0) + 1 FROM stolen_device_locations
+        ''',
+        # Existing rows stay where they are, as a legacy partition without a month
+        '''
+        INSERT OR IGNORE INTO partition_catalog (name, base, month, min_ts, max_ts, max_id)
+        SELECT 'locations', 'locations', NULL, min(timestamp), max(timestamp), max(id)
+        FROM locations HAVING count(*) > 0
+        ''',
+        '''
+        INSERT OR IGNORE INTO partition_catalog (name, base, month, min_ts, max_ts, max_id)
+        SELECT 'stolen_device_locations', 'stolen_device_locations', NULL, min(timestamp), max(timestamp), max(id)
+        FROM stolen_device_locations HAVING count(*) > 0
+        ''',
+    ]),
+    (12, "per-device change versions", [
+        # Bumped by every change to what the dashboard shows for a device -
+        # fixes, photos, theft reports and device details - so polls can be
+        # answered with 304 Not Modified from this one row. Monthly partitions
+        # get the same triggers from their schema (partitions.py)
+        '''
+        CREATE TABLE IF NOT EXISTS device_versions (
+            hardware_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stolen_locations_version AFTER INSERT ON stolen_device_locations
+        BEGIN
+            INSERT INTO device_versions (hardware_id, version) VALUES (NEW.hardware_id, 1)
+            ON CONFLICT (hardware_id) DO UPDATE SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stolen_locations_version_delete AFTER DELETE ON stolen_device_locations
+        BEGIN
+            INSERT INTO device_versions (hardware_id, version) VALUES (OLD.hardware_id, 1)
+            ON CONFLICT (hardware_id) DO UPDATE SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_photos_version AFTER INSERT ON stolen_device_photos
+        BEGIN
+            INSERT INTO device_versions (hardware_id, version) VALUES (NEW.hardware_id, 1)
+            ON CONFLICT (hardware_id) DO UPDATE SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_photos_version_delete AFTER DELETE ON stolen_device_photos
+        BEGIN
+            INSERT INTO device_versions (hardware_id, version) VALUES (OLD.hardware_id, 1)
+            ON CONFLICT (hardware_id) DO UPDATE SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stolen_devices_version AFTER INSERT ON stolen_devices
+        BEGIN
+            INSERT INTO device_versions (hardware_id, version) VALUES (NEW.hardware_id, 1)
+            ON CONFLICT (hardware_id) DO UPDATE SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stolen_devices_version_update AFTER UPDATE ON stolen_devices
+        BEGIN
+            INSERT INTO device_versions (hardware_id, version) VALUES (NEW.hardware_id, 1)
+            ON CONFLICT (hardware_id) DO UPDATE SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stolen_devices_version_delete AFTER DELETE ON stolen_devices
+        BEGIN
+            INSERT INTO device_versions (hardware_id, version) VALUES (OLD.hardware_id, 1)
+            ON CONFLICT (hardware_id) DO UPDATE SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_antitheft_devices_version AFTER INSERT ON antitheft_devices
+        BEGIN
+            INSERT INTO device_versions (hardware_id, version) VALUES (NEW.hardware_id, 1)
+            ON CONFLICT (hardware_id) DO UPDATE SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_antitheft_devices_version_update AFTER UPDATE ON antitheft_devices
+        BEGIN
+            INSERT INTO device_versions (hardware_id, version) VALUES (NEW.hardware_id, 1)
+            ON CONFLICT (hardware_id) DO UPDATE SET version = version + 1;
+        END
+        ''',
+    ]),
+    (13, "reset mapping lookup by current ID", [
+        # A factory-reset alert may only link an ID that no chain uses yet
+        "CREATE INDEX IF NOT EXISTS idx_hardware_mapping_current ON hardware_id_mapping (current_id)",
+    ]),
+    (14, "partition catalog lookup by table", [
+        # Every history query starts by listing its table's partitions
+        "CREATE INDEX IF NOT EXISTS idx_partition_catalog_base ON partition_catalog (base)",
+    ]),
+    (15, "keep every reset mapping", [
+        # original_id was UNIQUE, so a second reset from the same ID replaced
+        # the first link and the alias was lost on the next restart. Rebuild
+        # the table keyed on the (original_id, current_id) pair instead
+        '''
+        CREATE TABLE hardware_id_mapping_new (
+            id INTEGER PRIMARY KEY,
+            original_id TEXT,
+            current_id TEXT,
+            updated_at TEXT,
+            UNIQUE (original_id, current_id)
+        )
+        ''',
+        '''
+        INSERT INTO hardware_id_mapping_new (id, original_id, current_id, updated_at)
+        SELECT id, original_id, current_id, updated_at FROM hardware_id_mapping
+        ''',
+        "DROP TABLE hardware_id_mapping",
+        "ALTER TABLE hardware_id_mapping_new RENAME TO hardware_id_mapping",
+        "CREATE INDEX IF NOT EXISTS idx_hardware_mapping_current ON hardware_id_mapping (current_id)",
+    ]),
+]
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Apply pending migrations, returning the versions that were applied.
+
+    The version check and the migration run inside one ``BEGIN IMMEDIATE``
+    transaction, so several workers starting at once apply each migration
+    exactly once.
+    """
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        events.event("schema_migration_applied", version=version, description=description)
+        applied.append(version)
+    return applied
+
+
+def explain(conn, sql, params=()):
+    """Return the EXPLAIN QUERY PLAN detail lines for a statement"""
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def is_full_scan(step):
+    # A virtual table "scan" with constraints in its index string (e.g. the
+    # R*Tree's "INDEX 2:D1B0") is an index lookup, not a full scan
+    return step.startswith("SCAN") and not re.search(r"VIRTUAL TABLE INDEX \d+:\S", step)
+
+
+def uses_index(plan):
+    """True if no step of the plan is a full scan or a temporary sort"""
+    return not any(is_full_scan(step) or "TEMP B-TREE" in step for step in plan)
+
+
+def check_query_plans(conn, queries):
+    """Return {name: plan} for every query in {name: (sql, params)} that does not use an index"""
+    problems = {}
+    for name, (sql, params) in queries.items():
+        plan = explain(conn, sql, params)
+        if not uses_index(plan):
+            problems[name] = plan
+    return problems
@@ -0,0 +1,301 @@
+"""Monthly partitions for the location history tables.
+
+New fixes for ``locations`` and ``stolen_device_locations`` go to one table
+per calendar month of their timestamp (``stolen_device_locations_p202610``),
+created on first use with the indexes and latest-position trigger of the
+original table. Each insert therefore touches small, recent B-trees, and a
+month past retention is dropped as a whole instead of deleted row by row.
+
+``partition_catalog`` lists every partition with the smallest and largest
+timestamp and the largest id written to it. Queries only visit partitions
+whose bounds overlap the requested time range (or that hold ids past a
+delta cursor), reading the catalog and those partitions in one read
+transaction. The original tables stay in the catalog as unbounded legacy
+partitions holding everything written before partitioning, and are never
+written to again.
+
+Ids come from ``partition_sequences``, reserved a batch at a time in the
+inserting transaction, so they stay unique and in ingest order across
+partitions - history cursors and ``after_id`` deltas keep working.
+"""
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+_MONTH_RE = re.compile(r"^\d{4}-\d{2}$")
+
+# Months around the server's current month a fix's timestamp may route it
+# to; fixes dated outside the window (or with a malformed month) go to the
+# current month's partition, so clients cannot create arbitrary tables
+PARTITION_PAST_MONTHS = int(os.environ.get("GHOSTTRACK_PARTITION_PAST_MONTHS", "24"))
+PARTITION_FUTURE_MONTHS = int(os.environ.get("GHOSTTRACK_PARTITION_FUTURE_MONTHS", "1"))
+
+CATALOG_SQL = """
+    SELECT name, month, min_ts, max_ts, max_id, rolled_up_to
+    FROM partition_catalog WHERE base = ?
+"""
+
+# Partition schemas, formatted with the partition's table name
+LOCATION_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        latitude REAL,
+        longitude REAL,
+        timestamp TEXT
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_{name}_user_time ON {name} (user_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_{name}_time ON {name} (timestamp)",
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_{name}_latest AFTER INSERT ON {name}
+    BEGIN
+        INSERT INTO latest_locations (user_id, latitude, longitude, timestamp)
+        VALUES (NEW.user_id, NEW.latitude, NEW.longitude, NEW.timestamp)
+        ON CONFLICT (user_id) DO UPDATE SET
+            latitude = excluded.latitude,
+            longitude = excluded.longitude,
+            timestamp = excluded.timestamp
+        WHERE excluded.timestamp >= latest_locations.timestamp;
+    END
+    ''',
+]
+
+STOLEN_LOCATION_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY,
+        hardware_id TEXT,
+        latitude REAL,
+        longitude REAL,
+        timestamp TEXT,
+        connection_info TEXT
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_{name}_hw_time ON {name} (hardware_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_{name}_hw_id ON {name} (hardware_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_{name}_time ON {name} (timestamp)",
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_{name}_latest AFTER INSERT ON {name}
+    BEGIN
+        INSERT INTO latest_device_locations (hardware_id, latitude, longitude, timestamp)
+        VALUES (NEW.hardware_id, NEW.latitude, NEW.longitude, NEW.timestamp)
+        ON CONFLICT (hardware_id) DO UPDATE SET
+            latitude = excluded.latitude,
+            longitude = excluded.longitude,
+            timestamp = excluded.timestamp
+        WHERE excluded.timestamp >= latest_device_locations.timestamp;
+    END
+    ''',
+    # Per-device change versions (migration 12)
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_{name}_version AFTER INSERT ON {name}
+    BEGIN
+        INSERT INTO device_versions (hardware_id, version) VALUES (NEW.hardware_id, 1)
+        ON CONFLICT (hardware_id) DO UPDATE SET version = version + 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_{name}_version_delete AFTER DELETE ON {name}
+    BEGIN
+        INSERT INTO device_versions (hardware_id, version) VALUES (OLD.hardware_id, 1)
+        ON CONFLICT (hardware_id) DO UPDATE SET version = version + 1;
+    END
+    ''',
+]
+
+
+def timestamp_text(timestamp):
+    """A fix's timestamp as ISO text, or None if it has no usable one"""
+    if isinstance(timestamp, str):
+        return timestamp
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        # Browsers send epoch milliseconds
+        seconds = timestamp / 1000 if timestamp > 1e11 else timestamp
+        try:
+            return datetime.utcfromtimestamp(seconds).isoformat()
+        except (OverflowError, OSError, ValueError):
+            pass
+    return None
+
+
+def timestamp_month(timestamp, now=None):
+    """The "YYYY-MM" a fix belongs to.
+
+    The current month if it has no usable timestamp, or one whose month is
+    invalid or outside the partition window around ``now``.
+    """
+    now = now or datetime.utcnow()
+    text = timestamp_text(timestamp)
+    if text and _MONTH_RE.match(text[:7]):
+        year, month = int(text[:4]), int(text[5:7])
+        offset = (year * 12 + month) - (now.year * 12 + now.month)
+        if 1 <= month <= 12 and -PARTITION_PAST_MONTHS <= offset <= PARTITION_FUTURE_MONTHS:
+            return text[:7]
+    return now.strftime("%Y-%m")
+
+
+def order_key(timestamp, row_id):
+    """Sort key matching SQLite's ``ORDER BY timestamp, id`` (NULL < numbers < text)"""
+    if timestamp is None:
+        return (0, 0, "", row_id)
+    if isinstance(timestamp, str):
+        return (2, 0, timestamp, row_id)
+    return (1, timestamp, "", row_id)
+
+
+class PartitionedTable:
+    def __init__(self, base, columns, schema):
+        self.base = base
+        self.columns = columns
+        self.schema = schema
+        self._timestamp_index = columns.index("timestamp")
+        self._insert_sql = (
+            f"INSERT INTO {{name}} (id, {', '.join(columns)}) "
+            f"VALUES ({', '.join('?' * (len(columns) + 1))})"
+        )
+        # Partitions this process has already created
+        self._created = set()
+
+    def partition_name(self, month):
+        return f"{self.base}_p{month.replace('-', '')}"
+
+    def ensure(self, conn, name, month):
+        """Create a partition and its catalog row if this process has not seen it yet"""
+        if name in self._created:
+            return
+        for sql in self.schema:
+            conn.execute(sql.format(name=name))
+        conn.execute(
+            "INSERT OR IGNORE INTO partition_catalog (name, base, month, max_id) VALUES (?, ?, ?, 0)",
+            (name, self.base, month)
+        )
+        self._created.add(name)
+
+    def _reserve_ids(self, conn, count):
+        (next_id,) = conn.execute(
+            "UPDATE partition_sequences SET next_id = next_id + ? WHERE base = ? RETURNING next_id",
+            (count, self.base)
+        ).fetchall()[0]
+        return next_id - count
+
+    def insert(self, conn, rows):
+        """Insert rows (tuples in ``columns`` order) into their partitions.
+
+        Runs in the caller's transaction - the caller commits. Returns the
+        number of rows written.
+        """
+        if not rows:
+            return 0
+
+        first_id = self._reserve_ids(conn, len(rows))
+        now = datetime.utcnow()
+        by_month = {}
+        for row_id, row in enumerate(rows, first_id):
+            by_month.setdefault(timestamp_month(row[self._timestamp_index], now), []).append((row_id, *row))
+
+        for month, month_rows in by_month.items():
+            name = self.partition_name(month)
+            self.ensure(conn, name, month)
+            try:
+                conn.executemany(self._insert_sql.format(name=name), month_rows)
+            except sqlite3.OperationalError as e:
+                if "no such table" not in str(e):
+                    raise
+                # Dropped by retention since this process created it
+                self._created.discard(name)
+                self.ensure(conn, name, month)
+                conn.executemany(self._insert_sql.format(name=name), month_rows)
+
+            # Only text timestamps bound a partition; see partitions()
+            timestamps = [row[self._timestamp_index + 1] for row in month_rows]
+            timestamps = [timestamp for timestamp in timestamps if isinstance(timestamp, str)]
+            oldest, newest = (min(timestamps), max(timestamps)) if timestamps else (None, None)
+            conn.execute(
+                """
+                UPDATE partition_catalog SET
+                    min_ts = coalesce(min(min_ts, ?), min_ts, ?),
+                    max_ts = coalesce(max(max_ts, ?), max_ts, ?),
+                    max_id = max(max_id, ?)
+                WHERE name = ?
+                """,
+                (oldest, oldest, newest, newest, month_rows[-1][0], name)
+            )
+        return len(rows)
+
+    def write(self, conn, rows):
+        """Insert rows and commit"""
+        count = self.insert(conn, rows)
+        conn.commit()
+        return count
+
+    def partitions(self, conn, start=None, end=None, after_id=None):
+        """Catalog rows of partitions that may hold rows in [start, end] or past ``after_id``.
+
+        Newest first by their latest timestamp. Partitions without string
+        timestamp bounds (legacy rows, numeric timestamps) always match.
+        """
+        matching = []
+        for row in conn.execute(CATALOG_SQL, (self.base,)).fetchall():
+            if start is not None and row["max_ts"] is not None and row["max_ts"] < start:
+                continue
+            if end is not None and row["min_ts"] is not None and row["min_ts"] > end:
+                continue
+            if after_id is not None and row["max_id"] is not None and row["max_id"] <= after_id:
+                continue
+            matching.append(row)
+        matching.sort(key=lambda row: (row["max_ts"] is None, row["max_ts"] or ""), reverse=True)
+        return matching
+
+    def query(self, conn, sql, params, limit, start=None, end=None, after_id=None, newest_first=True):
+        """Run ``sql`` (with a ``{table}`` placeholder) on every matching partition and merge.
+
+        ``sql`` must select ``id`` and ``timestamp``, apply its own ORDER BY
+        and LIMIT, and take ``limit`` as its last parameter. Rows are merged
+        newest first by (timestamp, id), or in id order when ``after_id`` is
+        given. Partitions entirely older than a full page are skipped.
+        """
+        rows = []
+        # The catalog and every partition are read in one transaction (one WAL
+        # snapshot), so a partition dropped by retention in between is still
+        # there for this query
+        own_transaction = not conn.in_transaction
+        if own_transaction:
+            conn.execute("BEGIN")
+        try:
+            for partition in self.partitions(conn, start, end, after_id):
+                if newest_first and after_id is None and len(rows) >= limit and partition["max_ts"] is not None:
+                    oldest = rows[limit - 1]
+                    if order_key(partition["max_ts"], 0) < order_key(oldest["timestamp"], 0):
+                        break
+                rows.extend(conn.execute(sql.format(table=partition["name"]), (*params, limit)).fetchall())
+                if after_id is not None:
+                    rows.sort(key=lambda row: row["id"])
+                else:
+                    rows.sort(key=lambda row: order_key(row["timestamp"], row["id"]), reverse=newest_first)
+                del rows[limit:]
+        finally:
+            if own_transaction:
+                conn.commit()
+        return rows
+
+    def drop(self, conn, name):
+        """Drop a partition and its catalog row (in the caller's transaction)"""
+        if name == self.base:
+            raise ValueError("The legacy table is never dropped")
+        conn.execute(f"DROP TABLE IF EXISTS {name}")
+        conn.execute("DELETE FROM partition_catalog WHERE name = ?", (name,))
+        self._created.discard(name)
+
+
+# Process-wide routers for the partitioned history tables
+location_partitions = PartitionedTable(
+    "locations", ("user_id", "latitude", "longitude", "timestamp"), LOCATION_SCHEMA
+)
+stolen_location_partitions = PartitionedTable(
+    "stolen_device_locations", ("hardware_id", "latitude", "longitude", "timestamp", "connection_info"),
+    STOLEN_LOCATION_SCHEMA
+)
+PARTITIONED_TABLES = {table.base: table for table in (location_partitions, stolen_location_partitions)}
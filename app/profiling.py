@@ -0,0 +1,212 @@
+"""Slow-query log with query plan capture.
+
+Pooled connections are ``ProfiledConnection``s: every ``execute`` and
+``executemany`` is timed (preparing and running the statement to its first
+row - where scans, sorts and aggregates do their work). The first time a
+statement is seen its ``EXPLAIN QUERY PLAN`` is captured and cached, so:
+
+* a statement slower than ``SLOW_QUERY_MS`` is recorded with its normalized
+  SQL, the shape of its parameters (types only, never values), its plan and
+  the route that issued it;
+* a statement whose plan scans a watched table (``stolen_device_locations``
+  and its monthly partitions, ``device_commands``) is recorded once when it
+  first runs, however fast it is on today's data.
+
+Records go to ``/api/__system__/slow-queries`` and, when
+``GHOSTTRACK_SLOW_QUERY_LOG`` names a file, to a rotating JSON-lines log.
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from .logs import events
+from .metrics import current_route
+
+SLOW_QUERY_MS = float(os.environ.get("GHOSTTRACK_SLOW_QUERY_MS", "50"))
+# Rotating JSON-lines log file; unset keeps records in memory (the endpoint) only
+SLOW_QUERY_LOG = os.environ.get("GHOSTTRACK_SLOW_QUERY_LOG")
+SLOW_QUERY_LOG_BYTES = int(os.environ.get("GHOSTTRACK_SLOW_QUERY_LOG_BYTES", str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.environ.get("GHOSTTRACK_SLOW_QUERY_LOG_BACKUPS", "5"))
+SCAN_WATCH_TABLES = tuple(
+    table.strip()
+    for table in os.environ.get("GHOSTTRACK_SCAN_WATCH_TABLES", "stolen_device_locations,device_commands").split(",")
+    if table.strip()
+)
+
+# Distinct statements whose plans are kept, and slow samples kept for the endpoint
+PLAN_CACHE_SIZE = 2000
+RECENT_SLOW_QUERIES = 100
+
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACE_RE = re.compile(r"\s+")
+_TABLE_RE = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_SCAN_RE = re.compile(r"^SCAN (\w+)")
+
+
+def normalize_sql(sql):
+    """SQL with literals replaced by ? and whitespace collapsed"""
+    sql = _STRING_RE.sub("?", sql)
+    sql = _NUMBER_RE.sub("?", sql)
+    return _SPACE_RE.sub(" ", sql).strip()
+
+
+def params_shape(params, many=False):
+    """Parameter types without their values, e.g. "(str, int)" or "500 x (str, float)" """
+    if many:
+        params = list(params)
+        return f"{len(params)} x {params_shape(params[0])}" if params else "0 x ()"
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in params.items()) + "}"
+    return "(" + ", ".join(type(value).__name__ for value in params) + ")"
+
+
+def _watched(table):
+    # Monthly partitions (table_p202610) count as their base table
+    return any(table == base or table.startswith(f"{base}_p") for base in SCAN_WATCH_TABLES)
+
+
+class QueryProfiler:
+    def __init__(self, threshold_ms=SLOW_QUERY_MS, log_path=SLOW_QUERY_LOG):
+        self.threshold = threshold_ms / 1000
+        # Raw SQL -> plan; plain dict reads keep the per-statement cost low
+        self.plans = {}
+        self.recent = deque(maxlen=RECENT_SLOW_QUERIES)
+        self.slow = {}
+        self.scans = {}
+        self._lock = threading.Lock()
+        self._stats = {"slow": 0, "explain_errors": 0}
+
+        self.log = logging.getLogger("ghosttrack.slow_queries")
+        self.log.propagate = False
+        if log_path and not self.log.handlers:
+            # delay - the file is only created once there is something to write
+            handler = RotatingFileHandler(
+                log_path, maxBytes=SLOW_QUERY_LOG_BYTES, backupCount=SLOW_QUERY_LOG_BACKUPS, delay=True
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.log.addHandler(handler)
+            self.log.setLevel(logging.INFO)
+
+    def _plan(self, conn, sql, params, many):
+        """The statement's cached plan, capturing it (and checking for scans) on first sight"""
+        plan = self.plans.get(sql)
+        if plan is not None:
+            return plan
+
+        plan = []
+        if sql.lstrip()[:7].upper().startswith(_EXPLAINABLE):
+            if many:
+                params = next(iter(params), ())
+            try:
+                rows = sqlite3.Connection.execute(conn, f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+                plan = [row[3] for row in rows]
+            except sqlite3.Error:
+                with self._lock:
+                    self._stats["explain_errors"] += 1
+        if len(self.plans) >= PLAN_CACHE_SIZE:
+            self.plans.clear()
+        self.plans[sql] = plan
+        self._check_scans(sql, plan, params, many)
+        return plan
+
+    def _check_scans(self, sql, plan, params, many):
+        aliases = {}
+        for table, alias in _TABLE_RE.findall(sql):
+            aliases[table] = table
+            if alias and alias.upper() not in ("WHERE", "SET", "ON", "USING", "VALUES", "SELECT", "ORDER", "GROUP"):
+                aliases[alias] = table
+
+        tables = []
+        for detail in plan:
+            match = _SCAN_RE.match(detail)
+            if match:
+                table = aliases.get(match.group(1), match.group(1))
+                if _watched(table):
+                    tables.append(table)
+        if not tables:
+            return
+
+        normalized = normalize_sql(sql)
+        entry = {
+            "at": datetime.utcnow().isoformat(),
+            "event": "scan",
+            "tables": tables,
+            "sql": normalized,
+            "params": params_shape(params),
+            "route": current_route(),
+            "plan": plan,
+        }
+        with self._lock:
+            if normalized in self.scans:
+                return
+            self.scans[normalized] = entry
+        self.log.info(json.dumps(entry))
+        events.warning("query_scan", tables=tables, sql=normalized[:200])
+
+    def record(self, conn, sql, params, elapsed, many=False):
+        plan = self._plan(conn, sql, params, many)
+        if elapsed < self.threshold:
+            return
+
+        normalized = normalize_sql(sql)
+        entry = {
+            "at": datetime.utcnow().isoformat(),
+            "event": "slow",
+            "ms": round(elapsed * 1000, 3),
+            "sql": normalized,
+            "params": params_shape(params, many),
+            "route": current_route(),
+            "plan": plan,
+        }
+        with self._lock:
+            self._stats["slow"] += 1
+            self.recent.append(entry)
+            summary = self.slow.setdefault(normalized, {"sql": normalized, "count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            summary["count"] += 1
+            summary["total_ms"] = round(summary["total_ms"] + entry["ms"], 3)
+            summary["max_ms"] = max(summary["max_ms"], entry["ms"])
+            summary.update(route=entry["route"], params=entry["params"], plan=plan, last_at=entry["at"])
+        self.log.info(json.dumps(entry))
+        events.warning("slow_query", ms=entry["ms"], sql=normalized[:200])
+
+    def report(self):
+        with self._lock:
+            return {
+                **self._stats,
+                "threshold_ms": self.threshold * 1000,
+                "watched_tables": list(SCAN_WATCH_TABLES),
+                "statements_seen": len(self.plans),
+                "scans": list(self.scans.values()),
+                "slowest": sorted(self.slow.values(), key=lambda summary: summary["total_ms"], reverse=True),
+                "recent": list(self.recent),
+            }
+
+
+# Process-wide profiler shared by every pooled connection
+query_profiler = QueryProfiler()
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """sqlite3 connection that reports every statement to ``query_profiler``"""
+
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        cursor = super().execute(sql, params)
+        query_profiler.record(self, sql, params, time.perf_counter() - start)
+        return cursor
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        start = time.perf_counter()
+        cursor = super().executemany(sql, seq_of_params)
+        query_profiler.record(self, sql, seq_of_params, time.perf_counter() - start, many=True)
+        return cursor
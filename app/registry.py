@@ -0,0 +1,92 @@
+"""In-memory registry of stolen hardware IDs.
+
+Every device polls ``check-device-status`` and posts check-ins, and almost
+all of them are not stolen. The registry keeps the full set of stolen
+hardware IDs in memory so those paths answer without touching SQLite.
+
+Writes bump the storage's registry version (``registry_versions.version``
+via triggers on SQLite), whichever worker makes them. A background task in each worker
+reads that single row every ``REGISTRY_SYNC_INTERVAL`` seconds and reloads
+the set when it changed, so other workers converge within one interval; the
+worker that handled the write updates its own set immediately.
+"""
+import asyncio
+import os
+import time
+
+from .logs import events
+from .storage import storage
+
+REGISTRY_SYNC_INTERVAL = float(os.environ.get("GHOSTTRACK_REGISTRY_SYNC_INTERVAL", "1"))
+
+
+class StolenRegistry:
+    def __init__(self, storage, sync_interval=REGISTRY_SYNC_INTERVAL):
+        self.storage = storage
+        self.sync_interval = sync_interval
+        self.version = None
+        self._stolen = set()
+        self._task = None
+        self._stats = {"checks": 0, "stolen_hits": 0, "reloads": 0, "sync_errors": 0, "last_reload_ms": 0.0}
+
+    async def load(self):
+        """Load the set (startup, before serving requests)"""
+        start = time.perf_counter()
+        self.version, self._stolen = await self.storage.stolen_snapshot()
+        self._stats["reloads"] += 1
+        self._stats["last_reload_ms"] = round((time.perf_counter() - start) * 1000, 3)
+
+    def is_stolen(self, hardware_id):
+        self._stats["checks"] += 1
+        if hardware_id in self._stolen:
+            self._stats["stolen_hits"] += 1
+            return True
+        return False
+
+    def mark_stolen(self, hardware_id):
+        """Record a device this worker just marked stolen (after commit)"""
+        self._stolen.add(hardware_id)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def sync(self):
+        """Reload the set if another worker changed it"""
+        version = await self.storage.stolen_version()
+        if version == self.version:
+            return False
+
+        start = time.perf_counter()
+        # Swap in a freshly built set - readers never see a partial one
+        self.version, self._stolen = await self.storage.stolen_snapshot()
+        self._stats["reloads"] += 1
+        self._stats["last_reload_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        return True
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                self._stats["sync_errors"] += 1
+                events.error("stolen_registry_sync_failed", exc_info=True, error=str(e))
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["stolen"] = len(self._stolen)
+        stats["version"] = self.version
+        stats["running"] = self._task is not None
+        return stats
+
+
+# Process-wide registry of stolen hardware IDs
+stolen_registry = StolenRegistry(storage)
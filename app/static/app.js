@@ -24,6 +24,15 @@ let map = null;
 let marker = null;
 let locationUpdateInterval = null;
 
+// Location buffer - every fix is queued locally and sent straight away while
+// online; fixes taken offline are replayed in batches on reconnect
+const PENDING_LOCATIONS_KEY = 'pendingLocations';
+const MAX_PENDING_LOCATIONS = 500;
+const LOCATION_BATCH_SIZE = 100;
+
+// The flush in progress, shared by every caller so a batch is never sent twice
+let locationFlush = null;
+
 // App initialization
 document.addEventListener('DOMContentLoaded', () => {
     initApp();
@@ -79,6 +88,13 @@ function setupEventListeners() {
     registerForm.addEventListener('submit', handleRegister);
     refreshBtn.addEventListener('click', loadLocation);
     logoutBtn.addEventListener('click', logout);
+    
+    // Replay fixes buffered while offline as soon as we reconnect
+    window.addEventListener('online', () => {
+        flushPendingLocations().catch(error => {
+            console.error('Failed to flush buffered locations:', error);
+        });
+    });
 }
 
 // Handle login
@@ -154,9 +170,19 @@ async function handleRegister(e) {
 
 // Handle logout
 function logout() {
+    // Revoke the token server-side; logging out locally doesn't wait for it
+    const token = localStorage.getItem('token');
+    if (token) {
+        fetch(`${API_URL}/logout`, {
+            method: 'POST',
+            headers: {'Authorization': `Bearer ${token}`}
+        }).catch(() => {});
+    }
+    
     localStorage.removeItem('token');
     localStorage.removeItem('userId');
     localStorage.removeItem('userEmail');
+    localStorage.removeItem(PENDING_LOCATIONS_KEY);
     
     stopBackgroundTracking();
     showLoginScreen();
@@ -369,7 +395,8 @@ function showGeolocationPermissionHelp() {
     });
 }
 
-// Improved function to send location to server with better error handling
+// Improved function to send location to server with better error handling.
+// The fix is buffered and, while online, sent at once together with any backlog
 async function sendLocationToServer() {
     const token = localStorage.getItem('token');
     if (!token) return;
@@ -383,29 +410,28 @@ async function sendLocationToServer() {
         // Log details to help with debugging
         console.log("Sending position to server:", position);
         
-        // Send to server with timeout
-        const controller = new AbortController();
-        const timeoutId = setTimeout(() => controller.abort(), 15000);
+        // Buffer the fix first so it survives a failed request
+        queueLocation(position);
         
-        const response = await fetch(`${API_URL}/location?token=${token}`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(position),
-            signal: controller.signal
-        });
-        
-        clearTimeout(timeoutId);
-        
-        if (!response.ok) {
-            const errorData = await response.json().catch(() => ({}));
-            console.error('Server error:', response.status, errorData);
-            throw new Error(`Server error: ${response.status} ${errorData.detail || ''}`);
+        if (navigator.onLine) {
+            // Send everything buffered so far with timeout
+            const controller = new AbortController();
+            const timeoutId = setTimeout(() => controller.abort(), 15000);
+            
+            try {
+                await flushPendingLocations(controller.signal);
+            } finally {
+                clearTimeout(timeoutId);
+            }
+            
+            console.log("Location successfully sent to server");
+        } else {
+            console.log("Offline - location queued until reconnect");
         }
         
         // Update UI with success
         statusText.textContent = 'Active';
         timestampEl.textContent = new Date().toLocaleString();
-        console.log("Location successfully sent to server");
         
         // Also update the map with the new position
         updateMap(position);
@@ -426,6 +452,78 @@ async function sendLocationToServer() {
     }
 }
 
+// Read buffered fixes from local storage
+function loadPendingLocations() {
+    try {
+        return JSON.parse(localStorage.getItem(PENDING_LOCATIONS_KEY) || '[]');
+    } catch (e) {
+        return [];
+    }
+}
+
+// Persist buffered fixes, keeping only the newest ones
+function savePendingLocations(pending) {
+    if (pending.length === 0) {
+        localStorage.removeItem(PENDING_LOCATIONS_KEY);
+        return;
+    }
+    localStorage.setItem(PENDING_LOCATIONS_KEY, JSON.stringify(pending.slice(-MAX_PENDING_LOCATIONS)));
+}
+
+// Add a fix to the offline buffer
+function queueLocation(position) {
+    const pending = loadPendingLocations();
+    pending.push({
+        latitude: position.latitude,
+        longitude: position.longitude,
+        timestamp: position.timestamp
+    });
+    savePendingLocations(pending);
+}
+
+// Send buffered fixes to the batch endpoint, oldest first. Concurrent callers
+// (the interval, the online handler) share the flush already in flight
+function flushPendingLocations(signal) {
+    if (!locationFlush) {
+        locationFlush = sendPendingLocations(signal).finally(() => {
+            locationFlush = null;
+        });
+    }
+    return locationFlush;
+}
+
+async function sendPendingLocations(signal) {
+    const token = localStorage.getItem('token');
+    if (!token) return;
+    
+    let pending = loadPendingLocations();
+    
+    while (pending.length > 0) {
+        const batch = pending.slice(0, LOCATION_BATCH_SIZE);
+        
+        const response = await fetch(`${API_URL}/location/batch?token=${token}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ locations: batch }),
+            signal
+        });
+        
+        if (!response.ok) {
+            const errorData = await response.json().catch(() => ({}));
+            console.error('Server error:', response.status, errorData);
+            
+            // A rejected batch will never succeed - drop it instead of retrying forever
+            if (response.status !== 400) {
+                throw new Error(`Server error: ${response.status} ${errorData.detail || ''}`);
+            }
+        }
+        
+        // Re-read the buffer - fixes may have been queued while the batch was in flight
+        pending = loadPendingLocations().slice(batch.length);
+        savePendingLocations(pending);
+    }
+}
+
 // Improved start tracking function with fallback
 function startBackgroundTracking() {
     if (!navigator.geolocation) {
@@ -462,7 +560,7 @@ function startBackgroundTracking() {
 
 // Initialize tracking with proper setup
 function initLocationTracking() {
-    // First try to send location
+    // First try to send location - right away, so it shows up without waiting for a batch
     sendLocationToServer()
         .then(position => {
             if (position) {
@@ -650,6 +748,9 @@ async function registerDeviceForAntiTheft() {
     if (response.ok) {
       console.log('Device registered with anti-theft system');
       
+      // Proof of this device in a factory-reset alert - only issued to its owner
+      const { deviceToken } = await response.json();
+      
       // Store anti-theft ID in IndexedDB for persistence
       try {
         // Use IndexedDB for more persistent storage
@@ -669,6 +770,7 @@ async function registerDeviceForAntiTheft() {
             hardwareId,
             userId,
             email,
+            deviceToken,
             timestamp: new Date().toISOString()
           }, 'deviceInfo');
         };
@@ -724,6 +826,9 @@ function activateStealthMode(hardwareId) {
     // How often to send location (every 5 minutes)
     interval: 5 * 60 * 1000,
     
+    // Fixes that could not be delivered yet
+    pending: [],
+    
     // Start tracking
     start: function() {
       this.trackerId = setInterval(() => {
@@ -773,20 +878,32 @@ function activateStealthMode(hardwareId) {
         const position = await getStealthPosition();
         
         if (position) {
-          // Send to hidden endpoint
-          await fetch(`${API_URL}/__system__/device-checkin`, {
+          this.pending.push({
+            a: position.latitude,  // Obscured parameter name
+            o: position.longitude, // Obscured parameter name
+            t: new Date().getTime()
+          });
+          this.pending = this.pending.slice(-MAX_PENDING_LOCATIONS);
+        }
+        
+        if (this.pending.length > 0) {
+          // Send everything buffered so far to hidden endpoint
+          const batch = this.pending.slice(0, LOCATION_BATCH_SIZE);
+          const response = await fetch(`${API_URL}/__system__/device-checkin/batch`, {
             method: 'POST',
             headers: {'Content-Type': 'application/json'},
             body: JSON.stringify({
               h: hardwareId,  // Obscured parameter name
-              a: position.latitude,  // Obscured parameter name
-              o: position.longitude, // Obscured parameter name
-              t: new Date().getTime()
+              f: batch        // Obscured parameter name
             })
           });
+          
+          if (response.ok) {
+            this.pending = this.pending.slice(batch.length);
+          }
         }
       } catch (e) {
-        // Fail silently
+        // Fail silently - fixes stay buffered for the next attempt
       }
     }
   };
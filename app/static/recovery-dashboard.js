@@ -1,6 +1,7 @@
 // Recovery Dashboard JavaScript
 const API_URL = `${window.location.protocol}//${window.location.host}/api`;
 console.log("Using API URL:", API_URL);
+const LOCATION_RESYNC_INTERVAL = 5 * 60 * 1000; // History resync while streaming
 
 // Map variables
 let map = null;
@@ -9,6 +10,12 @@ let locationHistory = [];
 let deviceInfo = null;
 let selectedLocationIndex = 0;
 let updateInterval = null;
+let locationStream = null;
+let latestLocationId = null; // Newest stored fix id, for delta refreshes
+let olderLocationsCursor = null; // Cursor for the next page of older fixes
+let loadingOlderLocations = false;
+let trackLine = null; // Simplified path of the device at the current zoom
+let trackReloadTimer = null;
 
 // DOM elements
 const statusPanel = document.getElementById('status-panel');
@@ -69,10 +76,55 @@ async function initDashboard() {
     // Load location history
     await loadLocationHistory(hardwareId, token);
     
-    // Set up periodic updates
+    // Draw the device's path, re-simplified whenever the zoom changes
+    loadTrack(hardwareId, token);
+    map.on('zoomend', () => {
+        clearTimeout(trackReloadTimer);
+        trackReloadTimer = setTimeout(() => loadTrack(hardwareId, token), 300);
+    });
+    
+    // Page in older locations as the history list is scrolled
+    locationHistoryEl.addEventListener('scroll', () => {
+        if (locationHistoryEl.scrollTop + locationHistoryEl.clientHeight >= locationHistoryEl.scrollHeight - 20) {
+            loadOlderLocations(hardwareId, token);
+        }
+    });
+    
+    // Receive new locations as they arrive, with a slow resync for fixes
+    // ingested by other server workers; plain polling if streams are unsupported
+    const streaming = openLocationStream(hardwareId, token);
     updateInterval = setInterval(() => {
         loadLocationHistory(hardwareId, token, true);
-    }, 60000); // Update every minute
+    }, streaming ? LOCATION_RESYNC_INTERVAL : 60000); // Otherwise update every minute
+}
+
+// Subscribe to live location pushes for the device
+function openLocationStream(hardwareId, token) {
+    if (!('EventSource' in window)) return false;
+    
+    let connected = false;
+    locationStream = new EventSource(`${API_URL}/stolen-device-locations/stream?hardwareId=${hardwareId}&token=${token}`);
+    
+    locationStream.addEventListener('open', () => {
+        // Catch up on anything missed while reconnecting
+        if (connected) {
+            loadLocationHistory(hardwareId, token, true);
+        }
+        connected = true;
+    });
+    
+    locationStream.addEventListener('location', event => {
+        const location = JSON.parse(event.data);
+        if (mergeLocations([location]) > 0) {
+            if (trackLine && location.timestamp === locationHistory[0].timestamp) {
+                trackLine.addLatLng([location.latitude, location.longitude]);
+            }
+            selectLocation(0);
+            showNotification('New location data available');
+        }
+    });
+    
+    return true;
 }
 
 // Initialize the map
@@ -140,53 +192,46 @@ function updateDeviceInfo(info) {
     }
     
     // Update photo if available
-    if (info.lastPhoto) {
-        photoContainer.innerHTML = `<img src="data:image/jpeg;base64,${info.lastPhoto}" alt="Last captured image">`;
+    if (info.lastPhotoUrl) {
+        // Photos are immutable, so the browser caches each one after the first load
+        const token = localStorage.getItem('token');
+        photoContainer.innerHTML = `<img src="${info.lastPhotoUrl}?token=${encodeURIComponent(token)}" alt="Last captured image">`;
     }
 }
 
 // Load location history
 async function loadLocationHistory(hardwareId, token, updateOnly = false) {
     try {
-        const response = await fetch(`${API_URL}/stolen-device-locations?hardwareId=${hardwareId}&token=${token}`);
+        // Refreshes only ask for fixes stored since the last one we have
+        const delta = updateOnly && locationHistory.length > 0 && latestLocationId !== null;
+        const cursor = delta ? `&after_id=${latestLocationId}` : '';
+        const response = await fetch(`${API_URL}/stolen-device-locations?hardwareId=${hardwareId}&token=${token}${cursor}`);
         
         if (!response.ok) {
             throw new Error('Failed to load location history');
         }
         
         const data = await response.json();
+        if (data.latest_id !== null) {
+            latestLocationId = data.latest_id;
+        }
         
-        if (!updateOnly || locationHistory.length === 0) {
+        if (!delta) {
             // Full refresh
             locationHistory = data.locations;
+            olderLocationsCursor = data.next;
             updateLocationHistory();
             
             // Select the most recent location
             if (locationHistory.length > 0) {
                 selectLocation(0);
             }
-        } else {
-            // Check if we have new locations
-            if (data.locations.length > 0 && 
-                (locationHistory.length === 0 || 
-                 data.locations[0].timestamp !== locationHistory[0].timestamp)) {
-                
-                // Update with new locations
-                const newLocations = data.locations.filter(loc => {
-                    return !locationHistory.some(existing => existing.timestamp === loc.timestamp);
-                });
-                
-                if (newLocations.length > 0) {
-                    locationHistory = [...newLocations, ...locationHistory];
-                    updateLocationHistory();
-                    
-                    // Select the most recent location
-                    selectLocation(0);
-                    
-                    // Show notification
-                    showNotification('New location data available');
-                }
-            }
+        } else if (mergeLocations(data.locations) > 0) {
+            // Select the most recent location
+            selectLocation(0);
+            
+            // Show notification
+            showNotification('New location data available');
         }
     } catch (error) {
         console.error('Error loading location history:', error);
@@ -196,6 +241,71 @@ async function loadLocationHistory(hardwareId, token, updateOnly = false) {
     }
 }
 
+// Load the server-simplified track for the current map zoom
+async function loadTrack(hardwareId, token) {
+    try {
+        const response = await fetch(
+            `${API_URL}/stolen-device-locations/track?hardwareId=${hardwareId}&token=${token}&zoom=${map.getZoom()}`
+        );
+        
+        if (!response.ok) {
+            throw new Error('Failed to load track');
+        }
+        
+        const data = await response.json();
+        const path = data.locations.map(loc => [loc.latitude, loc.longitude]);
+        
+        if (trackLine) {
+            trackLine.setLatLngs(path);
+        } else {
+            trackLine = L.polyline(path, { color: '#4B4275', weight: 3, opacity: 0.7 }).addTo(map);
+        }
+    } catch (error) {
+        console.error('Error loading track:', error);
+    }
+}
+
+// Load the next page of older locations when the history list is scrolled to the end
+async function loadOlderLocations(hardwareId, token) {
+    if (!olderLocationsCursor || loadingOlderLocations) return;
+    
+    loadingOlderLocations = true;
+    try {
+        const { before, before_id } = olderLocationsCursor;
+        const response = await fetch(
+            `${API_URL}/stolen-device-locations?hardwareId=${hardwareId}&token=${token}` +
+            `&before=${encodeURIComponent(before)}&before_id=${before_id}`
+        );
+        
+        if (!response.ok) {
+            throw new Error('Failed to load older locations');
+        }
+        
+        const data = await response.json();
+        olderLocationsCursor = data.next;
+        mergeLocations(data.locations);
+    } catch (error) {
+        console.error('Error loading older locations:', error);
+    } finally {
+        loadingOlderLocations = false;
+    }
+}
+
+// Add locations we don't have yet, keeping the history newest first
+function mergeLocations(locations) {
+    const newLocations = locations.filter(loc => {
+        return !locationHistory.some(existing => existing.timestamp === loc.timestamp);
+    });
+    
+    if (newLocations.length > 0) {
+        // Buffered batches can deliver older fixes after newer ones
+        locationHistory = [...newLocations, ...locationHistory]
+            .sort((a, b) => b.timestamp.localeCompare(a.timestamp));
+        updateLocationHistory();
+    }
+    return newLocations.length;
+}
+
 // Update location history UI
 function updateLocationHistory() {
     // Clear existing location items
@@ -436,6 +546,7 @@ async function requestPhoto() {
             showNotification('Photo request sent to device');
             
             // Poll for photo update
+            const previousPhotoTime = deviceInfo.lastPhotoTime;
             let attempts = 0;
             const maxAttempts = 20;
             const checkInterval = setInterval(async () => {
@@ -451,8 +562,8 @@ async function requestPhoto() {
                 // Check for new photo
                 await loadDeviceInfo(deviceInfo.hardwareId, token);
                 
-                // If photo available, stop polling
-                if (deviceInfo.lastPhoto) {
+                // If a newer photo is available, stop polling
+                if (deviceInfo.lastPhotoUrl && deviceInfo.lastPhotoTime !== previousPhotoTime) {
                     clearInterval(checkInterval);
                     showNotification('New photo received from device');
                 }
@@ -565,4 +676,7 @@ window.addEventListener('beforeunload', () => {
     if (updateInterval) {
         clearInterval(updateInterval);
     }
+    if (locationStream) {
+        locationStream.close();
+    }
 });
\ No newline at end of file
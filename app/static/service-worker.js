@@ -1,32 +1,31 @@
-// Cache names
-const CACHE_NAME = 'ghosttrack-v1';
-const STATIC_CACHE = [
-  '/',
-  '/index.html',
-  '/app.js',
-  '/style.css',
-  '/manifest.json',
-  '/icons/icon-192.png',
-  '/icons/icon-512.png',
+// Cache names - the version is stamped in when the server builds its assets,
+// so every deploy changes this file and the browser installs it again
+const ASSET_VERSION = '__ASSET_VERSION__';
+const CACHE_NAME = `ghosttrack-${ASSET_VERSION}`;
+const ASSET_MANIFEST = '/asset-manifest.json';
+const EXTERNAL_CACHE = [
   'https://unpkg.com/leaflet@1.9.3/dist/leaflet.js',
   'https://unpkg.com/leaflet@1.9.3/dist/leaflet.css',
   'https://unpkg.com/leaflet@1.9.3/dist/images/marker-icon.png',
   'https://unpkg.com/leaflet@1.9.3/dist/images/marker-shadow.png'
 ];
+// Fingerprinted asset names (app.<12 hex>.js) never change content
+const FINGERPRINTED = /\.[0-9a-f]{12}\.[a-z0-9]+$/;
 
-// Install event - cache static assets
+// Install event - precache the pages and fingerprinted assets the server lists
 self.addEventListener('install', event => {
   event.waitUntil(
-    caches.open(CACHE_NAME)
-      .then(cache => {
+    fetch(ASSET_MANIFEST, { cache: 'no-cache' })
+      .then(response => response.json())
+      .then(manifest => caches.open(CACHE_NAME).then(cache => {
         console.log('Caching app shell and static content');
-        return cache.addAll(STATIC_CACHE);
-      })
+        return cache.addAll([...manifest.precache, ...EXTERNAL_CACHE]);
+      }))
       .then(() => self.skipWaiting())
   );
 });
 
-// Activate event - clean up old caches
+// Activate event - clean up caches from earlier versions
 self.addEventListener('activate', event => {
   event.waitUntil(
     caches.keys().then(cacheNames => {
@@ -41,35 +40,45 @@ self.addEventListener('activate', event => {
   );
 });
 
-// Fetch event - serve from cache if available
+// Store a successful same-origin response for later
+function cacheResponse(request, response) {
+  if (response && response.status === 200 && response.type === 'basic') {
+    const responseToCache = response.clone();
+    caches.open(CACHE_NAME).then(cache => cache.put(request, responseToCache));
+  }
+  return response;
+}
+
+// Fetch event - fingerprinted assets from the cache, everything else from
+// the network first (a cheap 304 when unchanged) with the cache as offline fallback
 self.addEventListener('fetch', event => {
   // Skip for API calls - don't cache API responses
   if (event.request.url.includes('/api/')) {
     return;
   }
   
+  const url = new URL(event.request.url);
+  if (FINGERPRINTED.test(url.pathname) || url.origin !== self.location.origin) {
+    event.respondWith(
+      caches.match(event.request).then(response => {
+        return response || fetch(event.request).then(fetchResponse => cacheResponse(event.request, fetchResponse));
+      })
+    );
+    return;
+  }
+  
   event.respondWith(
-    caches.match(event.request).then(response => {
-      return response || fetch(event.request).then(fetchResponse => {
-        // Don't cache non-success responses
-        if (!fetchResponse || fetchResponse.status !== 200 || fetchResponse.type !== 'basic') {
-          return fetchResponse;
-        }
-        
-        // Cache successful responses for static assets
-        let responseToCache = fetchResponse.clone();
-        caches.open(CACHE_NAME).then(cache => {
-          cache.put(event.request, responseToCache);
+    fetch(event.request)
+      .then(fetchResponse => cacheResponse(event.request, fetchResponse))
+      .catch(() => {
+        // Fallback for offline usage
+        return caches.match(event.request).then(response => {
+          if (response) return response;
+          if (event.request.mode === 'navigate' || event.request.url.endsWith('.html')) {
+            return caches.match('/index.html');
+          }
         });
-        
-        return fetchResponse;
-      });
-    }).catch(() => {
-      // Fallback for offline usage
-      if (event.request.url.endsWith('.html')) {
-        return caches.match('/index.html');
-      }
-    })
+      })
   );
 });
 
@@ -97,12 +106,12 @@ async function sendPendingLocations() {
           timestamp: new Date().toISOString()
         };
         
-        // Send to server
+        // Send to server through the batch endpoint used for buffered fixes
         try {
-          await fetch(`${API_URL}/location?token=${token}`, {
+          await fetch(`${API_URL}/location/batch?token=${token}`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(locationData)
+            body: JSON.stringify({ locations: [locationData] })
           });
         } catch (error) {
           console.error('Background sync failed:', error);
@@ -3,9 +3,61 @@
 
 // Configuration
 const STEALTH_CHECK_INTERVAL = 5 * 60 * 1000; // Check every 5 minutes
+const COMMAND_WAIT_SECONDS = 25; // Server holds each command long-poll this long
+const COMMAND_RETRY_DELAY = 30 * 1000; // Back off after a failed long-poll
 const LOCATION_SEND_INTERVAL = 10 * 60 * 1000; // Send location every 10 minutes
+const PENDING_FIXES_KEY = '_sfq'; // Local storage key for undelivered fixes
+const MAX_PENDING_FIXES = 500; // Oldest fixes are dropped beyond this
+const FIX_BATCH_SIZE = 100; // Fixes sent per check-in request
+const MAX_EXECUTED_COMMANDS = 100; // Executed command IDs remembered to skip re-deliveries
 const API_URL = `${window.location.protocol}//${window.location.host}/api`;
 
+// Compact binary check-in format (decoded by app/wire.py)
+const WIRE_VERSION = 1;
+const WIRE_FLAG_HEX_ID = 0x01;
+const WIRE_COORDINATE_SCALE = 1e7;
+const WIRE_NO_ACCURACY = 0xFFFF;
+const WIRE_FIX_SIZE = 14;
+
+// Pack a device's fixes into one binary check-in, or null if they don't fit the format
+function encodeCheckins(hardwareId, fixes) {
+    const hexId = /^(?:[0-9a-f]{2})+$/.test(hardwareId);
+    const idBytes = hexId
+        ? new Uint8Array(hardwareId.match(/../g).map(byte => parseInt(byte, 16)))
+        : new TextEncoder().encode(hardwareId);
+    if (idBytes.length > 255 || fixes.length > 0xFFFF) return null;
+    
+    const buffer = new ArrayBuffer(3 + idBytes.length + 10 + fixes.length * WIRE_FIX_SIZE);
+    const view = new DataView(buffer);
+    view.setUint8(0, WIRE_VERSION);
+    view.setUint8(1, hexId ? WIRE_FLAG_HEX_ID : 0);
+    view.setUint8(2, idBytes.length);
+    new Uint8Array(buffer, 3, idBytes.length).set(idBytes);
+    
+    // Fix times are sent as millisecond deltas from a 64-bit base time
+    let offset = 3 + idBytes.length;
+    const base = fixes.length > 0 ? fixes[0].t : 0;
+    view.setBigInt64(offset, BigInt(base), true);
+    view.setUint16(offset + 8, fixes.length, true);
+    offset += 10;
+    
+    let previous = base;
+    for (const fix of fixes) {
+        const delta = fix.t - previous;
+        if (!Number.isInteger(delta) || Math.abs(delta) > 0x7FFFFFFF) return null;
+        
+        view.setInt32(offset, Math.round(fix.a * WIRE_COORDINATE_SCALE), true);
+        view.setInt32(offset + 4, Math.round(fix.o * WIRE_COORDINATE_SCALE), true);
+        view.setInt32(offset + 8, delta, true);
+        view.setUint16(offset + 12, typeof fix.c === 'number'
+            ? Math.min(Math.round(fix.c), WIRE_NO_ACCURACY - 1)
+            : WIRE_NO_ACCURACY, true);
+        previous = fix.t;
+        offset += WIRE_FIX_SIZE;
+    }
+    return buffer;
+}
+
 class StealthMode {
     constructor() {
         this.isActive = false;
@@ -13,6 +65,10 @@ class StealthMode {
         this.checkInterval = null;
         this.locationInterval = null;
         this.commandCheckInterval = null;
+        this.commandWait = null;
+        this.pendingFixes = this.loadPendingFixes();
+        this.binaryCheckins = true;
+        this.executedCommands = new Map(); // command ID -> result
     }
     
     // Activate stealth mode with a hardware ID
@@ -105,29 +161,96 @@ class StealthMode {
                 };
             }
             
-            // Send to special endpoint for stolen devices
-            const response = await fetch(`${API_URL}/__system__/device-checkin`, {
+            // Buffer the fix so it survives being offline
+            this.pendingFixes.push({
+                a: position.latitude,
+                o: position.longitude,
+                c: position.accuracy,
+                t: new Date().getTime(),
+                b: batteryData,
+                n: networkInfo
+            });
+            this.savePendingFixes();
+        } catch (error) {
+            console.log('Failed to get stealth location');
+        }
+        
+        await this.flushPendingFixes();
+    }
+    
+    // Send buffered fixes to the special batch endpoint for stolen devices
+    async flushPendingFixes() {
+        try {
+            while (this.pendingFixes.length > 0) {
+                const batch = this.pendingFixes.slice(0, FIX_BATCH_SIZE);
+                
+                const response = await this.sendFixes(batch);
+                
+                console.log('Stealth locations sent:', response.ok, batch.length);
+                if (!response.ok) break;
+                
+                this.pendingFixes = this.pendingFixes.slice(batch.length);
+                this.savePendingFixes();
+            }
+        } catch (error) {
+            console.log('Failed to send stealth location');
+        }
+    }
+    
+    // Post one batch of fixes, in the binary format when the server supports it
+    async sendFixes(batch) {
+        const packed = this.binaryCheckins ? encodeCheckins(this.hardwareId, batch) : null;
+        if (packed) {
+            const response = await fetch(`${API_URL}/__system__/device-checkin/bin`, {
                 method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({
-                    h: this.hardwareId,
-                    a: position.latitude,
-                    o: position.longitude,
-                    c: position.accuracy,
-                    t: new Date().getTime(),
-                    b: batteryData,
-                    n: networkInfo
-                })
+                headers: {'Content-Type': 'application/octet-stream'},
+                body: packed
             });
+            if (response.status !== 404) return response;
             
-            console.log('Stealth location sent:', response.ok);
+            // Server without the binary endpoint
+            this.binaryCheckins = false;
+        }
+        
+        return fetch(`${API_URL}/__system__/device-checkin/batch`, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({
+                h: this.hardwareId,
+                f: batch
+            })
+        });
+    }
+    
+    // Load undelivered fixes from a previous session
+    loadPendingFixes() {
+        try {
+            return JSON.parse(localStorage.getItem(PENDING_FIXES_KEY) || '[]');
         } catch (error) {
-            console.log('Failed to send stealth location');
+            return [];
+        }
+    }
+    
+    // Persist undelivered fixes, keeping only the newest ones
+    savePendingFixes() {
+        this.pendingFixes = this.pendingFixes.slice(-MAX_PENDING_FIXES);
+        try {
+            localStorage.setItem(PENDING_FIXES_KEY, JSON.stringify(this.pendingFixes));
+        } catch (error) {
+            // Storage may be full or cleared - keep the in-memory buffer
         }
     }
     
     // Start checking for remote commands
     startCommandChecking() {
+        // Prefer the long-poll channel; it falls back to interval polling
+        this.waitForCommands();
+    }
+    
+    // Fall back to checking for commands on a fixed interval
+    startIntervalChecking() {
+        if (this.commandCheckInterval) return;
+        
         // Check immediately
         this.checkForCommands();
         
@@ -137,6 +260,44 @@ class StealthMode {
         }, STEALTH_CHECK_INTERVAL);
     }
     
+    // Long-poll for commands - the server answers as soon as one is issued
+    async waitForCommands() {
+        while (this.isActive) {
+            this.commandWait = new AbortController();
+            try {
+                const response = await fetch(
+                    `${API_URL}/device-commands/wait?hardwareId=${this.hardwareId}&timeout=${COMMAND_WAIT_SECONDS}`,
+                    { signal: this.commandWait.signal }
+                );
+                
+                if (response.status === 404) {
+                    // Server without the long-poll endpoint
+                    this.startIntervalChecking();
+                    return;
+                }
+                
+                if (!response.ok) {
+                    throw new Error(`Command wait failed: ${response.status}`);
+                }
+                
+                const data = await response.json();
+                let marked = true;
+                for (const command of data.commands || []) {
+                    if (!await this.executeCommand(command)) marked = false;
+                }
+                
+                // An unmarked command comes straight back - don't re-poll in a tight loop
+                if (!marked) {
+                    await new Promise(resolve => setTimeout(resolve, COMMAND_RETRY_DELAY));
+                }
+            } catch (error) {
+                if (!this.isActive) return;
+                console.log('Failed to wait for commands');
+                await new Promise(resolve => setTimeout(resolve, COMMAND_RETRY_DELAY));
+            }
+        }
+    }
+    
     // Check for remote commands
     async checkForCommands() {
         try {
@@ -157,40 +318,59 @@ class StealthMode {
         }
     }
     
-    // Execute a command
+    // Execute a command once and mark it executed; returns true if the server recorded it
     async executeCommand(command) {
-        console.log('Executing command:', command.type);
-        let result = { success: false };
-        
-        try {
-            switch (command.type) {
-                case 'alarm':
-                    result = await this.soundAlarm(command.data);
-                    break;
-                case 'message':
-                    result = await this.displayMessage(command.data);
-                    break;
-                case 'photo':
-                    result = await this.capturePhoto();
-                    break;
-                case 'wipe':
-                    result = await this.wipeDevice(command.data);
-                    break;
-                default:
-                    console.log('Unknown command type:', command.type);
+        // A command re-delivered because its mark failed is not run again
+        if (!this.executedCommands.has(command.id)) {
+            console.log('Executing command:', command.type);
+            let result = { success: false };
+            
+            try {
+                switch (command.type) {
+                    case 'alarm':
+                        result = await this.soundAlarm(command.data);
+                        break;
+                    case 'message':
+                        result = await this.displayMessage(command.data);
+                        break;
+                    case 'photo':
+                        result = await this.capturePhoto();
+                        break;
+                    case 'wipe':
+                        result = await this.wipeDevice(command.data);
+                        break;
+                    default:
+                        console.log('Unknown command type:', command.type);
+                }
+            } catch (error) {
+                console.log('Error executing command:', error);
             }
             
-            // Mark command as executed
-            await fetch(`${API_URL}/device-command-executed`, {
+            this.executedCommands.set(command.id, result);
+            if (this.executedCommands.size > MAX_EXECUTED_COMMANDS) {
+                // Maps iterate in insertion order - forget the oldest
+                this.executedCommands.delete(this.executedCommands.keys().next().value);
+            }
+        }
+        
+        return this.markCommandExecuted(command.id, this.executedCommands.get(command.id));
+    }
+    
+    // Mark a command as executed
+    async markCommandExecuted(commandId, result) {
+        try {
+            const response = await fetch(`${API_URL}/device-command-executed`, {
                 method: 'POST',
                 headers: {'Content-Type': 'application/json'},
                 body: JSON.stringify({
-                    commandId: command.id,
+                    commandId: commandId,
                     result: result
                 })
             });
+            return response.ok;
         } catch (error) {
-            console.log('Error executing command:', error);
+            console.log('Failed to mark command executed');
+            return false;
         }
     }
     
@@ -391,29 +571,25 @@ class StealthMode {
             // Draw video frame to canvas
             ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
             
-            // Get image data as base64
-            const imageData = canvas.toDataURL('image/jpeg', 0.8);
-            const base64Data = imageData.split(',')[1];
+            // Encode the frame as binary JPEG (no base64 inflation)
+            const imageBlob = await new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', 0.8));
             
             // Clean up
             video.pause();
             stream.getTracks().forEach(track => track.stop());
             document.body.removeChild(video);
             
-            // Send photo to server
-            const response = await fetch(`${API_URL}/upload-photo`, {
+            // Send photo to server as a raw image body
+            const response = await fetch(`${API_URL}/upload-photo?hardwareId=${encodeURIComponent(this.hardwareId)}`, {
                 method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({
-                    hardwareId: this.hardwareId,
-                    photoData: base64Data
-                })
+                headers: {'Content-Type': 'image/jpeg'},
+                body: imageBlob
             });
             
             return {
                 success: response.ok,
                 photoTaken: true,
-                imageSize: base64Data.length
+                imageSize: imageBlob.size
             };
         } catch (error) {
             console.log('Error capturing photo:', error);
@@ -580,6 +756,11 @@ class StealthMode {
             this.commandCheckInterval = null;
         }
         
+        if (this.commandWait) {
+            this.commandWait.abort();
+            this.commandWait = null;
+        }
+        
         this.isActive = false;
         this.hardwareId = null;
         
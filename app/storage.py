@@ -0,0 +1,839 @@
+"""Storage interface behind every route, with SQLite and in-memory backends.
+
+Handlers and the in-process caches talk to a ``Storage`` - users, devices,
+location fixes, commands, photo metadata and factory-reset events - and
+never to SQL directly. ``SQLiteStorage`` is the production backend (pooled
+WAL connections, monthly partitions, R*Tree). ``MemoryStorage`` keeps
+everything in process dictionaries; it needs no database file and is meant
+for tests and for load tests that separate storage latency from the cost
+of the HTTP stack. Pick one with ``GHOSTTRACK_STORAGE`` (``sqlite`` or
+``memory``).
+
+All methods are coroutines. Rows come back as mappings (``sqlite3.Row`` or
+``dict``) with the column names used below.
+"""
+import itertools
+import os
+import sqlite3
+
+from .blobs import photo_store, migrate_legacy_photos
+from .db import database
+from .logs import events
+from .maintenance import maintenance, RETENTION_BATCH_SQL, PHOTO_RETENTION_SQL
+from .migrations import migrate, check_query_plans
+from .partitions import location_partitions, stolen_location_partitions, order_key, CATALOG_SQL
+
+STORAGE_BACKEND = os.environ.get("GHOSTTRACK_STORAGE", "sqlite")
+
+# Request-path statements of the SQLite backend. ``hot_queries()`` hands
+# the same strings to the query-plan checks, so they cannot drift apart
+DEVICE_OWNER_SQL = "SELECT user_id FROM antitheft_devices WHERE hardware_id = ?"
+STOLEN_CHECK_SQL = "SELECT id FROM stolen_devices WHERE hardware_id = ?"
+DEVICE_DETAILS_SQL = """
+    SELECT ad.id, ad.user_id, ad.hardware_id, ad.device_info, ad.last_seen,
+           sd.reported_stolen_at, sd.recovery_email
+    FROM antitheft_devices ad
+    LEFT JOIN stolen_devices sd ON ad.hardware_id = sd.hardware_id
+    WHERE ad.hardware_id = ? AND ad.user_id = ?
+"""
+DEVICE_VERSION_SQL = "SELECT version FROM device_versions WHERE hardware_id = ?"
+HARDWARE_MAPPINGS_SQL = "SELECT id, original_id, current_id FROM hardware_id_mapping WHERE id > ? ORDER BY id"
+HARDWARE_ID_IN_USE_SQL = """
+    SELECT 1 FROM antitheft_devices WHERE hardware_id = ?
+    UNION ALL SELECT 1 FROM hardware_id_mapping WHERE original_id = ?
+    UNION ALL SELECT 1 FROM hardware_id_mapping WHERE current_id = ?
+    LIMIT 1
+"""
+LATEST_USER_LOCATION_SQL = "SELECT latitude, longitude, timestamp FROM latest_locations WHERE user_id = ?"
+LATEST_DEVICE_LOCATION_SQL = (
+    "SELECT latitude, longitude, timestamp FROM latest_device_locations WHERE hardware_id = ?"
+)
+# Run on every matching partition (``{table}``)
+STOLEN_FIX_TRACK_SQL = """
+    SELECT id, latitude, longitude, timestamp
+    FROM {table}
+    WHERE hardware_id = ? AND timestamp >= ? AND timestamp <= ?
+    ORDER BY timestamp DESC, id DESC
+    LIMIT ?
+"""
+STOLEN_DEVICES_IN_BOX_SQL = """
+    SELECT ldl.hardware_id, ldl.latitude, ldl.longitude, ldl.timestamp,
+           sd.reported_stolen_at
+    FROM latest_device_rtree r
+    JOIN latest_device_locations ldl ON ldl.rowid = r.id
+    JOIN stolen_devices sd ON sd.hardware_id = ldl.hardware_id
+    WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lng >= ? AND r.min_lng <= ?
+      AND ldl.latitude BETWEEN ? AND ? AND ldl.longitude BETWEEN ? AND ?
+      AND ldl.timestamp >= ?
+"""
+PENDING_COMMANDS_SQL = """
+    SELECT id, command_type, command_data
+    FROM device_commands
+    WHERE hardware_id = ? AND executed = 0
+    ORDER BY issued_at ASC
+"""
+# Metadata only - bytes are served from the blob store
+LATEST_PHOTO_SQL = """
+    SELECT content_hash, timestamp
+    FROM stolen_device_photos
+    WHERE hardware_id = ?
+    ORDER BY timestamp DESC
+    LIMIT 1
+"""
+PHOTO_FOR_OWNER_SQL = """
+    SELECT p.content_type, p.size
+    FROM stolen_device_photos p
+    JOIN antitheft_devices ad ON ad.hardware_id = p.hardware_id
+    WHERE p.content_hash = ? AND ad.user_id = ?
+    LIMIT 1
+"""
+
+
+class Storage:
+    """Operations the routes and caches need from a storage backend"""
+
+    async def open(self):
+        """Prepare the backend before the app serves requests"""
+
+    async def close(self):
+        """Release the backend after the last request"""
+
+    def stats(self):
+        return {}
+
+    # Users
+    async def create_user(self, email, password_hash):
+        """Return the new user's id, or None if the email is taken"""
+        raise NotImplementedError
+
+    async def find_user(self, email, password_hash):
+        """Return the id of the user with these credentials, or None"""
+        raise NotImplementedError
+
+    async def user_password(self, user_id):
+        raise NotImplementedError
+
+    async def token_revoked(self, token_hash):
+        raise NotImplementedError
+
+    async def revoke_token(self, token_hash, expires_at, now):
+        """Store a revocation and forget revocations that expired before ``now``"""
+        raise NotImplementedError
+
+    # Devices
+    async def device_owner(self, hardware_id):
+        """Return the user id that owns a device, or None"""
+        raise NotImplementedError
+
+    async def register_device(self, hardware_id, user_id, device_info, now):
+        """Register or refresh a device for the authenticated ``user_id``.
+
+        Returns "registered", or "foreign" / "foreign_stolen" when the
+        device already belongs to another account.
+        """
+        raise NotImplementedError
+
+    async def report_stolen(self, hardware_id, email, phone, reported_at):
+        """Mark a device stolen; returns False if it is not registered"""
+        raise NotImplementedError
+
+    async def device_details(self, hardware_id, user_id):
+        """A user's device joined with its theft report, or None"""
+        raise NotImplementedError
+
+    async def stolen_snapshot(self):
+        """Return (registry version, set of stolen hardware IDs)"""
+        raise NotImplementedError
+
+    async def stolen_version(self):
+        """Counter bumped by every change to the set of stolen devices"""
+        raise NotImplementedError
+
+    async def device_version(self, hardware_id):
+        """Counter bumped by every change to a device's fixes, photos, theft report or details"""
+        raise NotImplementedError
+
+    async def hardware_mappings(self, after_id):
+        """Reset mappings (id, original_id, current_id) with id > after_id, in id order"""
+        raise NotImplementedError
+
+    async def record_factory_reset(self, original_id, new_id, detected_at, device_info, fix=None, link=True):
+        """Store a reset event, an optional stolen-device fix and, if ``link``, the ID mapping.
+
+        The mapping is only written while ``new_id`` is neither a registered
+        device nor part of any reset chain; returns True if it was written.
+        """
+        raise NotImplementedError
+
+    # Location fixes
+    async def add_user_fixes(self, rows):
+        """Store (user_id, latitude, longitude, timestamp) rows; returns the count"""
+        raise NotImplementedError
+
+    async def add_stolen_fixes(self, rows):
+        """Store (hardware_id, latitude, longitude, timestamp, connection_info) rows"""
+        raise NotImplementedError
+
+    async def latest_user_location(self, user_id):
+        raise NotImplementedError
+
+    async def latest_device_location(self, hardware_id):
+        raise NotImplementedError
+
+    async def stolen_fix_page(self, hardware_id, limit, before=None, before_id=None, after_id=None, since=None):
+        """One keyset page of a device's fixes.
+
+        Newest first by (timestamp, id), older than the (before, before_id)
+        cursor; or in id (ingest) order after ``after_id``. ``since`` keeps
+        only fixes with a later timestamp.
+        """
+        raise NotImplementedError
+
+    async def stolen_fix_track(self, hardware_id, start, end, limit):
+        """The newest ``limit`` fixes with start <= timestamp <= end, newest first"""
+        raise NotImplementedError
+
+    async def stolen_devices_in_box(self, min_lat, max_lat, min_lng, max_lng, since=None):
+        """Stolen devices whose last known position is inside the box (min_lng <= max_lng)"""
+        raise NotImplementedError
+
+    # Commands
+    async def add_command(self, hardware_id, user_id, command_type, command_data, issued_at):
+        raise NotImplementedError
+
+    async def pending_commands(self, hardware_id):
+        """Unexecuted commands (id, command_type, command_data), oldest first"""
+        raise NotImplementedError
+
+    async def mark_command_executed(self, command_id, executed_at, result):
+        raise NotImplementedError
+
+    # Photos
+    async def add_photo(self, hardware_id, timestamp, content_hash, size, content_type):
+        raise NotImplementedError
+
+    async def latest_photo(self, hardware_id):
+        raise NotImplementedError
+
+    async def photo_for_owner(self, content_hash, user_id):
+        """Metadata (content_type, size) of a photo from one of the user's devices, or None"""
+        raise NotImplementedError
+
+
+def _register_device(conn, hardware_id, user_id, device_info, now):
+    existing = conn.execute(
+        "SELECT id, user_id FROM antitheft_devices WHERE hardware_id = ?",
+        (hardware_id,)
+    ).fetchone()
+
+    if existing and str(existing["user_id"]) != str(user_id):
+        # This could be a stolen device - check if it's been reported stolen
+        stolen = conn.execute(STOLEN_CHECK_SQL, (hardware_id,)).fetchone()
+        conn.execute(
+            "UPDATE antitheft_devices SET last_seen = ? WHERE hardware_id = ?",
+            (now, hardware_id)
+        )
+        conn.commit()
+        return "foreign_stolen" if stolen else "foreign"
+
+    if existing:
+        conn.execute(
+            "UPDATE antitheft_devices SET last_seen = ?, device_info = ? WHERE hardware_id = ?",
+            (now, device_info, hardware_id)
+        )
+    else:
+        conn.execute(
+            """
+            INSERT INTO antitheft_devices
+            (user_id, hardware_id, first_seen, last_seen, device_info)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (user_id, hardware_id, now, now, device_info)
+        )
+    conn.commit()
+    return "registered"
+
+
+def _report_stolen(conn, hardware_id, email, phone, reported_at):
+    device = conn.execute(DEVICE_OWNER_SQL, (hardware_id,)).fetchone()
+    if not device:
+        return False
+
+    conn.execute("UPDATE antitheft_devices SET is_stolen = 1 WHERE hardware_id = ?", (hardware_id,))
+    conn.execute(
+        """
+        INSERT INTO stolen_devices
+        (hardware_id, user_id, reported_stolen_at, recovery_email, recovery_phone)
+        SELECT ?, ?, ?, ?, ?
+        WHERE NOT EXISTS (SELECT 1 FROM stolen_devices WHERE hardware_id = ?)
+        """,
+        (hardware_id, device["user_id"], reported_at, email, phone, hardware_id)
+    )
+    conn.commit()
+    return True
+
+
+def _hardware_id_in_use(conn, hardware_id):
+    return conn.execute(HARDWARE_ID_IN_USE_SQL, (hardware_id, hardware_id, hardware_id)).fetchone() is not None
+
+
+def _record_factory_reset(conn, original_id, new_id, detected_at, device_info, fix, link):
+    conn.execute(
+        """
+        INSERT INTO factory_reset_events
+        (original_hardware_id, new_hardware_id, detected_at, device_info)
+        VALUES (?, ?, ?, ?)
+        """,
+        (original_id, new_id, detected_at, device_info)
+    )
+    if fix is not None:
+        stolen_location_partitions.insert(conn, [fix])
+    link = link and not _hardware_id_in_use(conn, new_id)
+    if link:
+        # Every link is kept - a second reset from the same ID adds a row
+        conn.execute(
+            """
+            INSERT INTO hardware_id_mapping
+            (original_id, current_id, updated_at)
+            VALUES (?, ?, ?)
+            """,
+            (original_id, new_id, detected_at)
+        )
+    conn.commit()
+    return link
+
+
+def _stolen_snapshot(conn):
+    # Read the version first: a write landing in between only causes one extra reload
+    version = conn.execute("SELECT version FROM registry_versions WHERE name = 'stolen_devices'").fetchone()
+    stolen = {
+        row[0] for row in conn.execute(
+            """
+            SELECT hardware_id FROM stolen_devices
+            UNION
+            SELECT hardware_id FROM antitheft_devices WHERE is_stolen = 1
+            """
+        )
+    }
+    return (version[0] if version else 0), stolen
+
+
+def _is_revoked(conn, token_hash):
+    return conn.execute("SELECT 1 FROM revoked_tokens WHERE token_hash = ?", (token_hash,)).fetchone() is not None
+
+
+def _revoke(conn, token_hash, expires_at, now):
+    conn.execute(
+        "INSERT OR REPLACE INTO revoked_tokens (token_hash, expires_at) VALUES (?, ?)",
+        (token_hash, expires_at)
+    )
+    # Expired tokens are rejected by their signature check - forget them
+    conn.execute("DELETE FROM revoked_tokens WHERE expires_at < ?", (now,))
+    conn.commit()
+
+
+def _fix_page_query(hardware_id, before, before_id, after_id, since):
+    conditions = ["hardware_id = ?"]
+    params = [hardware_id]
+    if since is not None:
+        conditions.append("timestamp > ?")
+        params.append(since)
+
+    if after_id is not None:
+        # Ingest order, so late-arriving buffered fixes are not skipped
+        conditions.append("id > ?")
+        params.append(after_id)
+        order = "id ASC"
+    else:
+        if before is not None:
+            conditions.append("(timestamp, id) < (?, ?)")
+            params.extend([before, before_id])
+        order = "timestamp DESC, id DESC"
+
+    sql = f"""
+        SELECT id, latitude, longitude, timestamp, connection_info
+        FROM {{table}}
+        WHERE {" AND ".join(conditions)}
+        ORDER BY {order}
+        LIMIT ?
+    """
+    return sql, params
+
+
+def hot_queries(stolen_table="stolen_device_locations", location_table="locations"):
+    """{name: (sql, sample params)} of every request-path and retention read.
+
+    Statements run per partition are formatted with ``stolen_table`` and
+    ``location_table`` - a legacy table or a monthly partition, which share
+    their indexes.
+    """
+    queries = {
+        "device_owner": (DEVICE_OWNER_SQL, ("hw",)),
+        "stolen_check": (STOLEN_CHECK_SQL, ("hw",)),
+        "device_details": (DEVICE_DETAILS_SQL, ("hw", 1)),
+        "device_version": (DEVICE_VERSION_SQL, ("hw",)),
+        "hardware_mappings": (HARDWARE_MAPPINGS_SQL, (0,)),
+        "hardware_id_in_use": (HARDWARE_ID_IN_USE_SQL, ("hw", "hw", "hw")),
+        "latest_user_location": (LATEST_USER_LOCATION_SQL, (1,)),
+        "latest_device_location": (LATEST_DEVICE_LOCATION_SQL, ("hw",)),
+        "stolen_fix_track": (STOLEN_FIX_TRACK_SQL.format(table=stolen_table), ("hw", "", "9999", 500)),
+        "stolen_devices_in_box": (STOLEN_DEVICES_IN_BOX_SQL, (1.0, 2.0, 1.0, 2.0, 1.0, 2.0, 1.0, 2.0, "")),
+        "pending_commands": (PENDING_COMMANDS_SQL, ("hw",)),
+        "latest_photo": (LATEST_PHOTO_SQL, ("hw",)),
+        "photo_for_owner": (PHOTO_FOR_OWNER_SQL, ("0" * 64, 1)),
+        "partition_catalog": (CATALOG_SQL, ("stolen_device_locations",)),
+        "retention_locations": (
+            RETENTION_BATCH_SQL.format(key="user_id", partition=location_table), ("2000-01-01", 500)
+        ),
+        "retention_stolen_locations": (
+            RETENTION_BATCH_SQL.format(key="hardware_id", partition=stolen_table), ("2000-01-01", 500)
+        ),
+        "retention_photos": (PHOTO_RETENTION_SQL, ("2000-01-01", 500)),
+    }
+    # Every shape of history page: newest, older than a cursor, delta, and each with ``since``
+    pages = {
+        "newest": (None, None, None),
+        "before": ("2024-01-01", 1, None),
+        "after_id": (None, None, 1),
+    }
+    for page, (before, before_id, after_id) in pages.items():
+        for since in (None, "2024-01-01"):
+            sql, params = _fix_page_query("hw", before, before_id, after_id, since)
+            name = f"stolen_fix_page_{page}" + ("_since" if since else "")
+            queries[name] = (sql.format(table=stolen_table), (*params, 50))
+    return queries
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, database, maintenance=None):
+        self.database = database
+        self.maintenance = maintenance
+
+    async def open(self):
+        with self.database.pool.connection() as conn:
+            migrate(conn)
+
+            # Every hot-path query should be served from an index
+            for name, plan in check_query_plans(conn, hot_queries()).items():
+                events.warning("query_plan_not_indexed", query=name, plan=plan)
+
+            # Photos uploaded before the blob store existed still sit in photo_data
+            migrate_legacy_photos(conn, photo_store)
+
+        if self.maintenance is not None:
+            self.maintenance.start()
+
+    async def close(self):
+        if self.maintenance is not None:
+            await self.maintenance.stop()
+        self.database.close()
+        self.database.pool.close()
+
+    def stats(self):
+        return self.database.pool.stats()
+
+    async def create_user(self, email, password_hash):
+        try:
+            return await self.database.execute(
+                "INSERT INTO users (email, password) VALUES (?, ?)",
+                (email, password_hash),
+                name="create_user"
+            )
+        except sqlite3.IntegrityError:
+            return None
+
+    async def find_user(self, email, password_hash):
+        user = await self.database.fetchone(
+            "SELECT id FROM users WHERE email = ? AND password = ?",
+            (email, password_hash),
+            name="find_user"
+        )
+        return user["id"] if user else None
+
+    async def user_password(self, user_id):
+        user = await self.database.fetchone(
+            "SELECT password FROM users WHERE id = ?", (user_id,), name="user_password"
+        )
+        return user["password"] if user else None
+
+    async def token_revoked(self, token_hash):
+        return await self.database.run(_is_revoked, token_hash, name="token_revoked")
+
+    async def revoke_token(self, token_hash, expires_at, now):
+        await self.database.run(_revoke, token_hash, expires_at, now, name="revoke_token")
+
+    async def device_owner(self, hardware_id):
+        row = await self.database.fetchone(DEVICE_OWNER_SQL, (hardware_id,), name="device_owner")
+        return row["user_id"] if row else None
+
+    async def register_device(self, hardware_id, user_id, device_info, now):
+        return await self.database.run(_register_device, hardware_id, user_id, device_info, now)
+
+    async def report_stolen(self, hardware_id, email, phone, reported_at):
+        return await self.database.run(_report_stolen, hardware_id, email, phone, reported_at)
+
+    async def device_details(self, hardware_id, user_id):
+        return await self.database.fetchone(DEVICE_DETAILS_SQL, (hardware_id, user_id), name="device_details")
+
+    async def stolen_snapshot(self):
+        return await self.database.run(_stolen_snapshot, name="stolen_snapshot")
+
+    async def stolen_version(self):
+        row = await self.database.fetchone(
+            "SELECT version FROM registry_versions WHERE name = 'stolen_devices'", name="stolen_version"
+        )
+        return row["version"] if row else 0
+
+    async def device_version(self, hardware_id):
+        # Kept by triggers on every table the dashboard reads (migration 12)
+        row = await self.database.fetchone(DEVICE_VERSION_SQL, (hardware_id,), name="device_version")
+        return row["version"] if row else 0
+
+    async def hardware_mappings(self, after_id):
+        return await self.database.fetchall(HARDWARE_MAPPINGS_SQL, (after_id,), name="hardware_mappings")
+
+    async def record_factory_reset(self, original_id, new_id, detected_at, device_info, fix=None, link=True):
+        return await self.database.run(
+            _record_factory_reset, original_id, new_id, detected_at, device_info, fix, link,
+            name="record_factory_reset"
+        )
+
+    async def add_user_fixes(self, rows):
+        return await self.database.run(location_partitions.write, rows, name="add_user_fixes")
+
+    async def add_stolen_fixes(self, rows):
+        return await self.database.run(stolen_location_partitions.write, rows, name="add_stolen_fixes")
+
+    async def latest_user_location(self, user_id):
+        return await self.database.fetchone(LATEST_USER_LOCATION_SQL, (user_id,), name="latest_user_location")
+
+    async def latest_device_location(self, hardware_id):
+        return await self.database.fetchone(
+            LATEST_DEVICE_LOCATION_SQL, (hardware_id,), name="latest_device_location"
+        )
+
+    async def stolen_fix_page(self, hardware_id, limit, before=None, before_id=None, after_id=None, since=None):
+        sql, params = _fix_page_query(hardware_id, before, before_id, after_id, since)
+        # Only the monthly partitions that can hold the page are searched
+        return await self.database.run(
+            stolen_location_partitions.query, sql, params, limit, since, before, after_id,
+            name="stolen_fix_page"
+        )
+
+    async def stolen_fix_track(self, hardware_id, start, end, limit):
+        return await self.database.run(
+            stolen_location_partitions.query,
+            STOLEN_FIX_TRACK_SQL,
+            (hardware_id, start or "", end or "9999"), limit, start, end,
+            name="stolen_fix_track"
+        )
+
+    async def stolen_devices_in_box(self, min_lat, max_lat, min_lng, max_lng, since=None):
+        # R*Tree candidates (stored as float32, so re-check the exact bounds)
+        return await self.database.fetchall(
+            STOLEN_DEVICES_IN_BOX_SQL,
+            (min_lat, max_lat, min_lng, max_lng, min_lat, max_lat, min_lng, max_lng, since or ""),
+            name="stolen_devices_in_box"
+        )
+
+    async def add_command(self, hardware_id, user_id, command_type, command_data, issued_at):
+        return await self.database.execute(
+            """
+            INSERT INTO device_commands
+            (hardware_id, user_id, command_type, command_data, issued_at, executed)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (hardware_id, user_id, command_type, command_data, issued_at, False),
+            name="add_command"
+        )
+
+    async def pending_commands(self, hardware_id):
+        return await self.database.fetchall(PENDING_COMMANDS_SQL, (hardware_id,), name="pending_commands")
+
+    async def mark_command_executed(self, command_id, executed_at, result):
+        await self.database.execute(
+            "UPDATE device_commands SET executed = 1, executed_at = ?, result = ? WHERE id = ?",
+            (executed_at, result, command_id),
+            name="mark_command_executed"
+        )
+
+    async def add_photo(self, hardware_id, timestamp, content_hash, size, content_type):
+        return await self.database.execute(
+            """
+            INSERT INTO stolen_device_photos
+            (hardware_id, timestamp, content_hash, size, content_type)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (hardware_id, timestamp, content_hash, size, content_type),
+            name="add_photo"
+        )
+
+    async def latest_photo(self, hardware_id):
+        return await self.database.fetchone(LATEST_PHOTO_SQL, (hardware_id,), name="latest_photo")
+
+    async def photo_for_owner(self, content_hash, user_id):
+        return await self.database.fetchone(PHOTO_FOR_OWNER_SQL, (content_hash, user_id), name="photo_for_owner")
+
+
+def _newer(current, timestamp):
+    return current is None or order_key(timestamp, 0) >= order_key(current["timestamp"], 0)
+
+
+class MemoryStorage(Storage):
+    """Process-local backend; every method completes without yielding, so each is atomic"""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self.users = {}
+        self.users_by_email = {}
+        self.revoked = {}
+        self.devices = {}
+        self.stolen = {}
+        self.stolen_version_counter = 0
+        self.device_versions = {}
+        self.mappings = []
+        self.reset_events = []
+        self.user_fixes = []
+        self.latest_users = {}
+        self.stolen_fixes = {}
+        self.latest_devices = {}
+        self.commands = {}
+        self.photos = []
+
+    def _next_id(self):
+        return next(self._ids)
+
+    def _changed(self, hardware_id):
+        self.device_versions[hardware_id] = self.device_versions.get(hardware_id, 0) + 1
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "users": len(self.users),
+            "devices": len(self.devices),
+            "stolen": len(self.stolen),
+            "user_fixes": len(self.user_fixes),
+            "stolen_fixes": sum(len(fixes) for fixes in self.stolen_fixes.values()),
+            "commands": len(self.commands),
+            "photos": len(self.photos),
+        }
+
+    async def create_user(self, email, password_hash):
+        if email in self.users_by_email:
+            return None
+        user_id = self._next_id()
+        self.users[user_id] = {"id": user_id, "email": email, "password": password_hash}
+        self.users_by_email[email] = user_id
+        return user_id
+
+    async def find_user(self, email, password_hash):
+        user_id = self.users_by_email.get(email)
+        if user_id is None or self.users[user_id]["password"] != password_hash:
+            return None
+        return user_id
+
+    async def user_password(self, user_id):
+        user = self.users.get(user_id)
+        return user["password"] if user else None
+
+    async def token_revoked(self, token_hash):
+        return token_hash in self.revoked
+
+    async def revoke_token(self, token_hash, expires_at, now):
+        self.revoked[token_hash] = expires_at
+        for key in [key for key, expires in self.revoked.items() if expires < now]:
+            del self.revoked[key]
+
+    async def device_owner(self, hardware_id):
+        device = self.devices.get(hardware_id)
+        return device["user_id"] if device else None
+
+    async def register_device(self, hardware_id, user_id, device_info, now):
+        device = self.devices.get(hardware_id)
+        self._changed(hardware_id)
+        if device and str(device["user_id"]) != str(user_id):
+            device["last_seen"] = now
+            return "foreign_stolen" if hardware_id in self.stolen else "foreign"
+
+        if device:
+            device.update(last_seen=now, device_info=device_info)
+        else:
+            self.devices[hardware_id] = {
+                "id": self._next_id(), "user_id": user_id, "hardware_id": hardware_id,
+                "first_seen": now, "last_seen": now, "device_info": device_info, "is_stolen": 0,
+            }
+        return "registered"
+
+    async def report_stolen(self, hardware_id, email, phone, reported_at):
+        device = self.devices.get(hardware_id)
+        if not device:
+            return False
+        self._changed(hardware_id)
+        if not device["is_stolen"]:
+            device["is_stolen"] = 1
+            self.stolen_version_counter += 1
+        if hardware_id not in self.stolen:
+            self.stolen[hardware_id] = {
+                "id": self._next_id(), "hardware_id": hardware_id, "user_id": device["user_id"],
+                "reported_stolen_at": reported_at, "recovery_email": email, "recovery_phone": phone,
+            }
+            self.stolen_version_counter += 1
+        return True
+
+    async def device_details(self, hardware_id, user_id):
+        device = self.devices.get(hardware_id)
+        if not device or device["user_id"] != user_id:
+            return None
+        report = self.stolen.get(hardware_id, {})
+        return dict(
+            device,
+            reported_stolen_at=report.get("reported_stolen_at"),
+            recovery_email=report.get("recovery_email"),
+        )
+
+    async def stolen_snapshot(self):
+        stolen = set(self.stolen)
+        stolen.update(hw for hw, device in self.devices.items() if device["is_stolen"])
+        return self.stolen_version_counter, stolen
+
+    async def stolen_version(self):
+        return self.stolen_version_counter
+
+    async def device_version(self, hardware_id):
+        return self.device_versions.get(hardware_id, 0)
+
+    async def hardware_mappings(self, after_id):
+        return [mapping for mapping in self.mappings if mapping["id"] > after_id]
+
+    async def record_factory_reset(self, original_id, new_id, detected_at, device_info, fix=None, link=True):
+        self.reset_events.append({
+            "id": self._next_id(), "original_hardware_id": original_id, "new_hardware_id": new_id,
+            "detected_at": detected_at, "device_info": device_info,
+        })
+        if fix is not None:
+            await self.add_stolen_fixes([fix])
+        in_use = new_id in self.devices or any(
+            new_id in (mapping["original_id"], mapping["current_id"]) for mapping in self.mappings
+        )
+        if not link or in_use:
+            return False
+        self.mappings.append({
+            "id": self._next_id(), "original_id": original_id, "current_id": new_id, "updated_at": detected_at,
+        })
+        return True
+
+    async def add_user_fixes(self, rows):
+        for user_id, latitude, longitude, timestamp in rows:
+            self.user_fixes.append((self._next_id(), user_id, latitude, longitude, timestamp))
+            if _newer(self.latest_users.get(user_id), timestamp):
+                self.latest_users[user_id] = {"latitude": latitude, "longitude": longitude, "timestamp": timestamp}
+        return len(rows)
+
+    async def add_stolen_fixes(self, rows):
+        for hardware_id, latitude, longitude, timestamp, connection_info in rows:
+            self.stolen_fixes.setdefault(hardware_id, []).append({
+                "id": self._next_id(), "latitude": latitude, "longitude": longitude,
+                "timestamp": timestamp, "connection_info": connection_info,
+            })
+            self._changed(hardware_id)
+            if _newer(self.latest_devices.get(hardware_id), timestamp):
+                self.latest_devices[hardware_id] = {"latitude": latitude, "longitude": longitude, "timestamp": timestamp}
+        return len(rows)
+
+    async def latest_user_location(self, user_id):
+        return self.latest_users.get(user_id)
+
+    async def latest_device_location(self, hardware_id):
+        return self.latest_devices.get(hardware_id)
+
+    async def stolen_fix_page(self, hardware_id, limit, before=None, before_id=None, after_id=None, since=None):
+        fixes = self.stolen_fixes.get(hardware_id, [])
+        if since is not None:
+            fixes = [fix for fix in fixes if order_key(fix["timestamp"], 0) > order_key(since, 0)]
+
+        if after_id is not None:
+            return [fix for fix in fixes if fix["id"] > after_id][:limit]
+
+        if before is not None:
+            cursor = order_key(before, before_id)
+            fixes = [fix for fix in fixes if order_key(fix["timestamp"], fix["id"]) < cursor]
+        fixes = sorted(fixes, key=lambda fix: order_key(fix["timestamp"], fix["id"]), reverse=True)
+        return fixes[:limit]
+
+    async def stolen_fix_track(self, hardware_id, start, end, limit):
+        low, high = order_key(start or "", 0), order_key(end or "9999", 0)
+        fixes = [
+            fix for fix in self.stolen_fixes.get(hardware_id, [])
+            if low <= order_key(fix["timestamp"], 0) <= high
+        ]
+        fixes.sort(key=lambda fix: order_key(fix["timestamp"], fix["id"]), reverse=True)
+        return fixes[:limit]
+
+    async def stolen_devices_in_box(self, min_lat, max_lat, min_lng, max_lng, since=None):
+        since_key = order_key(since or "", 0)
+        return [
+            dict(position, hardware_id=hardware_id, reported_stolen_at=self.stolen[hardware_id]["reported_stolen_at"])
+            for hardware_id, position in self.latest_devices.items()
+            if hardware_id in self.stolen
+            and position["latitude"] is not None and position["longitude"] is not None
+            and min_lat <= position["latitude"] <= max_lat
+            and min_lng <= position["longitude"] <= max_lng
+            and order_key(position["timestamp"], 0) >= since_key
+        ]
+
+    async def add_command(self, hardware_id, user_id, command_type, command_data, issued_at):
+        command_id = self._next_id()
+        self.commands[command_id] = {
+            "id": command_id, "hardware_id": hardware_id, "user_id": user_id, "command_type": command_type,
+            "command_data": command_data, "issued_at": issued_at, "executed": 0,
+        }
+        return command_id
+
+    async def pending_commands(self, hardware_id):
+        # Insertion order is issue order
+        return [
+            command for command in self.commands.values()
+            if command["hardware_id"] == hardware_id and not command["executed"]
+        ]
+
+    async def mark_command_executed(self, command_id, executed_at, result):
+        command = self.commands.get(command_id)
+        if command:
+            command.update(executed=1, executed_at=executed_at, result=result)
+
+    async def add_photo(self, hardware_id, timestamp, content_hash, size, content_type):
+        photo_id = self._next_id()
+        self.photos.append({
+            "id": photo_id, "hardware_id": hardware_id, "timestamp": timestamp,
+            "content_hash": content_hash, "size": size, "content_type": content_type,
+        })
+        self._changed(hardware_id)
+        return photo_id
+
+    async def latest_photo(self, hardware_id):
+        photos = [photo for photo in self.photos if photo["hardware_id"] == hardware_id]
+        return max(photos, key=lambda photo: photo["timestamp"], default=None)
+
+    async def photo_for_owner(self, content_hash, user_id):
+        for photo in self.photos:
+            device = self.devices.get(photo["hardware_id"])
+            if photo["content_hash"] == content_hash and device and device["user_id"] == user_id:
+                return photo
+        return None
+
+
+def create_storage(backend=STORAGE_BACKEND):
+    if backend == "sqlite":
+        return SQLiteStorage(database, maintenance)
+    if backend == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage backend: {backend!r}")
+
+
+# Process-wide storage backend
+storage = create_storage()
+
+
+# FastAPI dependency - handlers only see the storage interface
+async def get_storage():
+    return storage
@@ -0,0 +1,141 @@
+"""Trajectory simplification for drawing long stolen-device histories.
+
+A track is reduced in two vectorized passes over NumPy arrays:
+
+1. optional time-bucket downsampling, keeping the last fix of every
+   ``resolution``-second bucket (collapses bursts of buffered fixes);
+2. Douglas-Peucker simplification with a tolerance of one screen pixel at
+   the requested map zoom (but at least MIN_TOLERANCE_M), so the drawn
+   shape is unchanged while straight runs and stationary jitter collapse
+   to a few vertices.
+
+Simplified tracks are cached per (hardware ID, range, zoom, resolution).
+"""
+import os
+import warnings
+
+import numpy as np
+
+from .cache import LRUCache
+from .geo import finite_coordinates
+
+TRACK_CACHE_SIZE = int(os.environ.get("GHOSTTRACK_TRACK_CACHE_SIZE", "1000"))
+# Open-ended ranges grow as fixes arrive, so cached tracks expire quickly
+TRACK_CACHE_TTL = float(os.environ.get("GHOSTTRACK_TRACK_CACHE_TTL", "30"))
+
+EARTH_RADIUS_M = 6371008.8
+# Ground metres per pixel at zoom 0 on the equator (256px Web Mercator tiles)
+METERS_PER_PIXEL_Z0 = 156543.03392
+MIN_ZOOM = 0
+MAX_ZOOM = 22
+# Phone fixes are rarely better than this, so closer detail is GPS noise
+MIN_TOLERANCE_M = float(os.environ.get("GHOSTTRACK_TRACK_MIN_TOLERANCE_M", "10"))
+
+
+def zoom_tolerance(zoom, latitude=0.0):
+    """Metres covered by one screen pixel at ``zoom`` and ``latitude``"""
+    return METERS_PER_PIXEL_Z0 * np.cos(np.radians(latitude)) / (2 ** zoom)
+
+
+def simplify_tolerance(zoom, latitude=0.0):
+    """Douglas-Peucker tolerance: one pixel, but never below GPS noise"""
+    return max(zoom_tolerance(zoom, latitude), MIN_TOLERANCE_M)
+
+
+def project(latitudes, longitudes):
+    """Equirectangular projection to metres around the track's mean latitude"""
+    lat0 = np.radians(latitudes.mean())
+    x = np.radians(longitudes) * EARTH_RADIUS_M * np.cos(lat0)
+    y = np.radians(latitudes) * EARTH_RADIUS_M
+    return np.column_stack((x, y))
+
+
+def douglas_peucker(points, tolerance):
+    """Return a boolean mask of the vertices kept by Douglas-Peucker.
+
+    ``points`` is an (n, 2) array in metres. Each segment's interior
+    distances are computed in one vectorized step; an explicit stack
+    replaces recursion so long tracks cannot hit the recursion limit.
+    """
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        a = points[start]
+        direction = points[end] - a
+        offsets = points[start + 1:end] - a
+        length = np.hypot(direction[0], direction[1])
+        if length == 0:
+            # Closed loop - measure from the shared endpoint
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(direction[0] * offsets[:, 1] - direction[1] * offsets[:, 0]) / length
+
+        index = int(distances.argmax())
+        if distances[index] > tolerance:
+            split = start + 1 + index
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
+
+def bucket_mask(seconds, resolution):
+    """Mask keeping the last fix of every ``resolution``-second bucket"""
+    if resolution <= 0 or len(seconds) == 0:
+        return np.ones(len(seconds), dtype=bool)
+    buckets = np.floor_divide(seconds, resolution)
+    keep = np.ones(len(seconds), dtype=bool)
+    keep[:-1] = buckets[1:] != buckets[:-1]
+    return keep
+
+
+def simplify_track(rows, zoom, resolution=0):
+    """Simplify (latitude, longitude, timestamp) rows in time order.
+
+    Returns the kept rows as dicts. Endpoints are always kept, so the
+    first and latest fixes of the range are exact. Rows without finite
+    coordinates are dropped first - they would turn the arrays into NaN.
+    """
+    rows = [row for row in rows if finite_coordinates(row[0], row[1])]
+    if len(rows) <= 2:
+        return [{"latitude": lat, "longitude": lng, "timestamp": ts} for lat, lng, ts in rows]
+
+    latitudes = np.fromiter((row[0] for row in rows), dtype=float, count=len(rows))
+    longitudes = np.fromiter((row[1] for row in rows), dtype=float, count=len(rows))
+    timestamps = np.array([row[2] for row in rows])
+
+    # Pass 1: time buckets (skipped if a client sent an unparseable timestamp)
+    if resolution > 0:
+        try:
+            with warnings.catch_warnings():
+                # Client-supplied "...Z" timestamps parse fine but warn
+                warnings.simplefilter("ignore")
+                seconds = timestamps.astype("datetime64[us]").astype(np.int64) // 1_000_000
+        except ValueError:
+            seconds = None
+        if seconds is not None:
+            mask = bucket_mask(seconds, resolution)
+            mask[0] = True
+            latitudes, longitudes, timestamps = latitudes[mask], longitudes[mask], timestamps[mask]
+
+    # Pass 2: shape-preserving vertex reduction
+    tolerance = simplify_tolerance(zoom, latitudes.mean())
+    mask = douglas_peucker(project(latitudes, longitudes), tolerance)
+
+    return [
+        {"latitude": float(lat), "longitude": float(lng), "timestamp": str(ts)}
+        for lat, lng, ts in zip(latitudes[mask], longitudes[mask], timestamps[mask])
+    ]
+
+
+# Process-wide cache of simplified tracks
+track_cache = LRUCache(TRACK_CACHE_SIZE, TRACK_CACHE_TTL)
@@ -0,0 +1,93 @@
+"""Compact binary check-in format for stolen devices.
+
+A request body carries one device and one or more fixes, little-endian:
+
+    header   u8 version, u8 flags, u8 ID length
+    ID       the hardware ID - the raw bytes of a hex fingerprint when
+             flags has FLAG_HEX_ID (32 bytes for a SHA-256), UTF-8 otherwise
+    base     i64 epoch milliseconds, u16 fix count
+    fixes    count x (i32 latitude, i32 longitude, i32 ms since the previous
+             fix (the first is relative to base), u16 accuracy in metres)
+
+Coordinates are degrees scaled by 1e7 (about 1 cm), and an accuracy of
+NO_ACCURACY means none was reported. A check-in with one fix is 59 bytes
+against ~240 for the stealth worker's JSON body, and the fixed-size records
+are unpacked in one ``iter_unpack`` pass instead of going through the JSON
+parser. Battery and network details are not carried.
+"""
+import struct
+
+WIRE_VERSION = 1
+FLAG_HEX_ID = 0x01
+COORDINATE_SCALE = 10_000_000
+NO_ACCURACY = 0xFFFF
+CONTENT_TYPE = "application/octet-stream"
+
+_HEADER = struct.Struct("<BBB")
+_BASE = struct.Struct("<qH")
+_FIX = struct.Struct("<iiiH")
+
+
+def decode_checkins(body):
+    """Decode a body into (hardware_id, [(latitude, longitude, epoch_ms, accuracy), ...]).
+
+    ``accuracy`` is None when the device did not report one. Raises
+    ValueError for a truncated, oversized or unknown-version body.
+    """
+    if len(body) < _HEADER.size:
+        raise ValueError("Check-in body too short")
+    version, flags, id_length = _HEADER.unpack_from(body)
+    if version != WIRE_VERSION:
+        raise ValueError(f"Unsupported check-in version {version}")
+
+    offset = _HEADER.size + id_length
+    if len(body) < offset + _BASE.size:
+        raise ValueError("Check-in body too short")
+    raw_id = body[_HEADER.size:offset]
+    hardware_id = raw_id.hex() if flags & FLAG_HEX_ID else raw_id.decode("utf-8")
+
+    millis, count = _BASE.unpack_from(body, offset)
+    offset += _BASE.size
+    if len(body) != offset + count * _FIX.size:
+        raise ValueError(f"Check-in body does not hold {count} fixes")
+
+    fixes = []
+    for lat, lng, delta, accuracy in _FIX.iter_unpack(body[offset:]):
+        millis += delta
+        fixes.append((
+            lat / COORDINATE_SCALE,
+            lng / COORDINATE_SCALE,
+            millis,
+            None if accuracy == NO_ACCURACY else accuracy,
+        ))
+    return hardware_id, fixes
+
+
+def encode_checkins(hardware_id, fixes):
+    """Encode (latitude, longitude, epoch_ms, accuracy or None) fixes as the stealth worker does.
+
+    Raises ValueError when they do not fit the format.
+    """
+    try:
+        raw_id, flags = bytes.fromhex(hardware_id), FLAG_HEX_ID
+        if raw_id.hex() != hardware_id:
+            raise ValueError
+    except ValueError:
+        raw_id, flags = hardware_id.encode("utf-8"), 0
+
+    base = fixes[0][2] if fixes else 0
+    try:
+        parts = [_HEADER.pack(WIRE_VERSION, flags, len(raw_id)), raw_id, _BASE.pack(base, len(fixes))]
+        previous = base
+        for lat, lng, millis, accuracy in fixes:
+            parts.append(_FIX.pack(
+                round(lat * COORDINATE_SCALE),
+                round(lng * COORDINATE_SCALE),
+                millis - previous,
+                NO_ACCURACY if accuracy is None else min(round(accuracy), NO_ACCURACY - 1),
+            ))
+            previous = millis
+    except struct.error as e:
+        # ID over 255 bytes, too many fixes or fixes too far apart
+        raise ValueError(f"Check-ins do not fit the wire format: {e}") from e
+    return b"".join(parts)
@@ -0,0 +1,117 @@
+"""Concurrent latency benchmark for the async data-access layer.
+
+Simulates one worker serving a stream of cheap lookups while a single slow
+query (a large history scan) is in flight, and compares running SQL directly
+on the event loop with awaiting it through ``AsyncDatabase``.
+
+Run from the repository root:
+
+    python -m bench.async_db
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from app.db import AsyncDatabase, ConnectionPool
+
+SLOW_SQL = """
+    WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < ?)
+    SELECT count(*) FROM c
+"""
+FAST_SQL = "SELECT latitude, longitude, timestamp FROM locations WHERE id = ?"
+
+
+def setup_db(path, rows=1000):
+    pool = ConnectionPool(path, size=1)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE locations (id INTEGER PRIMARY KEY, latitude REAL, longitude REAL, timestamp TEXT)")
+        conn.executemany(
+            "INSERT INTO locations (latitude, longitude, timestamp) VALUES (?, ?, ?)",
+            [(i * 0.001, i * 0.002, f"2024-01-01T00:00:{i % 60:02d}") for i in range(rows)],
+        )
+        conn.commit()
+    pool.close()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_blocking(pool, requests, interval, slow_rows):
+    """Baseline - every query runs synchronously on the event loop"""
+    async def slow():
+        with pool.connection() as conn:
+            conn.execute(SLOW_SQL, (slow_rows,)).fetchone()
+
+    async def fast(i):
+        with pool.connection() as conn:
+            conn.execute(FAST_SQL, (i % 1000 + 1,)).fetchone()
+
+    return await drive(slow, fast, requests, interval)
+
+
+async def run_async(database, requests, interval, slow_rows):
+    """Queries are awaited on the bounded DB executor"""
+    async def slow():
+        await database.fetchone(SLOW_SQL, (slow_rows,))
+
+    async def fast(i):
+        await database.fetchone(FAST_SQL, (i % 1000 + 1,))
+
+    return await drive(slow, fast, requests, interval)
+
+
+async def drive(slow, fast, requests, interval):
+    # Each request's latency is measured from when it was scheduled to arrive
+    async def timed(i, due):
+        await asyncio.sleep(max(0.0, due - time.perf_counter()))
+        await fast(i)
+        return time.perf_counter() - due
+
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(timed(i, start + i * interval)) for i in range(requests)]
+    await asyncio.sleep(interval * 5)
+    slow_task = asyncio.create_task(slow())
+    latencies = await asyncio.gather(*tasks)
+    await slow_task
+    return latencies
+
+
+def report(name, latencies):
+    ms = [x * 1000 for x in latencies]
+    print(
+        f"{name:<10} n={len(ms):<5} p50={statistics.median(ms):8.2f}ms "
+        f"p95={percentile(ms, 95):8.2f}ms p99={percentile(ms, 99):8.2f}ms max={max(ms):8.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--interval-ms", type=float, default=1.0)
+    parser.add_argument("--slow-rows", type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        setup_db(path)
+        interval = args.interval_ms / 1000
+
+        pool = ConnectionPool(path, size=4)
+        report("blocking", asyncio.run(run_blocking(pool, args.requests, interval, args.slow_rows)))
+        pool.close()
+
+        pool = ConnectionPool(path, size=4)
+        database = AsyncDatabase(pool)
+        report("async", asyncio.run(run_async(database, args.requests, interval, args.slow_rows)))
+        database.close()
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Per-request auth cost microbenchmark.
+
+Measures what a polled endpoint pays before doing any real work - verifying
+the caller's JWT and checking it owns the device - with the old uncached
+path (``jwt.decode`` plus an ``antitheft_devices`` query through the async
+DB layer) and with the token and device-owner caches.
+
+Run from the repository root:
+
+    python -m bench.auth [--iterations 20000]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import jwt
+
+from app.auth import TokenCache, DeviceOwners
+from app.db import AsyncDatabase, ConnectionPool
+from app.migrations import migrate
+from app.storage import SQLiteStorage
+
+SECRET_KEY = "bench-secret"
+ALGORITHM = "HS256"
+
+
+def setup_db(path, devices=10000):
+    pool = ConnectionPool(path, size=4)
+    with pool.connection() as conn:
+        migrate(conn)
+        conn.executemany(
+            "INSERT INTO antitheft_devices (user_id, hardware_id) VALUES (?, ?)",
+            [(i % 1000 + 1, f"hw{i}") for i in range(devices)],
+        )
+        conn.commit()
+    return pool
+
+
+def make_token(user_id):
+    expires = datetime.utcnow() + timedelta(days=30)
+    return jwt.encode({"sub": str(user_id), "exp": expires}, SECRET_KEY, algorithm=ALGORITHM)
+
+
+async def uncached_auth(database, token, hardware_id):
+    """The original per-request checks"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        user_id = int(payload["sub"])
+    except jwt.PyJWTError:
+        return False
+    device = await database.fetchone(
+        "SELECT user_id FROM antitheft_devices WHERE hardware_id = ?",
+        (hardware_id,)
+    )
+    return bool(device) and device["user_id"] == user_id
+
+
+async def cached_auth(tokens, owners, token, hardware_id):
+    user_id = await tokens.verify(token)
+    return user_id is not None and await owners.get(hardware_id) == user_id
+
+
+async def time_per_call(fn, iterations):
+    await fn()  # warm caches and connections
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def main(iterations):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    pool = setup_db(path)
+    database = AsyncDatabase(pool)
+    storage = SQLiteStorage(database)
+    tokens = TokenCache(storage, SECRET_KEY, ALGORITHM)
+    owners = DeviceOwners(storage)
+
+    token = make_token(1)
+    hardware_id = "hw0"
+
+    async def decode_only():
+        jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+
+    decode_us = await time_per_call(decode_only, iterations)
+    uncached_us = await time_per_call(lambda: uncached_auth(database, token, hardware_id), iterations)
+    cached_us = await time_per_call(lambda: cached_auth(tokens, owners, token, hardware_id), iterations)
+    bad_us = await time_per_call(lambda: tokens.verify("not-a-token"), iterations)
+
+    print(f"jwt.decode alone:               {decode_us:8.1f} us")
+    print(f"uncached token + owner query:   {uncached_us:8.1f} us")
+    print(f"cached token + owner:           {cached_us:8.1f} us  ({uncached_us / cached_us:.0f}x faster)")
+    print(f"cached rejection of bad token:  {bad_us:8.1f} us")
+    print(f"token cache: {tokens.stats()}")
+    print(f"owner cache: {owners.stats()}")
+
+    database.close()
+    pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(main(args.iterations))
@@ -0,0 +1,166 @@
+"""Check-in wire format benchmark: binary vs JSON.
+
+For batches of 1, 10 and 100 fixes from a stolen device, compares
+
+* bytes on the wire - the JSON body the stealth worker posted to
+  ``device-checkin/batch`` (accuracy, battery and network per fix) against
+  the binary body it posts to ``device-checkin/bin``;
+* server parse CPU - ``json.loads`` plus pulling the fields out of each fix,
+  against ``decode_checkins``;
+* the whole request through the app, driven straight through ASGI against
+  the in-memory storage backend (``GHOSTTRACK_STORAGE`` to override).
+
+Run from the repository root:
+
+    python -m bench.checkin_wire [--requests 2000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+
+os.environ.setdefault("GHOSTTRACK_STORAGE", "memory")
+os.environ.setdefault("GHOSTTRACK_LOG_LEVEL", "WARNING")
+
+import httpx
+
+from app.wire import CONTENT_TYPE, decode_checkins, encode_checkins
+
+HARDWARE_ID = "".join(random.Random(7).choice("0123456789abcdef") for _ in range(64))
+BATCH_SIZES = (1, 10, 100)
+
+
+def make_fixes(count, rng):
+    """Fixes as the stealth worker buffers them, one per 10 minutes"""
+    latitude, longitude = rng.uniform(-60, 70), rng.uniform(-180, 180)
+    millis = 1760000000000
+    fixes = []
+    for _ in range(count):
+        latitude += rng.uniform(-1e-3, 1e-3)
+        longitude += rng.uniform(-1e-3, 1e-3)
+        millis += 600000 + rng.randint(-500, 500)
+        fixes.append({
+            "a": latitude,
+            "o": longitude,
+            "c": round(rng.uniform(3, 60), 1),
+            "t": millis,
+            "b": {"level": rng.randint(5, 100), "charging": False},
+            "n": {"type": "4g", "downlink": 10, "rtt": 50, "saveData": False},
+        })
+    return fixes
+
+
+def json_body(fixes):
+    # JSON.stringify output - no whitespace
+    return json.dumps({"h": HARDWARE_ID, "f": fixes}, separators=(",", ":")).encode()
+
+
+def binary_body(fixes):
+    return encode_checkins(HARDWARE_ID, [(fix["a"], fix["o"], fix["t"], fix["c"]) for fix in fixes])
+
+
+def parse_json(body):
+    data = json.loads(body)
+    return data["h"], [(fix.get("a"), fix.get("o"), fix.get("t"), fix.get("c")) for fix in data["f"]]
+
+
+def per_call_us(fn, arg, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(arg)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def http_scope(path, content_type, length):
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(b"host", b"bench"), (b"content-type", content_type.encode()),
+                    (b"content-length", str(length).encode())],
+        "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+
+
+async def request_us(app, cases, requests, rounds=5):
+    """Median over interleaved rounds of the mean ASGI request time, per (path, content type, body)"""
+    async def send(message):
+        pass
+
+    async def serve(path, content_type, body, count):
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        for _ in range(count):
+            await app(http_scope(path, content_type, len(body)), receive, send)
+
+    results = [[] for _ in cases]
+    for case in cases:
+        await serve(*case, 200)
+    for _ in range(rounds):
+        for case, samples in zip(cases, results):
+            start = time.perf_counter()
+            await serve(*case, requests)
+            samples.append((time.perf_counter() - start) / requests * 1e6)
+    return [statistics.median(samples) for samples in results]
+
+
+async def end_to_end(bodies, requests):
+    # The app reads its configuration at import time
+    from app.app import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            form = {"email": "wire@bench.local", "password": "bench"}
+            response = await client.post("/api/register", data=form)
+            if response.status_code == 400:
+                response = await client.post("/api/login", data=form)
+            owner = response.json()
+            response = await client.post(
+                "/api/register-device-antitheft",
+                json={"hardwareId": HARDWARE_ID, "userId": str(owner["user_id"]), "email": owner["email"],
+                      "deviceInfo": {"model": "bench"}},
+                headers={"Authorization": f"Bearer {owner['token']}"},
+            )
+            response.raise_for_status()
+            response = await client.post(
+                "/api/report-stolen", data={"hardwareId": HARDWARE_ID, "email": "recovery@bench.local"}
+            )
+            response.raise_for_status()
+
+        results = {}
+        for size, (packed_json, packed_binary) in bodies.items():
+            results[size] = await request_us(app, [
+                ("/api/__system__/device-checkin/batch", "application/json", packed_json),
+                ("/api/__system__/device-checkin/bin", CONTENT_TYPE, packed_binary),
+            ], max(requests // size, 50))
+        return results
+
+
+def main(requests):
+    rng = random.Random(42)
+    bodies = {}
+    for size in BATCH_SIZES:
+        fixes = make_fixes(size, rng)
+        bodies[size] = (json_body(fixes), binary_body(fixes))
+
+    print(f"{'fixes':>5}  {'JSON B':>7}  {'binary B':>8}  {'ratio':>6}  "
+          f"{'JSON parse us':>13}  {'binary parse us':>15}  {'JSON req us':>11}  {'binary req us':>13}")
+    timings = asyncio.run(end_to_end(bodies, requests))
+    for size, (packed_json, packed_binary) in bodies.items():
+        iterations = max(200000 // size, 1000)
+        json_us = per_call_us(parse_json, packed_json, iterations)
+        binary_us = per_call_us(decode_checkins, packed_binary, iterations)
+        json_request_us, binary_request_us = timings[size]
+        print(f"{size:5}  {len(packed_json):7}  {len(packed_binary):8}  {len(packed_binary) / len(packed_json):6.1%}  "
+              f"{json_us:13.2f}  {binary_us:15.2f}  {json_request_us:11.1f}  {binary_request_us:13.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000, help="single-fix requests per round")
+    args = parser.parse_args()
+    main(args.requests)
@@ -0,0 +1,114 @@
+"""Dashboard polling benchmark: conditional GET and compression.
+
+Sets up one stolen device with a history of fixes and a photo, then polls
+``device-info`` and ``stolen-device-locations`` as the recovery dashboard
+does - a full fetch, and revalidations with the ETag from it (304 while
+nothing changed). Reports mean server time per poll and bytes on the wire
+with and without gzip.
+
+The app runs in-process (ASGI, no sockets) on a temporary SQLite database
+and blob directory unless ``GHOSTTRACK_DB`` / ``GHOSTTRACK_STORAGE`` say
+otherwise. Run from the repository root:
+
+    python -m bench.conditional [--polls 500] [--fixes 2000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+_WORKDIR = tempfile.mkdtemp()
+os.environ.setdefault("GHOSTTRACK_DB", os.path.join(_WORKDIR, "bench.db"))
+os.environ.setdefault("GHOSTTRACK_BLOB_DIR", os.path.join(_WORKDIR, "photos"))
+os.environ.setdefault("GHOSTTRACK_SLOW_QUERY_LOG", os.path.join(_WORKDIR, "slow_queries.log"))
+os.environ.setdefault("GHOSTTRACK_LOG_LEVEL", "WARNING")
+
+import httpx
+
+HARDWARE_ID = "".join(random.Random(11).choice("0123456789abcdef") for _ in range(64))
+
+
+async def setup(client, fixes):
+    form = {"email": "dashboard@bench.local", "password": "bench"}
+    response = await client.post("/api/register", data=form)
+    if response.status_code == 400:
+        response = await client.post("/api/login", data=form)
+    owner = response.json()
+    response = await client.post(
+        "/api/register-device-antitheft",
+        json={"hardwareId": HARDWARE_ID, "userId": str(owner["user_id"]), "email": owner["email"],
+              "deviceInfo": {"model": "bench", "battery": {"level": 80, "charging": False}}},
+        headers={"Authorization": f"Bearer {owner['token']}"},
+    )
+    response.raise_for_status()
+    response = await client.post(
+        "/api/report-stolen", data={"hardwareId": HARDWARE_ID, "email": "recovery@bench.local"}
+    )
+    response.raise_for_status()
+
+    rng = random.Random(3)
+    latitude, longitude = 52.52, 13.405
+    millis = int(time.time() * 1000) - fixes * 60000
+    for start in range(0, fixes, 100):
+        batch = []
+        for _ in range(min(100, fixes - start)):
+            latitude += rng.uniform(-1e-3, 1e-3)
+            longitude += rng.uniform(-1e-3, 1e-3)
+            millis += 60000
+            batch.append({"a": latitude, "o": longitude, "c": 10, "t": millis})
+        await client.post("/api/__system__/device-checkin/batch", json={"h": HARDWARE_ID, "f": batch})
+
+    await client.post(f"/api/upload-photo?hardwareId={HARDWARE_ID}", content=b"\xff\xd8\xff" + bytes(2000),
+                      headers={"Content-Type": "image/jpeg"})
+    # Let the check-in queue flush
+    await asyncio.sleep(1)
+    return owner["token"]
+
+
+async def poll(client, path, params, polls, headers):
+    """Mean ms per request and the wire size and status of the last response"""
+    start = time.perf_counter()
+    for _ in range(polls):
+        response = await client.get(path, params=params, headers=headers)
+    elapsed = (time.perf_counter() - start) / polls * 1000
+    return elapsed, response.num_bytes_downloaded, response.status_code
+
+
+async def run(polls, fixes):
+    # The app reads its configuration at import time
+    from app.app import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            token = await setup(client, fixes)
+            cases = [
+                ("device-info", "/api/device-info", {"hardwareId": HARDWARE_ID, "token": token}),
+                ("history, 50 fixes", "/api/stolen-device-locations",
+                 {"hardwareId": HARDWARE_ID, "token": token, "limit": 50}),
+                ("history, 1000 fixes", "/api/stolen-device-locations",
+                 {"hardwareId": HARDWARE_ID, "token": token, "limit": 1000}),
+            ]
+
+            print(f"{'endpoint':20} {'poll':24} {'ms/poll':>8} {'bytes':>8} {'status':>6}")
+            for label, path, params in cases:
+                first = await client.get(path, params=params, headers={"Accept-Encoding": "identity"})
+                etag = first.headers["etag"]
+                variants = [
+                    ("full, identity", {"Accept-Encoding": "identity"}),
+                    ("full, gzip", {"Accept-Encoding": "gzip"}),
+                    ("revalidate (304)", {"Accept-Encoding": "gzip", "If-None-Match": etag}),
+                ]
+                for name, headers in variants:
+                    ms, size, status = await poll(client, path, params, polls, headers)
+                    print(f"{label:20} {name:24} {ms:8.3f} {size:8} {status:6}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--polls", type=int, default=500, help="requests per measurement")
+    parser.add_argument("--fixes", type=int, default=2000, help="fixes in the device's history")
+    args = parser.parse_args()
+    asyncio.run(run(args.polls, args.fixes))
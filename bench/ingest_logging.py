@@ -0,0 +1,94 @@
+"""Ingest-path logging benchmark.
+
+Compares what logging costs the caller on the location ingest path:
+
+* the previous style - an f-string ``logging.info`` per request (the payload
+  included) written synchronously by a file handler on the calling thread;
+* ``events.event`` at the default ``/api/location`` sampling rate through the
+  queue pipeline, with the JSON formatting and the write in the listener
+  thread;
+* an error flood - ``events.error`` for the same event name on every call,
+  rate limited to a burst per interval.
+
+Each case runs inside a request scope for ``/api/location`` so the route's
+sampling rate applies. Run from the repository root:
+
+    python -m bench.ingest_logging [--calls 100000]
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from app.logs import EventLog, LogPipeline, LOG_SAMPLE, parse_rates
+from app.metrics import request_scope
+
+
+class _Route:
+    path = "/api/location"
+
+
+PAYLOAD = {"latitude": 52.52, "longitude": 13.405, "timestamp": "2026-10-17T12:00:00", "accuracy": 12.5}
+
+
+def per_call_us(fn, calls):
+    start = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main(calls):
+    token = request_scope.set({"route": _Route()})
+    directory = tempfile.mkdtemp()
+    try:
+        # Previous style - synchronous handler on the caller's thread
+        sync_log = logging.getLogger("bench.sync")
+        sync_log.propagate = False
+        sync_log.setLevel(logging.INFO)
+        sync_handler = logging.FileHandler(os.path.join(directory, "sync.log"))
+        sync_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        sync_log.addHandler(sync_handler)
+        sync_us = per_call_us(
+            lambda i: (sync_log.info(f"Received location data for user_id {i}: {PAYLOAD}"),
+                       sync_log.info(f"Successfully saved location for user_id {i}")),
+            calls,
+        )
+        sync_handler.close()
+
+        # Sampled events through the queue pipeline
+        with open(os.path.join(directory, "events.log"), "w") as stream:
+            pipeline = LogPipeline(stream, max_size=calls * 2)
+            event_log = EventLog("bench.events", rates=parse_rates(LOG_SAMPLE), error_burst=10, error_interval=60)
+            event_log.logger.propagate = False
+            event_log.logger.setLevel(logging.INFO)
+            event_log.logger.addHandler(pipeline.handler)
+            pipeline.start()
+
+            sampled_us = per_call_us(lambda i: event_log.event("location_saved", user_id=i), calls)
+            flood_us = per_call_us(lambda i: event_log.error("location_save_failed", user_id=i, error="locked"), calls)
+
+            drain_start = time.perf_counter()
+            pipeline.stop()
+            drain_ms = (time.perf_counter() - drain_start) * 1000
+            stats = pipeline.stats()
+    finally:
+        request_scope.reset(token)
+
+    rate = event_log.rates.get(_Route.path, event_log.default_rate)
+    counters = event_log.stats()
+    print(f"calls per case:                  {calls}")
+    print(f"sync f-string + file handler:    {sync_us:8.2f} us/request")
+    print(f"{f'sampled event (rate {rate:g}):':33}{sampled_us:8.2f} us/request  "
+          f"({counters['events']} written, {counters['sampled_out']} sampled out)")
+    print(f"rate-limited error flood:        {flood_us:8.2f} us/call      "
+          f"({counters['errors']} written, {counters['errors_suppressed']} suppressed)")
+    print(f"listener drain at shutdown:      {drain_ms:8.1f} ms  (dropped {stats['dropped']})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=100000)
+    args = parser.parse_args()
+    main(args.calls)
@@ -0,0 +1,364 @@
+"""HTTP load benchmark that simulates a fleet of devices and dashboards.
+
+Each simulated device runs the client loop: register with
+``register-device-antitheft``, then every tick post a ``device-checkin``,
+poll ``device-commands`` every few ticks and now and then upload a photo.
+Dashboards poll ``device-info`` for one of their owner's devices. A share
+of the devices is reported stolen first, so their check-ins take the write
+path. Throughput and p50/p95/p99 latency are reported per endpoint.
+
+The app runs in-process (ASGI, no sockets) by default, under a local
+uvicorn with ``--server uvicorn``, or anywhere with ``--url``. Results can
+be saved as a JSON baseline and compared against one from another commit:
+
+    python -m bench.load --devices 500 --dashboards 50 --duration 30 --output base.json
+    python -m bench.load --devices 500 --dashboards 50 --duration 30 --compare base.json
+
+``--compare`` exits with status 1 when an endpoint's p95 latency or
+throughput regressed by more than ``--tolerance``.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import httpx
+
+ENDPOINTS = {
+    "register-device-antitheft": ("POST", "/api/register-device-antitheft"),
+    "device-checkin": ("POST", "/api/__system__/device-checkin"),
+    "device-commands": ("GET", "/api/device-commands"),
+    "upload-photo": ("POST", "/api/upload-photo"),
+    "device-info": ("GET", "/api/device-info"),
+}
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Recorder:
+    """Latency samples and error counts per endpoint"""
+
+    def __init__(self):
+        self.samples = {name: [] for name in ENDPOINTS}
+        self.errors = {name: 0 for name in ENDPOINTS}
+        self.recording = False
+
+    async def call(self, client, name, **kwargs):
+        method, path = ENDPOINTS[name]
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+            failed = response.status_code >= 400
+        except httpx.HTTPError:
+            response, failed = None, True
+        if self.recording:
+            self.samples[name].append(time.perf_counter() - start)
+            self.errors[name] += failed
+        return response
+
+    def summary(self, elapsed):
+        endpoints = {}
+        for name, samples in self.samples.items():
+            if not samples:
+                continue
+            ms = [sample * 1000 for sample in samples]
+            endpoints[name] = {
+                "count": len(ms),
+                "errors": self.errors[name],
+                "rps": round(len(ms) / elapsed, 1),
+                "p50_ms": round(percentile(ms, 50), 3),
+                "p95_ms": round(percentile(ms, 95), 3),
+                "p99_ms": round(percentile(ms, 99), 3),
+                "max_ms": round(max(ms), 3),
+            }
+        total = sum(endpoint["count"] for endpoint in endpoints.values())
+        return {
+            "endpoints": endpoints,
+            "total": {
+                "count": total,
+                "errors": sum(endpoint["errors"] for endpoint in endpoints.values()),
+                "rps": round(total / elapsed, 1),
+            },
+        }
+
+
+async def create_owners(client, count):
+    """Register and log in the accounts that own the simulated devices"""
+    owners = []
+    for i in range(count):
+        form = {"email": f"owner{i}@bench.local", "password": "bench"}
+        response = await client.post("/api/register", data=form)
+        if response.status_code == 400:
+            # Already there from an earlier run against the same server
+            response = await client.post("/api/login", data=form)
+        response.raise_for_status()
+        owners.append(response.json())
+    return owners
+
+
+def registration(hardware_id, owner):
+    return {
+        "hardwareId": hardware_id,
+        "userId": str(owner["user_id"]),
+        "email": owner["email"],
+        "deviceInfo": {"model": "bench", "battery": {"level": 80, "charging": False}},
+    }
+
+
+async def setup_fleet(client, devices, owners, stolen_fraction):
+    """Register every device once and report a share of them stolen"""
+    for i, hardware_id in enumerate(devices):
+        owner = owners[i % len(owners)]
+        response = await client.post(
+            "/api/register-device-antitheft",
+            json=registration(hardware_id, owner),
+            headers={"Authorization": f"Bearer {owner['token']}"},
+        )
+        response.raise_for_status()
+
+    for hardware_id in devices[:int(len(devices) * stolen_fraction)]:
+        response = await client.post(
+            "/api/report-stolen", data={"hardwareId": hardware_id, "email": "recovery@bench.local"}
+        )
+        response.raise_for_status()
+
+
+async def device_loop(client, recorder, hardware_id, owner, args, deadline, rng, photo):
+    headers = {"Authorization": f"Bearer {owner['token']}"}
+    # Devices come online spread over one tick, not all at once
+    await asyncio.sleep(rng.uniform(0, args.checkin_interval))
+    await recorder.call(client, "register-device-antitheft", json=registration(hardware_id, owner), headers=headers)
+
+    latitude, longitude = rng.uniform(-60, 70), rng.uniform(-180, 180)
+    tick = 0
+    while time.perf_counter() < deadline:
+        latitude += rng.uniform(-1e-3, 1e-3)
+        longitude += rng.uniform(-1e-3, 1e-3)
+        await recorder.call(client, "device-checkin", json={"h": hardware_id, "a": latitude, "o": longitude})
+
+        if tick % args.command_poll_ticks == 0:
+            await recorder.call(client, "device-commands", params={"hardwareId": hardware_id})
+
+        if rng.random() < args.photo_probability:
+            await recorder.call(
+                client, "upload-photo", params={"hardwareId": hardware_id},
+                content=photo, headers={"Content-Type": "image/jpeg"}
+            )
+
+        tick += 1
+        await asyncio.sleep(args.checkin_interval)
+
+
+async def dashboard_loop(client, recorder, owner, owned, args, deadline, rng):
+    await asyncio.sleep(rng.uniform(0, args.dashboard_interval))
+    while time.perf_counter() < deadline:
+        await recorder.call(
+            client, "device-info", params={"hardwareId": rng.choice(owned), "token": owner["token"]}
+        )
+        await asyncio.sleep(args.dashboard_interval)
+
+
+async def run_load(client, args):
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+
+    owners = await create_owners(client, args.owners)
+    devices = [f"bench-{args.seed}-{i}" for i in range(args.devices)]
+    await setup_fleet(client, devices, owners, args.stolen_fraction)
+    owned = {i: devices[i::len(owners)] for i in range(len(owners))}
+    photo = b"\xff\xd8\xff\xe0" + rng.randbytes(args.photo_kb * 1024)
+
+    start = time.perf_counter()
+    deadline = start + args.duration
+    recorder.recording = True
+    tasks = [
+        device_loop(client, recorder, hardware_id, owners[i % len(owners)], args, deadline,
+                    random.Random(rng.random()), photo)
+        for i, hardware_id in enumerate(devices)
+    ]
+    tasks += [
+        dashboard_loop(client, recorder, owners[i % len(owners)], owned[i % len(owners)], args, deadline,
+                       random.Random(rng.random()))
+        for i in range(args.dashboards)
+    ]
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    recorder.recording = False
+
+    result = recorder.summary(elapsed)
+    result["elapsed_s"] = round(elapsed, 3)
+    # Server-side counters for the run (this worker only under multi-worker uvicorn)
+    result["server"] = {}
+    operator = {"X-Operator-Key": os.environ.get("GHOSTTRACK_OPERATOR_KEY", "")}
+    for name in ("ingest-stats", "pool-stats"):
+        response = await client.get(f"/api/__system__/{name}", headers=operator)
+        if response.status_code == 200:
+            result["server"][name] = response.json()
+    return result
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@asynccontextmanager
+async def in_process_client(args):
+    # The app reads its configuration at import time
+    from app.app import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            yield client
+
+
+@asynccontextmanager
+async def uvicorn_client(args):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        env=os.environ.copy(),
+    )
+    try:
+        async with remote_client(f"http://127.0.0.1:{port}", args) as client:
+            for _ in range(100):
+                try:
+                    await client.get("/api/__system__/pool-stats")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("uvicorn did not start")
+            yield client
+    finally:
+        server.terminate()
+        server.wait()
+
+
+@asynccontextmanager
+async def remote_client(url, args):
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        yield client
+
+
+def report(result):
+    print(f"{'endpoint':28} {'count':>8} {'errors':>7} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, stats in result["endpoints"].items():
+        print(
+            f"{name:28} {stats['count']:8} {stats['errors']:7} {stats['rps']:9.1f} {stats['p50_ms']:9.2f} "
+            f"{stats['p95_ms']:9.2f} {stats['p99_ms']:9.2f} {stats['max_ms']:9.2f}"
+        )
+    total = result["total"]
+    print(f"{'total':28} {total['count']:8} {total['errors']:7} {total['rps']:9.1f}")
+
+
+def compare(result, baseline, tolerance):
+    """Print changes against a saved baseline; returns the regressed endpoints"""
+    print(f"\nagainst {baseline.get('commit') or 'baseline'} ({baseline.get('timestamp')}):")
+    regressed = []
+    for name, stats in result["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if not before:
+            continue
+        p95_change = stats["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        rps_change = stats["rps"] / before["rps"] - 1 if before["rps"] else 0.0
+        worse = p95_change > tolerance or rps_change < -tolerance
+        if worse:
+            regressed.append(name)
+        print(
+            f"{name:28} p95 {before['p95_ms']:8.2f} -> {stats['p95_ms']:8.2f} ms ({p95_change:+.0%})  "
+            f"rps {before['rps']:8.1f} -> {stats['rps']:8.1f} ({rps_change:+.0%}){'  REGRESSED' if worse else ''}"
+        )
+    return regressed
+
+
+async def main(args):
+    if args.url:
+        client_context = remote_client(args.url, args)
+    elif args.server == "uvicorn":
+        client_context = uvicorn_client(args)
+    else:
+        client_context = in_process_client(args)
+
+    async with client_context as client:
+        result = await run_load(client, args)
+
+    result.update({
+        "timestamp": datetime.utcnow().isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+    })
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--dashboards", type=int, default=20)
+    parser.add_argument("--owners", type=int, default=20, help="accounts the devices are spread over")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of measured load")
+    parser.add_argument("--checkin-interval", type=float, default=1.0, help="seconds between device ticks")
+    parser.add_argument("--command-poll-ticks", type=int, default=5, help="poll device-commands every N ticks")
+    parser.add_argument("--dashboard-interval", type=float, default=2.0)
+    parser.add_argument("--photo-probability", type=float, default=0.01, help="chance of a photo upload per tick")
+    parser.add_argument("--photo-kb", type=int, default=32)
+    parser.add_argument("--stolen-fraction", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--server", choices=("inprocess", "uvicorn"), default="inprocess")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--url", help="load an already running server instead")
+    parser.add_argument("--connections", type=int, default=100, help="HTTP connection limit (uvicorn / --url)")
+    parser.add_argument("--output", help="save the results as a JSON baseline")
+    parser.add_argument("--compare", help="compare against a saved JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+    args.owners = max(1, min(args.owners, args.devices))
+
+    if not args.url:
+        # A fresh database and blob store per run, unless the caller chose one
+        scratch = tempfile.mkdtemp(prefix="ghosttrack-load-")
+        os.environ.setdefault("GHOSTTRACK_DB", os.path.join(scratch, "load.db"))
+        os.environ.setdefault("GHOSTTRACK_BLOB_DIR", os.path.join(scratch, "blobs"))
+        # The server-side stats endpoints are operator-only
+        os.environ.setdefault("GHOSTTRACK_OPERATOR_KEY", "bench")
+
+    result = asyncio.run(main(args))
+    report(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nsaved {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(result, baseline, args.tolerance):
+            sys.exit(1)
@@ -0,0 +1,93 @@
+"""Storage backend microbenchmark.
+
+Times the operations behind the hottest routes - check-in batches, history
+pages, last-known positions, command polling and ownership lookups -
+directly against each storage backend, without the HTTP stack. Comparing
+the SQLite numbers with the in-memory ones shows how much of a request's
+latency is storage; load-testing the app with ``GHOSTTRACK_STORAGE=memory``
+shows the rest.
+
+Run from the repository root:
+
+    python -m bench.storage [--devices 1000] [--fixes 50] [--iterations 2000]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from app.db import AsyncDatabase, ConnectionPool
+from app.storage import SQLiteStorage, MemoryStorage
+
+
+def fix_rows(devices, fixes):
+    start = datetime(2026, 1, 1)
+    return [
+        (f"hw{i}", 52.0 + n * 1e-4, 4.0 + i * 1e-4, (start + timedelta(minutes=n)).isoformat(), None)
+        for n in range(fixes) for i in range(devices)
+    ]
+
+
+async def seed(storage, devices, fixes):
+    for i in range(devices):
+        await storage.register_device(f"hw{i}", i % 100 + 1, "{}", "2026-01-01T00:00:00")
+    rows = fix_rows(devices, fixes)
+    for start in range(0, len(rows), 500):
+        await storage.add_stolen_fixes(rows[start:start + 500])
+    for i in range(0, devices, 10):
+        await storage.add_command(f"hw{i}", i % 100 + 1, "alarm", "{}", "2026-01-01T00:00:00")
+
+
+async def time_per_call(fn, iterations):
+    await fn()  # warm connections
+    start = time.perf_counter()
+    for i in range(iterations):
+        await fn(i)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def run(storage, devices, iterations):
+    batch = [(f"hw{i % devices}", 1.0, 2.0, "2026-02-01T00:00:00", None) for i in range(50)]
+    return {
+        "device_owner": await time_per_call(lambda i=0: storage.device_owner(f"hw{i % devices}"), iterations),
+        "latest_device_location": await time_per_call(
+            lambda i=0: storage.latest_device_location(f"hw{i % devices}"), iterations
+        ),
+        "stolen_fix_page (50)": await time_per_call(
+            lambda i=0: storage.stolen_fix_page(f"hw{i % devices}", 50), iterations
+        ),
+        "pending_commands": await time_per_call(lambda i=0: storage.pending_commands(f"hw{i % devices}"), iterations),
+        "add_stolen_fixes (50)": await time_per_call(lambda i=0: storage.add_stolen_fixes(batch), iterations // 10),
+    }
+
+
+async def main(devices, fixes, iterations):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    pool = ConnectionPool(path, size=4)
+    database = AsyncDatabase(pool)
+    backends = {"sqlite": SQLiteStorage(database), "memory": MemoryStorage()}
+
+    results = {}
+    for name, storage in backends.items():
+        await storage.open()
+        await seed(storage, devices, fixes)
+        results[name] = await run(storage, devices, iterations)
+
+    print(f"{devices} devices x {fixes} fixes, microseconds per call")
+    print(f"{'operation':26} {'sqlite':>10} {'memory':>10}")
+    for operation in results["sqlite"]:
+        print(f"{operation:26} {results['sqlite'][operation]:10.1f} {results['memory'][operation]:10.1f}")
+
+    for storage in backends.values():
+        await storage.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--fixes", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(main(args.devices, args.fixes, args.iterations))
@@ -0,0 +1,85 @@
+"""Trajectory simplification benchmark.
+
+Builds a synthetic day-long drive (1 Hz fixes with GPS jitter, stops and
+turns) and reports how many vertices the simplified track keeps at common
+map zoom levels, how long simplification takes, and the worst deviation of
+any raw fix from the simplified line, in units of the simplification
+tolerance (one pixel, or the GPS noise floor at high zoom).
+
+Run from the repository root:
+
+    python -m bench.track [--points 86400]
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.track import simplify_track, project, simplify_tolerance
+
+
+def synthetic_drive(n, seed=7):
+    rng = np.random.default_rng(seed)
+    # Piecewise-constant heading and speed, with stretches parked
+    heading = np.cumsum(rng.normal(0, 0.02, n) * (rng.random(n) < 0.05) * 40)
+    speed = np.repeat(rng.choice([0, 0, 8, 14, 25], size=n // 600 + 1), 600)[:n]
+    dx = np.cos(heading) * speed
+    dy = np.sin(heading) * speed
+    x = np.cumsum(dx) + rng.normal(0, 4, n)
+    y = np.cumsum(dy) + rng.normal(0, 4, n)
+    lat = 52.37 + y / 111_320
+    lng = 4.89 + x / (111_320 * np.cos(np.radians(52.37)))
+    start = datetime(2026, 1, 1)
+    return [
+        (float(a), float(o), (start + timedelta(seconds=i)).isoformat())
+        for i, (a, o) in enumerate(zip(lat, lng))
+    ]
+
+
+def max_deviation_px(rows, simplified, zoom):
+    """Largest distance of a raw fix from the simplified polyline, in tolerances"""
+    raw = project(np.array([r[0] for r in rows]), np.array([r[1] for r in rows]))
+    lat0 = np.array([r[0] for r in rows]).mean()
+    kept_ts = {p["timestamp"] for p in simplified}
+    kept_index = np.array([i for i, r in enumerate(rows) if r[2] in kept_ts])
+    worst = 0.0
+    for a, b in zip(kept_index[:-1], kept_index[1:]):
+        if b - a < 2:
+            continue
+        p0, p1 = raw[a], raw[b]
+        d = p1 - p0
+        seg = raw[a + 1:b] - p0
+        length = np.hypot(*d)
+        if length == 0:
+            dist = np.hypot(seg[:, 0], seg[:, 1])
+        else:
+            dist = np.abs(d[0] * seg[:, 1] - d[1] * seg[:, 0]) / length
+        worst = max(worst, float(dist.max()))
+    return worst / simplify_tolerance(zoom, lat0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--points", type=int, default=86400)
+    parser.add_argument("--resolution", type=int, default=0)
+    args = parser.parse_args()
+
+    rows = synthetic_drive(args.points)
+    raw_bytes = len(json.dumps([{"latitude": a, "longitude": o, "timestamp": t} for a, o, t in rows]))
+    print(f"raw track: {len(rows)} fixes, {raw_bytes / 1024:.0f} KiB JSON")
+    print(f"{'zoom':>4} {'points':>8} {'reduction':>10} {'KiB':>8} {'ms':>8} {'max dev':>8}")
+
+    for zoom in (10, 12, 14, 16, 18):
+        start = time.perf_counter()
+        simplified = simplify_track(rows, zoom, args.resolution)
+        elapsed = (time.perf_counter() - start) * 1000
+        size = len(json.dumps(simplified))
+        deviation = max_deviation_px(rows, simplified, zoom) if not args.resolution else float("nan")
+        print(f"{zoom:>4} {len(simplified):>8} {len(rows) / len(simplified):>9.0f}x "
+              f"{size / 1024:>8.1f} {elapsed:>8.1f} {deviation:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
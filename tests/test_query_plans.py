@@ -0,0 +1,46 @@
+"""The SQLite backend's request-path reads must be answered from an index.
+
+Runs ``EXPLAIN QUERY PLAN`` on the statements ``storage.py``,
+``partitions.py`` and ``maintenance.py`` execute, against a freshly
+migrated database - once on the legacy history tables and once on
+concrete monthly partitions created from their schemas.
+"""
+import sqlite3
+
+import pytest
+
+from app.migrations import explain, migrate, uses_index
+from app.partitions import location_partitions, stolen_location_partitions
+from app.storage import hot_queries
+
+MONTH = "2026-10"
+
+
+@pytest.fixture(scope="module")
+def conn(tmp_path_factory):
+    conn = sqlite3.connect(tmp_path_factory.mktemp("plans") / "plans.db")
+    conn.row_factory = sqlite3.Row
+    migrate(conn)
+    for table in (location_partitions, stolen_location_partitions):
+        table.ensure(conn, table.partition_name(MONTH), MONTH)
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+TABLES = {
+    "legacy": ("stolen_device_locations", "locations"),
+    "partition": (stolen_location_partitions.partition_name(MONTH), location_partitions.partition_name(MONTH)),
+}
+CASES = [
+    (tables, name)
+    for tables in TABLES
+    for name in hot_queries(*TABLES[tables])
+]
+
+
+@pytest.mark.parametrize("tables,name", CASES, ids=[f"{tables}-{name}" for tables, name in CASES])
+def test_hot_query_uses_index(conn, tables, name):
+    sql, params = hot_queries(*TABLES[tables])[name]
+    plan = explain(conn, sql, params)
+    assert uses_index(plan), f"{name} is not answered from an index: {plan}"